@@ -1,12 +1,392 @@
 import tkinter as tk
-from tkinter import ttk, messagebox, scrolledtext
-import json
+from tkinter import ttk, messagebox, scrolledtext, filedialog
 import os
-from datetime import datetime
-import re
+import queue
+import threading
+import time
+from snippet_core import (SnippetLibrary, BackgroundIO, IncrementalSearch, InotifyWatcher,
+                          Highlighter, DUPLICATE_THRESHOLD, PACK_EXTENSION, metrics)
+from snippet_core.highlight import KINDS
+
+class SnippetCard(tk.Frame):
+    """A reusable snippet card; show() points it at a different snippet"""
+    
+    def __init__(self, parent, app, on_scroll):
+        super().__init__(parent, bg=app.bg_secondary, cursor="hand2")
+        metrics.count("widgets.cards")
+        self.app = app
+        self.snippet = None
+        self.index = None
+        
+        # Header with language badge and file extension
+        self.header = tk.Frame(self, bg=app.bg_secondary)
+        self.header.pack(fill=tk.X, padx=20, pady=(15, 10))
+        
+        self.lang_badge = tk.Label(self.header, bg=app.accent, fg=app.bg_dark,
+                                   font=("Segoe UI", 9, "bold"),
+                                   padx=10, pady=3)
+        self.lang_badge.pack(side=tk.LEFT)
+        
+        # Show file extension
+        self.ext_label = tk.Label(self.header, bg=app.bg_tertiary, fg=app.success,
+                                  font=("Consolas", 9, "bold"),
+                                  padx=8, pady=3)
+        self.ext_label.pack(side=tk.LEFT, padx=(5, 0))
+        
+        self.date_label = tk.Label(self.header, bg=app.bg_secondary, fg=app.text_secondary,
+                                   font=("Segoe UI", 8))
+        self.date_label.pack(side=tk.RIGHT)
+        
+        # Title with filename
+        self.title = tk.Label(self, bg=app.bg_secondary, fg=app.text_primary,
+                              font=("Segoe UI", 16, "bold"),
+                              anchor=tk.W, wraplength=250)
+        self.title.pack(fill=tk.X, padx=20, pady=(5, 5))
+        
+        # Show actual filename
+        self.filename_label = tk.Label(self, bg=app.bg_secondary, fg=app.text_secondary,
+                                       font=("Consolas", 9),
+                                       anchor=tk.W)
+        self.filename_label.pack(fill=tk.X, padx=20, pady=(0, 10))
+        
+        # Code preview
+        self.code_label = tk.Label(self, bg=app.bg_tertiary, fg=app.text_secondary,
+                                   font=("Consolas", 9),
+                                   anchor=tk.W, justify=tk.LEFT,
+                                   wraplength=250, height=4)
+        self.code_label.pack(fill=tk.X, padx=20, pady=(0, 10))
+        
+        # Tags preview
+        self.tags_label = tk.Label(self, bg=app.bg_secondary, fg=app.accent,
+                                   font=("Segoe UI", 9),
+                                   anchor=tk.W)
+        self.tags_label.pack(fill=tk.X, padx=20, pady=(0, 15))
+        
+        # Hover effect and click, bound once for the lifetime of the card
+        self.hover_widgets = [self, self.header, self.title, self.filename_label,
+                              self.tags_label, self.date_label]
+        for widget in [self, self.header, self.title, self.filename_label, self.code_label,
+                       self.lang_badge, self.ext_label, self.date_label, self.tags_label]:
+            widget.bind("<Enter>", lambda e: self.set_background(app.bg_tertiary))
+            widget.bind("<Leave>", lambda e: self.set_background(app.bg_secondary))
+            widget.bind("<Button-1>", self.on_click)
+            for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+                widget.bind(sequence, on_scroll)
+    
+    def set_background(self, color):
+        for widget in self.hover_widgets:
+            widget.config(bg=color)
+    
+    def on_click(self, event):
+        if self.snippet is not None:
+            self.app.show_editor_page(self.snippet)
+    
+    def show(self, snippet):
+        metrics.count("widgets.card_binds")
+        self.snippet = snippet
+        self.lang_badge.config(text=snippet.get('language', 'Unknown'))
+        self.ext_label.config(text=snippet.get('extension', ''))
+        self.date_label.config(text=(snippet.get('created') or '').split(' ')[0])
+        self.title.config(text=snippet.get('title', 'Untitled'))
+        self.filename_label.config(text=f"📄 {snippet.get('filename', 'N/A')}")
+        self.code_label.config(text=snippet.get('code_preview', 'No preview'))
+        
+        tags_text = ""
+        if snippet.get('tags'):
+            tags_text = " ".join([f"#{tag}" for tag in snippet['tags'][:3]])
+            if len(snippet['tags']) > 3:
+                tags_text += f" +{len(snippet['tags']) - 3}"
+        self.tags_label.config(text=tags_text)
+        self.set_background(self.app.bg_secondary)
+
+
+class VirtualCardGrid:
+    """Scrollable card grid that only builds cards for the rows on screen.
+    
+    Cards live in a fixed pool sized to the viewport and are recycled as
+    the canvas scrolls, so drawing cost depends on the window size rather
+    than on the number of snippets.
+    """
+    
+    columns = 3
+    card_height = 250
+    min_card_width = 300
+    padding = 15
+    overscan_rows = 1
+    
+    def __init__(self, app, parent):
+        self.app = app
+        self.items = []
+        self.pool = []          # [(card, canvas window id)]
+        self.layout_key = None
+        
+        self.canvas = tk.Canvas(parent, bg=app.bg_dark, highlightthickness=0)
+        self.scrollbar = tk.Scrollbar(parent, orient=tk.VERTICAL, command=self.yview,
+                                      bg=app.bg_tertiary)
+        self.canvas.configure(yscrollcommand=self.scrollbar.set)
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        self.empty_frame = self.create_empty_state()
+        self.empty_window = self.canvas.create_window(0, 0, window=self.empty_frame,
+                                                      anchor=tk.N, state=tk.HIDDEN)
+        
+        self.canvas.bind('<Configure>', lambda e: self.refresh())
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.canvas.bind(sequence, self.on_mousewheel)
+    
+    def create_empty_state(self):
+        app = self.app
+        empty_frame = tk.Frame(self.canvas, bg=app.bg_dark)
+        
+        # Big emoji
+        tk.Label(empty_frame, text="📂", font=("Segoe UI", 80),
+                 bg=app.bg_dark, fg=app.text_secondary).pack(pady=(150, 0))
+        
+        tk.Label(empty_frame, text="No snippets yet!",
+                 font=("Segoe UI", 24, "bold"),
+                 bg=app.bg_dark, fg=app.text_primary).pack(pady=(20, 10))
+        
+        tk.Label(empty_frame,
+                 text="Click '✨ New Snippet' above to create your first code file",
+                 font=("Segoe UI", 14),
+                 bg=app.bg_dark, fg=app.text_secondary).pack()
+        return empty_frame
+    
+    def set_items(self, items):
+        self.items = items
+        for card, window in self.pool:
+            card.index = None
+        self.canvas.yview_moveto(0)
+        self.refresh()
+    
+    def replace_items(self, items):
+        """Show a new list of the same items without moving the view"""
+        self.items = items
+        for card, window in self.pool:
+            card.index = None
+        self.refresh()
+    
+    def append_items(self, items):
+        """Add items after the current ones without moving the view"""
+        self.items.extend(items)
+        self.refresh()
+    
+    def yview(self, *args):
+        self.canvas.yview(*args)
+        self.refresh()
+    
+    def on_mousewheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            self.canvas.yview_scroll(-1, "units")
+        else:
+            self.canvas.yview_scroll(1, "units")
+        self.refresh()
+    
+    @metrics.timed("render.grid")
+    def refresh(self):
+        width = max(self.canvas.winfo_width(), 1)
+        height = max(self.canvas.winfo_height(), 1)
+        column_width = max(width // self.columns, self.min_card_width + 2 * self.padding)
+        row_height = self.card_height + 2 * self.padding
+        rows = -(-len(self.items) // self.columns)
+        
+        self.canvas.configure(scrollregion=(0, 0, column_width * self.columns,
+                                            max(rows * row_height, height)))
+        self.canvas.configure(yscrollincrement=row_height // 4)
+        
+        if not self.items:
+            self.canvas.coords(self.empty_window, width // 2, 0)
+            self.canvas.itemconfigure(self.empty_window, state=tk.NORMAL)
+            for card, window in self.pool:
+                self.canvas.itemconfigure(window, state=tk.HIDDEN)
+            return
+        self.canvas.itemconfigure(self.empty_window, state=tk.HIDDEN)
+        
+        # Rows in (or just around) the viewport
+        top = self.canvas.canvasy(0)
+        first_row = max(0, int(top // row_height) - self.overscan_rows)
+        last_row = min(rows, int((top + height) // row_height) + 1 + self.overscan_rows)
+        
+        # The pool covers the largest number of rows that can ever be visible
+        pool_size = (height // row_height + 2 + 2 * self.overscan_rows) * self.columns
+        while len(self.pool) < pool_size:
+            card = SnippetCard(self.canvas, self.app, self.on_mousewheel)
+            window = self.canvas.create_window(0, 0, window=card, anchor=tk.NW,
+                                               state=tk.HIDDEN)
+            self.pool.append((card, window))
+        
+        # Re-position cards when the column width changes
+        layout_key = (column_width, len(self.pool))
+        relayout = layout_key != self.layout_key
+        self.layout_key = layout_key
+        
+        first = first_row * self.columns
+        last = min(len(self.items), last_row * self.columns)
+        in_use = set()
+        for index in range(first, last):
+            # Each index maps to a fixed pool slot, so scrolling one row
+            # only rebinds the cards of the row that came into view
+            slot = index % len(self.pool)
+            in_use.add(slot)
+            card, window = self.pool[slot]
+            if card.index == index and not relayout:
+                continue
+            card.index = index
+            card.show(self.items[index])
+            row, col = divmod(index, self.columns)
+            self.canvas.coords(window, col * column_width + self.padding,
+                               row * row_height + self.padding)
+            self.canvas.itemconfigure(window, state=tk.NORMAL,
+                                      width=column_width - 2 * self.padding,
+                                      height=self.card_height)
+        
+        for slot, (card, window) in enumerate(self.pool):
+            if slot not in in_use:
+                card.index = None
+                self.canvas.itemconfigure(window, state=tk.HIDDEN)
+
+
+class CodeHighlighter:
+    """Syntax colors for the code editor, kept current as the text changes.
+    
+    Every insert and delete passes through on_command (it stands in for
+    the Text widget's Tcl command), which tells the Highlighter which
+    lines changed. Once Tk is idle, only the lines in view are re-tagged,
+    so a keystroke costs the same in a ten-line snippet as in a large file.
+    """
+    
+    colors = {
+        "keyword": "#cba6f7",
+        "constant": "#fab387",
+        "string": "#a6e3a1",
+        "comment": "#7f849c",
+        "number": "#fab387",
+        "decorator": "#f9e2af",
+    }
+    
+    def __init__(self, text, language, on_change=None):
+        self.text = text
+        self.highlighter = Highlighter(language)
+        self.after_id = None
+        self.on_change = on_change    # called after every edit
+        for kind in KINDS:
+            text.tag_configure("hl_" + kind, foreground=self.colors[kind])
+        text.tag_raise("sel")
+        
+        # Put on_command in place of the widget command; tkinter deletes it with the widget
+        self.widget_command = text._w + "_widget"
+        text.tk.call("rename", text._w, self.widget_command)
+        text.tk.createcommand(text._w, self.on_command)
+        text._tclCommands = (text._tclCommands or []) + [text._w]
+    
+    def call(self, *args):
+        return self.text.tk.call(self.widget_command, *args)
+    
+    def line_of(self, index):
+        """0-based line of an index, clamped to the text like Tk does for edits"""
+        index = self.call("index", index)
+        if self.call("compare", index, ">", "end-1c"):
+            index = self.call("index", "end-1c")
+        return int(str(index).split(".")[0]) - 1
+    
+    def on_command(self, *args):
+        operation = args[0] if args else ""
+        if operation not in ("insert", "delete", "replace"):
+            try:
+                return self.call(*args)
+            except tk.TclError:
+                # As idlelib's WidgetRedirector: an exception here would end mainloop
+                return ""
+        try:
+            change = self.change_of(operation, args)
+        except tk.TclError:
+            change = None
+        try:
+            result = self.call(*args)
+        except tk.TclError:
+            # The text is unchanged, so there is nothing to re-highlight
+            return ""
+        if change is None:
+            # Edited somewhere the indexes didn't tell us: re-highlight everything
+            self.highlighter.reset()
+        else:
+            self.highlighter.lines_changed(*change)
+        self.schedule()
+        if self.on_change is not None:
+            self.on_change()
+        return result
+    
+    def change_of(self, operation, args):
+        """(first line, lines before, lines after) that an edit command touches"""
+        if len(args) < {"insert": 3, "delete": 2, "replace": 4}[operation]:
+            return None         # The command fails too, changing nothing
+        if operation == "insert":
+            inserted = "".join(args[2::2])
+            return (self.line_of(args[1]), 1, inserted.count("\n") + 1)
+        if operation == "delete":
+            lines = [self.line_of(index) for index in args[1:]]
+            if len(args) == 2:
+                lines.append(self.line_of(args[1] + "+1c"))
+            return (min(lines), max(lines) - min(lines) + 1, 1)
+        first, last = self.line_of(args[1]), self.line_of(args[2])
+        inserted = "".join(args[3::2])
+        return (first, last - first + 1, inserted.count("\n") + 1)
+    
+    def set_language(self, language):
+        if language != self.highlighter.language:
+            self.highlighter.set_language(language)
+            self.schedule()
+    
+    def schedule(self):
+        """Repaint once Tk is idle; any number of edits and scrolls before then share it"""
+        if self.after_id is None:
+            self.after_id = self.text.after_idle(self.repaint)
+    
+    def get_lines(self, first, last):
+        last = min(last, self.line_of("end-1c") + 1)
+        if first >= last:
+            return []
+        return self.call("get", f"{first + 1}.0", f"{last}.end").split("\n")
+    
+    def repaint(self):
+        """Re-tag the lines in view"""
+        self.after_id = None
+        if not self.text.winfo_exists():
+            return
+        with metrics.span("highlight.repaint"):
+            top = self.line_of("@0,0")
+            bottom = self.line_of(f"@0,{self.text.winfo_height()}") + 1
+            ranges = {kind: [] for kind in KINDS}
+            for line, tokens in self.highlighter.highlight(top, bottom, self.get_lines):
+                for kind, start, end in tokens:
+                    ranges[kind] += (f"{line + 1}.{start}", f"{line + 1}.{end}")
+            for kind, indexes in ranges.items():
+                self.call("tag", "remove", "hl_" + kind, f"{top + 1}.0", f"{bottom}.end")
+                if indexes:
+                    self.call("tag", "add", "hl_" + kind, *indexes)
+
 
 class CodeSnippetManager:
-    def __init__(self, root):
+    search_delay = 120      # ms without typing before a search runs
+    tags_delay = 400        # ms without editing before the tags are refreshed
+    result_batch = 60       # cards handed to the grid per step
+    
+    # Home page order: sort menu label -> (sort key, newest/largest first).
+    # "Best match" ranks search results, and lists the library as stored otherwise
+    best_match = "Best match"
+    sort_options = {
+        "Newest first": ("created", True),
+        "Oldest first": ("created", False),
+        "Recently modified": ("modified", True),
+        "Title A-Z": ("title", False),
+        "Language": ("language", False),
+    }
+    all_languages = "All languages"
+    all_tags = "All tags"
+    facet_limit = 50        # most used tags offered in the tag filter
+    
+    def __init__(self, root, storage_backend="sqlite", watch=True):
         self.root = root
         self.root.title("AI Code Snippet Manager")
         self.root.geometry("1200x700")
@@ -25,79 +405,165 @@ class CodeSnippetManager:
         
         self.root.configure(bg=self.bg_dark)
         
-        # File extensions mapping
-        self.language_extensions = {
-            "Python": ".py",
-            "JavaScript": ".js",
-            "Java": ".java",
-            "C++": ".cpp",
-            "HTML": ".html",
-            "CSS": ".css",
-            "SQL": ".sql",
-            "Ruby": ".rb",
-            "Go": ".go",
-            "Rust": ".rs",
-            "TypeScript": ".ts",
-            "PHP": ".php",
-            "C": ".c",
-            "C#": ".cs",
-            "Swift": ".swift",
-            "Kotlin": ".kt",
-            "Other": ".txt"
-        }
-        
-        # Create base directory for snippets
+        # All storage, search and tagging goes through the headless core library
+        # (SQLite metadata by default, migrates snippets_metadata.json on first run)
         self.base_dir = "Code_Snippets"
-        if not os.path.exists(self.base_dir):
-            os.makedirs(self.base_dir)
-        
-        # Metadata file
-        self.metadata_file = os.path.join(self.base_dir, "snippets_metadata.json")
-        self.snippets = self.load_snippets()
+        # File and metadata writes run on a worker thread so the window never freezes
+        self.io = BackgroundIO()
+        self.io.on_error = lambda e: messagebox.showerror("Error", f"Background write failed: {str(e)}")
+        # The metadata and search index load on the worker; until then the home
+        # page shows the cards saved at the last exit (startup_snapshot.bin)
+        self.library = SnippetLibrary(self.base_dir, storage_backend, io=self.io, load=False)
+        self.language_extensions = self.library.language_extensions
+        self.snapshot = self.library.open_snapshot()
+        
+        self.search_session = None
+        self.search_after_id = None
+        self.search_generation = 0
+        self.tags_after_id = None
+        self.tags_generation = 0
+        self.removed_tags = set()     # tags the user took off; live tagging leaves them off
+        self.tags_stale = False       # edited since the tags shown were generated
+        self.tag_saves = {}           # snippet id -> (token, modified) of a save awaiting tags
+        self.browse_sort = self.best_match
+        self.browse_language = None
+        self.browse_tag = None
         self.current_snippet = None
+        self.large_file = None
+        self.diagnostics = None
+        self.profile_output = ""
         
         # Container for switching views
         self.container = tk.Frame(self.root, bg=self.bg_dark)
         self.container.pack(fill=tk.BOTH, expand=True)
         
-        self.show_home_page()
+        self.import_job = None
         
-    def load_snippets(self):
-        if os.path.exists(self.metadata_file):
-            with open(self.metadata_file, 'r') as f:
-                return json.load(f)
-        return []
-    
-    def save_metadata(self):
-        with open(self.metadata_file, 'w') as f:
-            json.dump(self.snippets, f, indent=2)
-    
-    def get_language_folder(self, language):
-        """Get or create folder for specific language"""
-        folder = os.path.join(self.base_dir, language)
-        if not os.path.exists(folder):
-            os.makedirs(folder)
-        return folder
-    
-    def sanitize_filename(self, title):
-        """Convert title to valid filename"""
-        # Remove invalid characters
-        valid = re.sub(r'[<>:"/\\|?*]', '', title)
-        # Replace spaces with underscores
-        valid = valid.replace(' ', '_')
-        return valid if valid else "untitled"
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.bind("<F12>", self.show_diagnostics)
+        self.show_home_page()
+        self.process_io()
+        
+        self.watch = watch
+        self.watcher = None
+        self.reconcile_waiting = False    # outside changes still settling
+        self.reconcile_running = False
+        self.reconcile_failed = False
+        self.merge_running = False
+        self.library.load_in_background(self.on_library_loaded)
+        
+    @property
+    def snippets(self):
+        return self.library.snippets
+    
+    def on_library_loaded(self, library):
+        """Swap the snapshot cards for the real snippets and start background services"""
+        self.search_session = IncrementalSearch(self.library.search_index, self.library.fuzzy_index)
+        self.library.collect_history()
+        self.set_import_status("")
+        if self.card_grid.canvas.winfo_exists():
+            if self.home_search_var.get().strip():
+                self.filter_home_snippets()
+            else:
+                self.card_grid.replace_items(self.browse())
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
+        
+        # Near-duplicate detection builds its index without blocking startup
+        self.library.warm_similarity_index()
+        
+        # Pick up files edited, added or deleted outside the app, then keep
+        # watching the folder where the system supports it, and keep merging
+        # what other processes sharing the library save
+        self.root.after_idle(self.reconcile_files)
+        if self.watch and InotifyWatcher.available():
+            self.watcher = InotifyWatcher(self.base_dir)
+        self.root.after(1000, self.poll_changes)
+    
+    def wait_until_loaded(self):
+        """Block until the background load has finished; for actions that need the library"""
+        if not self.library.loaded:
+            self.library.wait_for_io()
+    
+    def on_close(self):
+        metrics.stop_sampling()
+        self.wait_until_loaded()
+        if self.watcher:
+            self.watcher.close()
+        self.library.close()
+        self.root.destroy()
+    
+    def reconcile_files(self, paths=None):
+        """Check outside changes on the I/O worker; on_files_reconciled applies them"""
+        self.reconcile_running = True
+        self.library.reconcile(paths, on_done=self.on_files_reconciled,
+                               on_error=self.on_reconcile_failed)
+    
+    def on_files_reconciled(self, result):
+        self.reconcile_running = False
+        self.reconcile_waiting = bool(result.waiting)
+        if result:
+            metrics.count("reconcile.added", len(result.added))
+            metrics.count("reconcile.updated", len(result.updated))
+            metrics.count("reconcile.removed", len(result.removed))
+            self.refresh_home()
+    
+    def on_reconcile_failed(self, error):
+        # The paths it was given are lost, so the next poll checks everything
+        self.reconcile_running = False
+        self.reconcile_failed = True
+        metrics.count("reconcile.failed")
+    
+    def refresh_home(self):
+        # Refresh the home page, but never pull an open editor away
+        if self.card_grid.canvas.winfo_exists():
+            self.search_session.reset()
+            self.filter_home_snippets()
+    
+    def poll_changes(self):
+        """Once a second: merge other processes' saves and check changed files"""
+        if not self.merge_running:
+            self.merge_running = True
+            self.library.merge_changes(on_done=self.on_changes_merged,
+                                       on_error=self.on_merge_failed)
+        # Changes seen while a pass runs stay with the watcher for the next one
+        if not self.reconcile_running:
+            changed = self.watcher.drain() if self.watcher else []
+            # None means events were lost; fall back to checking every file
+            if self.reconcile_failed:
+                changed, self.reconcile_failed = None, False
+            if changed is None or changed or self.reconcile_waiting:
+                self.reconcile_files(changed)
+        self.root.after(1000, self.poll_changes)
+    
+    def on_changes_merged(self, result):
+        self.merge_running = False
+        if result:
+            self.refresh_home()
+    
+    def on_merge_failed(self, error):
+        # Storage busy or unreadable for a moment; the next poll tries again
+        self.merge_running = False
+        metrics.count("merge.failed")
+    
+    def process_io(self):
+        """Hand finished background work to its callbacks on the Tk thread"""
+        self.io.process_completions()
+        self.root.after(50, self.process_io)
     
     def clear_container(self):
+        self.close_large_file()
+        self.cancel_live_tags()
         for widget in self.container.winfo_children():
             widget.destroy()
     
+    @metrics.timed("render.home")
     def show_home_page(self):
         self.clear_container()
         self.current_snippet = None
         
-        # Reload snippets from file to get latest
-        self.snippets = self.load_snippets()
-        print(f"📊 Loading home page with {len(self.snippets)} snippets")  # Debug
+        # The library's in-memory snippets are always current; writes may still be queued
         
         # Main home container
         home_frame = tk.Frame(self.container, bg=self.bg_dark)
@@ -130,7 +596,7 @@ class CodeSnippetManager:
         search_icon.pack(side=tk.LEFT, padx=(15, 10))
         
         self.home_search_var = tk.StringVar()
-        self.home_search_var.trace('w', lambda *args: self.filter_home_snippets())
+        self.home_search_var.trace('w', lambda *args: self.schedule_search())
         search_entry = tk.Entry(search_container, textvariable=self.home_search_var,
                                bg=self.bg_secondary, fg=self.text_primary,
                                relief=tk.FLAT, font=("Segoe UI", 14),
@@ -148,196 +614,295 @@ class CodeSnippetManager:
                            activeforeground=self.bg_dark)
         new_btn.pack(side=tk.LEFT)
         
+        # Import an existing code tree
+        import_btn = tk.Button(search_frame, text="📥 Import Folder",
+                              command=self.import_folder,
+                              bg=self.bg_tertiary, fg=self.text_primary,
+                              relief=tk.FLAT, font=("Segoe UI", 14, "bold"),
+                              cursor="hand2", padx=30, pady=12,
+                              activebackground=self.bg_secondary,
+                              activeforeground=self.text_primary)
+        import_btn.pack(side=tk.LEFT, padx=(15, 0))
+        
+        # The whole library as one compressed file, for backups and moving
+        pack_btn = tk.Button(search_frame, text="📦 Pack",
+                            bg=self.bg_tertiary, fg=self.text_primary,
+                            relief=tk.FLAT, font=("Segoe UI", 14, "bold"),
+                            cursor="hand2", padx=30, pady=12,
+                            activebackground=self.bg_secondary,
+                            activeforeground=self.text_primary)
+        pack_btn.configure(command=lambda: self.show_pack_menu(pack_btn))
+        pack_btn.pack(side=tk.LEFT, padx=(15, 0))
+        
+        # Sort order and language/tag filters; the menus are filled when opened
+        browse_frame = tk.Frame(home_frame, bg=self.bg_dark)
+        browse_frame.pack(pady=(0, 15))
+        
+        self.sort_var = tk.StringVar(value=self.browse_sort)
+        self.language_filter_var = tk.StringVar(value=self.browse_language or self.all_languages)
+        self.tag_filter_var = tk.StringVar(value=self.browse_tag or self.all_tags)
+        self.language_choices = {}
+        self.tag_choices = {}
+        combos = []
+        for label, variable, width in (("Sort", self.sort_var, 18),
+                                       ("Language", self.language_filter_var, 22),
+                                       ("Tag", self.tag_filter_var, 22)):
+            tk.Label(browse_frame, text=label, bg=self.bg_dark, fg=self.text_secondary,
+                    font=("Segoe UI", 10)).pack(side=tk.LEFT, padx=(15, 6))
+            combo = ttk.Combobox(browse_frame, textvariable=variable, state="readonly",
+                                 width=width, font=("Segoe UI", 10),
+                                 postcommand=self.update_facets)
+            combo.pack(side=tk.LEFT)
+            combo.bind("<<ComboboxSelected>>", self.on_browse_change)
+            combos.append(combo)
+        self.sort_combo, self.language_combo, self.tag_combo = combos
+        self.sort_combo.configure(values=[self.best_match] + list(self.sort_options))
+        
+        self.import_status = tk.Label(home_frame, text="",
+                                      bg=self.bg_dark, fg=self.success,
+                                      font=("Segoe UI", 11))
+        self.import_status.pack(pady=(0, 10))
+        if not self.library.loaded:
+            self.set_import_status("⏳ Loading snippets...")
+        
         # Snippets grid container
         snippets_container = tk.Frame(home_frame, bg=self.bg_dark)
         snippets_container.pack(fill=tk.BOTH, expand=True, padx=60, pady=(0, 40))
         
-        # Canvas for scrolling
-        canvas = tk.Canvas(snippets_container, bg=self.bg_dark, highlightthickness=0)
-        scrollbar = tk.Scrollbar(snippets_container, orient=tk.VERTICAL, command=canvas.yview,
-                                bg=self.bg_tertiary)
-        
-        self.snippets_grid_frame = tk.Frame(canvas, bg=self.bg_dark)
-        
-        canvas.create_window((0, 0), window=self.snippets_grid_frame, anchor=tk.NW)
-        canvas.configure(yscrollcommand=scrollbar.set)
-        
-        canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        
-        self.snippets_grid_frame.bind('<Configure>', 
-                                     lambda e: canvas.configure(scrollregion=canvas.bbox("all")))
-        
-        # Mouse wheel binding - fix for when switching pages
-        def on_mousewheel(event):
-            try:
-                canvas.yview_scroll(int(-1*(event.delta/120)), "units")
-            except:
-                pass
-        
-        canvas.bind("<MouseWheel>", on_mousewheel)
-        self.snippets_grid_frame.bind("<MouseWheel>", on_mousewheel)
+        # Virtualized grid: only the cards on screen are built
+        self.card_grid = VirtualCardGrid(self, snippets_container)
         
+        # Snippets may have changed since the last search
+        if self.search_session is not None:
+            self.search_session.reset()
         self.display_snippet_cards()
     
     def display_snippet_cards(self, filtered_snippets=None):
-        for widget in self.snippets_grid_frame.winfo_children():
-            widget.destroy()
-        
-        snippets_to_show = filtered_snippets if filtered_snippets is not None else self.snippets
-        
-        print(f"🎨 Displaying {len(snippets_to_show)} snippet cards")  # Debug
-        
-        if not snippets_to_show:
-            empty_frame = tk.Frame(self.snippets_grid_frame, bg=self.bg_dark)
-            empty_frame.pack(expand=True, pady=150)
-            
-            # Big emoji
-            emoji_label = tk.Label(empty_frame, text="📂", 
-                                  font=("Segoe UI", 80),
-                                  bg=self.bg_dark, fg=self.text_secondary)
-            emoji_label.pack()
-            
-            empty_label = tk.Label(empty_frame, 
-                                  text="No snippets yet!",
-                                  font=("Segoe UI", 24, "bold"),
-                                  bg=self.bg_dark, fg=self.text_primary)
-            empty_label.pack(pady=(20, 10))
-            
-            empty_sub = tk.Label(empty_frame, 
-                                text="Click '✨ New Snippet' above to create your first code file",
-                                font=("Segoe UI", 14),
-                                bg=self.bg_dark, fg=self.text_secondary)
-            empty_sub.pack()
+        if filtered_snippets is not None:
+            snippets_to_show = filtered_snippets
+        elif self.library.loaded:
+            snippets_to_show = self.browse()
+        else:
+            # Still loading: records are decoded from the snapshot as cards scroll into view
+            snippets_to_show = self.snapshot or []
+        self.card_grid.set_items(snippets_to_show)
+    
+    def browse(self, within=None):
+        """The library (or the snippets with ids in within) in the chosen order and filters"""
+        filtered = self.browse_language is not None or self.browse_tag is not None
+        if self.browse_sort not in self.sort_options and not filtered and within is None:
+            return self.snippets
+        sort, descending = self.sort_options.get(self.browse_sort, ("created", False))
+        return self.library.browse(sort, descending, self.browse_language, self.browse_tag, within)
+    
+    def update_facets(self):
+        """Fill the filter menus with current counts from the library's browse index"""
+        if not self.library.loaded:
+            return
+        language_counts, tag_counts = self.library.facets(self.browse_language)
+        self.language_choices = {self.all_languages: None}
+        for language, count in sorted(language_counts.items()):
+            self.language_choices[f"{language} ({count})"] = language
+        self.tag_choices = {self.all_tags: None}
+        for tag, count in tag_counts.most_common(self.facet_limit):
+            self.tag_choices[f"{tag} ({count})"] = tag
+        if self.browse_tag is not None and self.browse_tag not in self.tag_choices.values():
+            self.tag_choices[f"{self.browse_tag} ({tag_counts.get(self.browse_tag, 0)})"] = self.browse_tag
+        self.language_combo.configure(values=list(self.language_choices))
+        self.tag_combo.configure(values=list(self.tag_choices))
+    
+    def on_browse_change(self, event=None):
+        self.browse_sort = self.sort_var.get()
+        self.browse_language = self.language_choices.get(self.language_filter_var.get())
+        self.browse_tag = self.tag_choices.get(self.tag_filter_var.get())
+        if self.search_after_id is not None:
+            self.root.after_cancel(self.search_after_id)
+        self.search_generation += 1
+        self.filter_home_snippets()
+    
+    def schedule_search(self):
+        """Debounce typing: search once the user pauses"""
+        if self.search_after_id is not None:
+            self.root.after_cancel(self.search_after_id)
+        # Stop streaming the results of an older query
+        self.search_generation += 1
+        self.search_after_id = self.root.after(self.search_delay, self.filter_home_snippets)
+    
+    def filter_home_snippets(self):
+        self.search_after_id = None
+        if self.search_session is None:
+            # Runs again once loading has finished
+            return
+        query = self.home_search_var.get()
+        if not query.strip():
+            self.search_session.reset()
+            self.display_snippet_cards()
             return
         
-        # Create grid of cards (3 columns)
-        for idx, snippet in enumerate(snippets_to_show):
-            row = idx // 3
-            col = idx % 3
-            
-            card = self.create_snippet_card(self.snippets_grid_frame, snippet)
-            card.grid(row=row, column=col, padx=15, pady=15, sticky=tk.NSEW)
-        
-        # Configure grid weights
-        for i in range(3):
-            self.snippets_grid_frame.columnconfigure(i, weight=1, minsize=300)
+        # Only the first batch is ranked now; the word being typed is matched
+        # as a prefix, and a query that extends the previous one only
+        # searches its results
+        with metrics.span("search.keystroke"):
+            results = self.search_session.search(query, limit=self.result_batch)
+        if self.browse_sort in self.sort_options:
+            # Sorted rather than ranked: the browse index orders the matches
+            within = self.search_session.matched | {doc_id for doc_id, score in results}
+            self.card_grid.set_items(self.browse(within=within))
+            return
+        allowed = self.library.facet_ids(self.browse_language, self.browse_tag)
+        if allowed is not None:
+            results = [result for result in results if result[0] in allowed]
+        self.stream_results(results, 0, self.search_generation)
+        if len(self.search_session.matched) > self.result_batch or allowed is not None:
+            # The rest once pending keystrokes are in; a newer query drops it
+            self.root.after(1, self.rank_remaining, query, len(results), self.search_generation)
+    
+    def rank_remaining(self, query, start, generation):
+        """Rank every match of a query and stream those after the first batch"""
+        if generation != self.search_generation:
+            return
+        with metrics.span("search.remaining"):
+            results = self.search_session.search(query)
+        allowed = self.library.facet_ids(self.browse_language, self.browse_tag)
+        if allowed is not None:
+            results = [result for result in results if result[0] in allowed]
+        if start < len(results):
+            self.stream_results(results, start, generation)
+    
+    def stream_results(self, results, start, generation):
+        """Hand ranked results to the grid in batches, best first"""
+        if generation != self.search_generation or not self.card_grid.canvas.winfo_exists():
+            return
+        by_id = self.library.by_id
+        batch = [by_id[doc_id] for doc_id, score in results[start:start + self.result_batch]
+                 if doc_id in by_id]
+        if start == 0:
+            self.card_grid.set_items(batch)
+        else:
+            self.card_grid.append_items(batch)
+        start += self.result_batch
+        if start < len(results):
+            # Let pending keystrokes in before the next batch
+            self.root.after(1, self.stream_results, results, start, generation)
     
-    def create_snippet_card(self, parent, snippet):
-        print(f"🎴 Creating card for: {snippet.get('title', 'Unknown')}")  # Debug
+    def import_folder(self):
+        self.wait_until_loaded()
+        if self.import_job is not None:
+            messagebox.showinfo("Import", "An import is already running.")
+            return
         
-        card = tk.Frame(parent, bg=self.bg_secondary, cursor="hand2", width=350, height=250)
-        card.grid_propagate(False)
+        source_dir = filedialog.askdirectory(title="Import code from folder")
+        if not source_dir:
+            return
         
-        # Header with language badge and file extension
-        header = tk.Frame(card, bg=self.bg_secondary)
-        header.pack(fill=tk.X, padx=20, pady=(15, 10))
+        importer = self.library.make_importer()
+        self.start_import(importer, lambda progress: importer.run(importer.scan(source_dir), progress),
+                          "📥 Scanning folder...")
+    
+    def start_import(self, importer, run, status):
+        """Run an import off the Tk thread; poll_import shows progress and finishes it"""
+        updates = queue.Queue()
         
-        lang_badge = tk.Label(header, text=snippet.get('language', 'Unknown'),
-                             bg=self.accent, fg=self.bg_dark,
-                             font=("Segoe UI", 9, "bold"),
-                             padx=10, pady=3)
-        lang_badge.pack(side=tk.LEFT)
+        def work():
+            try:
+                result = run(lambda done, total, path: updates.put(("progress", done, total)))
+                updates.put(("done", result))
+            except Exception as e:
+                updates.put(("error", e))
         
-        # Show file extension
-        ext_label = tk.Label(header, text=snippet.get('extension', ''),
-                            bg=self.bg_tertiary, fg=self.success,
-                            font=("Consolas", 9, "bold"),
-                            padx=8, pady=3)
-        ext_label.pack(side=tk.LEFT, padx=(5, 0))
+        self.import_job = (importer, updates)
+        self.set_import_status(status)
+        threading.Thread(target=work, daemon=True).start()
+        self.root.after(100, self.poll_import)
+    
+    def show_pack_menu(self, button):
+        menu = tk.Menu(self.root, tearoff=0, bg=self.bg_secondary, fg=self.text_primary,
+                       activebackground=self.accent, activeforeground=self.bg_dark)
+        menu.add_command(label="📦 Export library to a pack...", command=self.export_pack)
+        menu.add_command(label="📥 Import snippets from a pack...", command=self.import_pack)
+        menu.tk_popup(button.winfo_rootx(), button.winfo_rooty() + button.winfo_height())
+    
+    def export_pack(self):
+        self.wait_until_loaded()
+        path = filedialog.asksaveasfilename(title="Export library to a pack",
+                                            defaultextension=PACK_EXTENSION,
+                                            filetypes=[("Snippet packs", "*" + PACK_EXTENSION)])
+        if not path:
+            return
         
-        date_label = tk.Label(header, text=snippet.get('created', '').split()[0],
-                             bg=self.bg_secondary, fg=self.text_secondary,
-                             font=("Segoe UI", 8))
-        date_label.pack(side=tk.RIGHT)
+        def done(count):
+            self.set_import_status("")
+            messagebox.showinfo("Export Complete", f"📦 Packed {count} snippets into\n{path}")
         
-        # Title with filename
-        title = tk.Label(card, text=snippet.get('title', 'Untitled'),
-                        bg=self.bg_secondary, fg=self.text_primary,
-                        font=("Segoe UI", 16, "bold"),
-                        anchor=tk.W, wraplength=250)
-        title.pack(fill=tk.X, padx=20, pady=(5, 5))
+        def failed(e):
+            self.set_import_status("")
+            messagebox.showerror("Error", f"Export failed: {str(e)}")
         
-        # Show actual filename
-        filename_label = tk.Label(card, text=f"📄 {snippet.get('filename', 'N/A')}",
-                                 bg=self.bg_secondary, fg=self.text_secondary,
-                                 font=("Consolas", 9),
-                                 anchor=tk.W)
-        filename_label.pack(fill=tk.X, padx=20, pady=(0, 10))
+        # On the I/O worker, so every queued save is in the pack
+        snippets = list(self.snippets)
+        self.set_import_status(f"📦 Packing {len(snippets)} snippets...")
+        self.io.submit(self.library.export_pack, path, snippets, on_done=done, on_error=failed)
+    
+    def import_pack(self):
+        self.wait_until_loaded()
+        if self.import_job is not None:
+            messagebox.showinfo("Import", "An import is already running.")
+            return
         
-        # Code preview
-        code_preview = snippet.get('code_preview', 'No preview')
-        code_label = tk.Label(card, text=code_preview,
-                             bg=self.bg_tertiary, fg=self.text_secondary,
-                             font=("Consolas", 9),
-                             anchor=tk.W, justify=tk.LEFT,
-                             wraplength=250, height=4)
-        code_label.pack(fill=tk.X, padx=20, pady=(0, 10))
+        path = filedialog.askopenfilename(title="Import snippets from a pack",
+                                          filetypes=[("Snippet packs", "*" + PACK_EXTENSION),
+                                                     ("All files", "*")])
+        if not path:
+            return
         
-        # Tags preview
-        if snippet.get('tags'):
-            tags_text = " ".join([f"#{tag}" for tag in snippet['tags'][:3]])
-            if len(snippet['tags']) > 3:
-                tags_text += f" +{len(snippet['tags']) - 3}"
-            
-            tags_label = tk.Label(card, text=tags_text,
-                                 bg=self.bg_secondary, fg=self.accent,
-                                 font=("Segoe UI", 9),
-                                 anchor=tk.W)
-            tags_label.pack(fill=tk.X, padx=20, pady=(0, 15))
-        else:
-            tags_label = None
-        
-        # Hover effect
-        def on_enter(e):
-            card.config(bg=self.bg_tertiary)
-            header.config(bg=self.bg_tertiary)
-            title.config(bg=self.bg_tertiary)
-            filename_label.config(bg=self.bg_tertiary)
-            if tags_label:
-                tags_label.config(bg=self.bg_tertiary)
-            date_label.config(bg=self.bg_tertiary)
-        
-        def on_leave(e):
-            card.config(bg=self.bg_secondary)
-            header.config(bg=self.bg_secondary)
-            title.config(bg=self.bg_secondary)
-            filename_label.config(bg=self.bg_secondary)
-            if tags_label:
-                tags_label.config(bg=self.bg_secondary)
-            date_label.config(bg=self.bg_secondary)
-        
-        card.bind("<Enter>", on_enter)
-        card.bind("<Leave>", on_leave)
-        card.bind("<Button-1>", lambda e, s=snippet: self.show_editor_page(s))
-        
-        # Bind all children too
-        for child in [header, title, filename_label, code_label, lang_badge, ext_label, date_label]:
-            child.bind("<Enter>", on_enter)
-            child.bind("<Leave>", on_leave)
-            child.bind("<Button-1>", lambda e, s=snippet: self.show_editor_page(s))
-        
-        if tags_label:
-            tags_label.bind("<Enter>", on_enter)
-            tags_label.bind("<Leave>", on_leave)
-            tags_label.bind("<Button-1>", lambda e, s=snippet: self.show_editor_page(s))
-        
-        return card
+        importer = self.library.make_pack_importer(path)
+        self.start_import(importer, importer.run, "📥 Opening pack...")
     
-    def filter_home_snippets(self):
-        search_term = self.home_search_var.get().lower()
-        if not search_term:
-            self.display_snippet_cards()
+    def poll_import(self):
+        importer, updates = self.import_job
+        message = None
+        try:
+            while message is None or message[0] == "progress":
+                message = updates.get_nowait()
+        except queue.Empty:
+            pass
+        
+        if message is None or message[0] == "progress":
+            if message:
+                self.set_import_status(f"📥 Importing {message[1]}/{message[2]} files...")
+            self.root.after(100, self.poll_import)
             return
         
-        filtered = [s for s in self.snippets if 
-                   search_term in s['title'].lower() or 
-                   search_term in s['language'].lower() or
-                   search_term in s.get('filename', '').lower() or
-                   any(search_term in tag for tag in s.get('tags', []))]
-        self.display_snippet_cards(filtered)
+        self.import_job = None
+        self.set_import_status("")
+        if message[0] == "error":
+            messagebox.showerror("Error", f"Import failed: {str(message[1])}")
+            return
+        
+        # Metadata is queued from the Tk thread and flushed in one batch
+        result = message[1]
+        self.library.finish_import(importer, result)
+        self.search_session.reset()
+        
+        messagebox.showinfo("Import Complete",
+                            f"✨ Imported {len(result.snippets)} files\n"
+                            f"({len(result.skipped)} skipped)")
+        # Don't throw away an editor the user is working in
+        if self.import_status.winfo_exists():
+            self.show_home_page()
+    
+    def set_import_status(self, text):
+        if self.import_status.winfo_exists():
+            self.import_status.config(text=text)
     
+    @metrics.timed("render.editor")
     def show_editor_page(self, snippet=None):
+        self.wait_until_loaded()
+        if snippet is not None:
+            # Cards drawn from the startup snapshot hold copies of the records
+            snippet = self.library.by_id.get(snippet['id'])
+            if snippet is None:
+                return
         self.clear_container()
         self.current_snippet = snippet
         
@@ -401,13 +966,15 @@ class CodeSnippetManager:
             title = self.title_entry.get().strip()
             lang = self.lang_var.get()
             if title and lang:
-                filename = self.sanitize_filename(title) + self.language_extensions[lang]
+                filename, filepath = self.library.target_path(title, lang)
                 self.filename_preview.config(text=f"💾 Will save as: {filename}")
             else:
                 self.filename_preview.config(text="")
         
         self.title_entry.bind('<KeyRelease>', update_preview)
         self.lang_var.trace('w', update_preview)
+        self.removed_tags = set()
+        self.tags_stale = False
         
         input_frame.columnconfigure(0, weight=3)
         input_frame.columnconfigure(1, weight=1)
@@ -426,6 +993,14 @@ class CodeSnippetManager:
                                                    wrap=tk.NONE, padx=10, pady=10,
                                                    height=12)
         self.code_text.pack(fill=tk.BOTH, expand=False)
+        self.code_highlighter = CodeHighlighter(self.code_text, self.lang_var.get(),
+                                                on_change=self.schedule_live_tags)
+        self.code_text.configure(yscrollcommand=self.on_code_scroll)
+        self.lang_var.trace('w', lambda *args: self.code_highlighter.set_language(self.lang_var.get()))
+        
+        # Shown only when a large file is opened page by page
+        self.large_file_status = tk.Label(content_frame, text="", bg=self.bg_dark,
+                                          fg=self.warning, font=("Segoe UI", 9))
         
         # Tags section
         tk.Label(content_frame, text="AI-Generated Tags", bg=self.bg_dark,
@@ -447,6 +1022,7 @@ class CodeSnippetManager:
         self.tags_canvas.configure(xscrollcommand=tags_scrollbar.set)
         
         self.tags_frame = tk.Frame(self.tags_canvas, bg=self.bg_secondary)
+        self.current_tags = []
         self.tags_canvas.create_window((0, 0), window=self.tags_frame, anchor=tk.NW)
         
         self.tags_canvas.bind('<MouseWheel>', self._on_mousewheel)
@@ -472,7 +1048,21 @@ class CodeSnippetManager:
                            cursor="hand2", padx=35, pady=15)
         gen_btn.pack(side=tk.LEFT, padx=(0, 20))
         
+        similar_btn = tk.Button(button_frame, text="🔎 Similar",
+                               command=self.show_similar_snippets,
+                               bg=self.bg_tertiary, fg=self.text_primary,
+                               relief=tk.FLAT, font=("Segoe UI", 14, "bold"),
+                               cursor="hand2", padx=35, pady=15)
+        similar_btn.pack(side=tk.LEFT, padx=(0, 20))
+        
         if snippet:
+            history_btn = tk.Button(button_frame, text="🕘 History",
+                                   command=self.show_history,
+                                   bg=self.bg_tertiary, fg=self.text_primary,
+                                   relief=tk.FLAT, font=("Segoe UI", 14, "bold"),
+                                   cursor="hand2", padx=35, pady=15)
+            history_btn.pack(side=tk.LEFT, padx=(0, 20))
+            
             delete_btn = tk.Button(button_frame, text="🗑️ Delete File",
                                   command=self.delete_snippet,
                                   bg=self.error, fg=self.bg_dark,
@@ -484,60 +1074,308 @@ class CodeSnippetManager:
         if snippet:
             self.title_entry.insert(0, snippet['title'])
             self.lang_var.set(snippet['language'])
-            # Load code from file
-            filepath = snippet.get('filepath')
-            if filepath and os.path.exists(filepath):
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    self.code_text.insert("1.0", f.read())
+            self.large_file = self.library.open_paged(snippet)
+            if self.large_file:
+                # Large file: show it a page at a time as the user scrolls
+                self.large_file_status.pack(anchor=tk.W, after=self.code_text.master.master,
+                                            pady=(0, 10))
+                self.load_next_page()
+            else:
+                # Load code from file in the background; large files shouldn't stall the UI
+                def show_code(code):
+                    if self.current_snippet is snippet and self.code_text.winfo_exists():
+                        self.code_text.insert("1.0", code)
+                        # Loading isn't editing: keep the saved tags until the user edits
+                        self.cancel_live_tags()
+                        self.tags_stale = False
+                self.io.submit(self.library.read_code, snippet, on_done=show_code)
             if snippet.get('tags'):
                 self.display_tags(snippet['tags'])
             update_preview()
+        
+        # Title words and the language are part of the tags too
+        self.title_entry.bind('<KeyRelease>', self.schedule_live_tags, add="+")
+        self.lang_var.trace('w', self.schedule_live_tags)
+    
+    def load_next_page(self):
+        """Append the next page of a large file to the editor"""
+        if not self.large_file or self.large_file.at_end:
+            return
+        # Loading a page isn't an edit; keep the user's modified flag as it was
+        modified = self.code_text.edit_modified()
+        self.code_text.insert("end-1c", self.large_file.read_page())
+        self.code_text.edit_modified(modified)
+        
+        loaded_mb = self.large_file.offset / (1024 * 1024)
+        total_mb = self.large_file.size / (1024 * 1024)
+        if self.large_file.at_end:
+            text = f"📄 Large file: all {total_mb:.1f} MB loaded"
+        else:
+            text = f"📄 Large file: showing {loaded_mb:.1f} of {total_mb:.1f} MB, scroll down to load more"
+        self.large_file_status.config(text=text)
+    
+    def on_code_scroll(self, first, last):
+        self.code_text.vbar.set(first, last)
+        # Scrolled, resized or edited: color whatever is now in view
+        self.code_highlighter.schedule()
+        # Near the bottom of what is loaded: fetch the next page
+        if self.large_file and not self.large_file.at_end and float(last) > 0.9:
+            self.root.after_idle(self.load_next_page)
+    
+    def close_large_file(self):
+        if self.large_file:
+            self.large_file.close()
+            self.large_file = None
     
     def generate_tags(self):
+        """Refresh the tags now, bringing back any the user removed"""
+        if not self.code_text.get("1.0", tk.END).strip():
+            messagebox.showwarning("Warning", "Please enter some code first!")
+            return
+        self.removed_tags = set()
+        self.cancel_live_tags()
+        self.refresh_live_tags()
+    
+    def schedule_live_tags(self, *args):
+        """Debounce editing: re-tag once the user pauses"""
+        if self.large_file:
+            # Only part of a large file is in the editor; tag it on request
+            return
+        self.cancel_live_tags()
+        self.tags_stale = True
+        self.tags_after_id = self.root.after(self.tags_delay, self.refresh_live_tags)
+    
+    def cancel_live_tags(self):
+        """Drop a pending refresh, and the result of one already on the worker"""
+        if self.tags_after_id is not None:
+            self.root.after_cancel(self.tags_after_id)
+            self.tags_after_id = None
+        self.tags_generation += 1
+    
+    def refresh_live_tags(self):
+        self.tags_after_id = None
+        if not self.code_text.winfo_exists():
+            return
         code = self.code_text.get("1.0", tk.END).strip()
+        if not code:
+            return
         title = self.title_entry.get().strip()
         language = self.lang_var.get()
+        generation = self.tags_generation
+        
+        def generate():
+            # Skip the work if a newer edit came in while this one was queued
+            if generation != self.tags_generation:
+                return None
+            return self.library.generate_tags(code, language, title)
         
+        def show(tags):
+            if tags is None or generation != self.tags_generation or not self.tags_frame.winfo_exists():
+                return
+            self.tags_stale = False
+            tags = [tag for tag in tags if tag not in self.removed_tags]
+            if tags != self.current_tags:
+                self.display_tags(tags)
+        
+        self.io.submit(generate, on_done=show)
+    
+    def show_similar_snippets(self):
+        code = self.code_text.get("1.0", tk.END).strip()
         if not code:
             messagebox.showwarning("Warning", "Please enter some code first!")
             return
+        if not self.library.similarity_ready:
+            messagebox.showinfo("Similar Snippets", "Still indexing your snippets, try again in a moment.")
+            return
+        
+        exclude = self.current_snippet['id'] if self.current_snippet else None
+        matches = self.library.similar(code, limit=10, exclude=exclude)
+        if not matches:
+            messagebox.showinfo("Similar Snippets", "No similar snippets found.")
+            return
+        
+        popup = tk.Toplevel(self.root, bg=self.bg_dark)
+        popup.title("Similar Snippets")
+        popup.transient(self.root)
+        tk.Label(popup, text="🔎 Similar Snippets", font=("Segoe UI", 16, "bold"),
+                bg=self.bg_dark, fg=self.accent).pack(padx=20, pady=(15, 10), anchor=tk.W)
+        
+        def open_snippet(snippet):
+            popup.destroy()
+            self.show_editor_page(snippet)
+        
+        for snippet, similarity in matches:
+            tk.Button(popup, text=f"{similarity:.0%}   {snippet['title']}   ({snippet['language']})",
+                     command=lambda s=snippet: open_snippet(s),
+                     bg=self.bg_secondary, fg=self.text_primary,
+                     relief=tk.FLAT, font=("Segoe UI", 11), anchor=tk.W,
+                     cursor="hand2", padx=15, pady=8,
+                     activebackground=self.bg_tertiary).pack(fill=tk.X, padx=20, pady=2)
+        tk.Label(popup, text="", bg=self.bg_dark).pack(pady=5)
+    
+    def show_history(self):
+        """Earlier versions of the open snippet, diffed against the editor, with restore"""
+        snippet = self.current_snippet
+        if self.large_file:
+            messagebox.showinfo("History", "History isn't kept for large files.")
+            return
+        
+        def show(revisions):
+            if self.current_snippet is not snippet or not self.code_text.winfo_exists():
+                return
+            if not revisions:
+                messagebox.showinfo("History", "No earlier versions yet. History starts "
+                                               "with the first save of an edit.")
+                return
+            self.open_history_window(snippet, revisions[::-1])
         
-        tags = set()
-        
-        # Detect patterns
-        if "def " in code or "function " in code:
-            tags.add("function")
-        if "class " in code:
-            tags.add("class")
-        if "import " in code or "#include" in code:
-            tags.add("imports")
-        if any(kw in code for kw in ["if", "else", "switch"]):
-            tags.add("conditional")
-        if any(kw in code for kw in ["for", "while", "loop"]):
-            tags.add("loop")
-        if any(kw in code for kw in ["try", "except", "catch"]):
-            tags.add("error-handling")
-        if any(kw in code for kw in ["async", "await", "Promise"]):
-            tags.add("async")
-        if "API" in code or "api" in code or "fetch" in code or "request" in code:
-            tags.add("api")
-        if "file" in code.lower() or "open(" in code:
-            tags.add("file-io")
-        if any(kw in code.lower() for kw in ["sort", "filter", "map"]):
-            tags.add("data-processing")
-        
-        tags.add(language.lower())
-        
-        if title:
-            title_words = re.findall(r'\w+', title.lower())
-            for word in title_words:
-                if len(word) > 3:
-                    tags.add(word)
-        
-        self.display_tags(list(tags))
-        messagebox.showinfo("Success", f"✨ Generated {len(tags)} AI-powered tags!")
+        self.io.submit(self.library.history.revisions, snippet['id'], on_done=show)
+    
+    def open_history_window(self, snippet, revisions):
+        popup = tk.Toplevel(self.root, bg=self.bg_dark)
+        popup.title(f"History - {snippet['title']}")
+        popup.geometry("900x560")
+        popup.transient(self.root)
+        tk.Label(popup, text="🕘 History", font=("Segoe UI", 16, "bold"),
+                bg=self.bg_dark, fg=self.accent).pack(padx=20, pady=(15, 10), anchor=tk.W)
+        
+        body = tk.Frame(popup, bg=self.bg_dark)
+        body.pack(fill=tk.BOTH, expand=True, padx=20)
+        
+        listbox = tk.Listbox(body, bg=self.bg_secondary, fg=self.text_primary, relief=tk.FLAT,
+                             font=("Segoe UI", 10), width=34, activestyle=tk.NONE,
+                             selectbackground=self.accent, selectforeground=self.bg_dark,
+                             exportselection=False)
+        listbox.pack(side=tk.LEFT, fill=tk.Y, padx=(0, 10))
+        for revision in revisions:
+            when = time.strftime("%Y-%m-%d %H:%M", time.localtime(revision.time))
+            listbox.insert(tk.END, f"#{revision.number}  {when}  {revision.title}")
+        
+        diff_view = scrolledtext.ScrolledText(body, bg=self.bg_tertiary, fg=self.text_primary,
+                                              font=("Consolas", 10), relief=tk.FLAT, wrap=tk.NONE)
+        diff_view.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        diff_view.tag_configure("added", foreground=self.success)
+        diff_view.tag_configure("removed", foreground=self.error)
+        diff_view.tag_configure("hunk", foreground=self.accent)
+        
+        def show_diff(lines):
+            if not diff_view.winfo_exists():
+                return
+            diff_view.config(state=tk.NORMAL)
+            diff_view.delete("1.0", tk.END)
+            if not lines:
+                diff_view.insert("1.0", "Same as the code in the editor.")
+            for line in lines:
+                tag = ("hunk" if line.startswith("@@") else
+                       "added" if line.startswith("+") else
+                       "removed" if line.startswith("-") else "")
+                diff_view.insert(tk.END, line if line.endswith("\n") else line + "\n", tag)
+            diff_view.config(state=tk.DISABLED)
+        
+        def selected():
+            selection = listbox.curselection()
+            return revisions[selection[0]] if selection else None
+        
+        def on_select(event=None):
+            revision = selected()
+            if revision is None or not self.code_text.winfo_exists():
+                return
+            current = self.code_text.get("1.0", tk.END).strip() + "\n"
+            self.io.submit(self.library.history.diff, snippet['id'], revision.number, current,
+                           on_done=show_diff)
+        
+        def restore():
+            revision = selected()
+            if revision is None:
+                return
+            
+            def put(code):
+                if self.current_snippet is not snippet or not self.code_text.winfo_exists():
+                    return
+                # An edit like any other: Save makes it the current version, as a new revision
+                self.code_text.delete("1.0", tk.END)
+                self.code_text.insert("1.0", code)
+                popup.destroy()
+            
+            self.io.submit(self.library.history.text, snippet['id'], revision.number, on_done=put)
+        
+        listbox.bind("<<ListboxSelect>>", on_select)
+        tk.Button(popup, text="↩ Restore into Editor", command=restore,
+                 bg=self.accent, fg=self.bg_dark, relief=tk.FLAT,
+                 font=("Segoe UI", 11, "bold"), cursor="hand2", padx=15, pady=6,
+                 activebackground=self.accent_hover).pack(anchor=tk.E, padx=20, pady=15)
+        listbox.selection_set(0)
+        on_select()
+    
+    def show_diagnostics(self, event=None):
+        """Live timings and counters, JSON export and a sampling profiler (F12)"""
+        if self.diagnostics is not None and self.diagnostics.winfo_exists():
+            self.diagnostics.lift()
+            return
+        
+        popup = tk.Toplevel(self.root, bg=self.bg_dark)
+        popup.title("Diagnostics")
+        popup.geometry("780x520")
+        self.diagnostics = popup
+        tk.Label(popup, text="📈 Diagnostics", font=("Segoe UI", 16, "bold"),
+                bg=self.bg_dark, fg=self.accent).pack(padx=20, pady=(15, 10), anchor=tk.W)
+        
+        controls = tk.Frame(popup, bg=self.bg_dark)
+        controls.pack(fill=tk.X, padx=20, pady=(0, 10))
+        
+        enabled_var = tk.BooleanVar(value=metrics.enabled)
+        tk.Checkbutton(controls, text="Record metrics", variable=enabled_var,
+                      command=lambda: metrics.enable(enabled_var.get()),
+                      bg=self.bg_dark, fg=self.text_primary, selectcolor=self.bg_tertiary,
+                      activebackground=self.bg_dark, activeforeground=self.text_primary,
+                      font=("Segoe UI", 11)).pack(side=tk.LEFT)
+        
+        def export():
+            path = filedialog.asksaveasfilename(parent=popup, defaultextension=".json",
+                                                filetypes=[("JSON files", "*.json")])
+            if path:
+                metrics.export_json(path)
+        
+        def toggle_profiler():
+            if metrics.sampler is None:
+                self.profile_output = ""
+                metrics.start_sampling()
+                profile_btn.config(text="⏹ Stop Profiler")
+            else:
+                self.profile_output = metrics.stop_sampling()
+                profile_btn.config(text="▶ Start Profiler")
+        
+        profile_btn = tk.Button(controls, command=toggle_profiler,
+                               text="⏹ Stop Profiler" if metrics.sampler else "▶ Start Profiler")
+        for text, command in (("🗑 Reset", metrics.reset), ("💾 Export JSON", export)):
+            tk.Button(controls, text=text, command=command)
+        for button in controls.winfo_children()[1:]:
+            button.config(bg=self.bg_tertiary, fg=self.text_primary, relief=tk.FLAT,
+                          font=("Segoe UI", 10), cursor="hand2", padx=12, pady=4,
+                          activebackground=self.bg_secondary, activeforeground=self.text_primary)
+            button.pack(side=tk.RIGHT, padx=(8, 0))
+        
+        report = scrolledtext.ScrolledText(popup, bg=self.bg_secondary, fg=self.text_primary,
+                                           font=("Consolas", 10), relief=tk.FLAT, wrap=tk.NONE)
+        report.pack(fill=tk.BOTH, expand=True, padx=20, pady=(0, 20))
+        
+        def refresh():
+            if not report.winfo_exists():
+                return
+            text = metrics.report() if metrics.enabled or metrics.spans else \
+                "Recording is off. Tick \"Record metrics\" or start with SNIPPET_METRICS=1."
+            if self.profile_output:
+                text += "\n\nProfile (sampled stacks of the UI thread)\n" + self.profile_output
+            report.config(state=tk.NORMAL)
+            report.delete("1.0", tk.END)
+            report.insert("1.0", text)
+            report.config(state=tk.DISABLED)
+            popup.after(1000, refresh)
+        
+        refresh()
     
     def display_tags(self, tags):
+        self.current_tags = list(tags)
         for widget in self.tags_frame.winfo_children():
             widget.destroy()
         
@@ -571,10 +1409,8 @@ class CodeSnippetManager:
         self.tags_canvas.configure(scrollregion=self.tags_canvas.bbox("all"))
     
     def remove_tag(self, tag):
-        current_tags = [child.winfo_children()[0].cget("text").replace("#", "") 
-                       for child in self.tags_frame.winfo_children()]
-        current_tags.remove(tag)
-        self.display_tags(current_tags)
+        self.removed_tags.add(tag)
+        self.display_tags([t for t in self.current_tags if t != tag])
     
     def _on_mousewheel(self, event):
         if event.num == 5 or event.delta < 0:
@@ -584,87 +1420,90 @@ class CodeSnippetManager:
     
     def save_snippet(self):
         title = self.title_entry.get().strip()
-        code = self.code_text.get("1.0", tk.END).strip()
+        if self.large_file:
+            # Only the loaded pages are in the editor; the rest is copied from the file
+            head = self.code_text.get("1.0", "end-1c")
+            code = self.large_file.splice(head, modified=self.code_text.edit_modified())
+        else:
+            code = self.code_text.get("1.0", tk.END).strip()
         language = self.lang_var.get()
         
-        if not title or not code:
+        if not title or not (code.head.strip() if self.large_file else code):
             messagebox.showwarning("Warning", "Please fill in title and code!")
             return
         
-        # Get tags
-        tags = []
-        try:
-            tags = [child.winfo_children()[0].cget("text").replace("#", "") 
-                    for child in self.tags_frame.winfo_children() if child.winfo_children()]
-        except:
-            tags = []
-        
-        # Create filename and filepath
-        filename = self.sanitize_filename(title) + self.language_extensions[language]
-        folder = self.get_language_folder(language)
-        filepath = os.path.join(folder, filename)
+        filename, filepath = self.library.target_path(title, language)
         
         # Check if file exists (for new snippets)
+        overwrite = False
         if not self.current_snippet and os.path.exists(filepath):
             overwrite = messagebox.askyesno("File Exists", 
                                            f"File '{filename}' already exists. Overwrite?")
             if not overwrite:
                 return
         
+        # Warn before saving a near-copy of an existing snippet
+        if not self.large_file and self.library.similarity_ready:
+            exclude = self.current_snippet['id'] if self.current_snippet else None
+            matches = self.library.similar(code, DUPLICATE_THRESHOLD, 1, exclude)
+            if matches:
+                similar, similarity = matches[0]
+                if not messagebox.askyesno("Similar Snippet",
+                                           f"This code is {similarity:.0%} similar to "
+                                           f"'{similar['title']}'.\n\nSave anyway?"):
+                    return
+        
+        # Saved before the tags caught up with the last edit: save with the
+        # tags shown now, and put the fresh ones on once the worker has them
+        retag = self.tags_stale and not self.large_file
+        if retag:
+            self.cancel_live_tags()
+        removed_tags = set(self.removed_tags)
+        
+        def saved(result):
+            metrics.count("snippets.saved")
+            messagebox.showinfo("Success", 
+                              f"✨ Code saved as:\n{filename}\n\nLocation:\n{filepath}")
+        
+        def failed(e):
+            messagebox.showerror("Error", f"Failed to save file: {str(e)}")
+        
         try:
-            # Save the actual code file
-            with open(filepath, 'w', encoding='utf-8') as f:
-                f.write(code)
-            
-            # Create code preview
-            code_preview = code[:100] + "..." if len(code) > 100 else code
-            
-            # Update or create metadata
             if self.current_snippet:
-                # Update existing
-                for snippet in self.snippets:
-                    if snippet.get('id') == self.current_snippet.get('id'):
-                        # Delete old file if name/language changed
-                        old_filepath = snippet.get('filepath')
-                        if old_filepath and old_filepath != filepath and os.path.exists(old_filepath):
-                            os.remove(old_filepath)
-                        
-                        snippet['title'] = title
-                        snippet['language'] = language
-                        snippet['filename'] = filename
-                        snippet['filepath'] = filepath
-                        snippet['extension'] = self.language_extensions[language]
-                        snippet['tags'] = tags
-                        snippet['code_preview'] = code_preview
-                        break
+                snippet = self.library.update(self.current_snippet['id'], title, code, language,
+                                              self.current_tags, on_done=saved, on_error=failed)
+                # The paged file now belongs to the pending write, which closes it
+                self.large_file = None
             else:
-                # Create new
-                new_snippet = {
-                    "id": max([s.get('id', 0) for s in self.snippets], default=0) + 1,
-                    "title": title,
-                    "language": language,
-                    "filename": filename,
-                    "filepath": filepath,
-                    "extension": self.language_extensions[language],
-                    "tags": tags,
-                    "code_preview": code_preview,
-                    "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                }
-                self.snippets.append(new_snippet)
-            
-            # Save metadata
-            self.save_metadata()
+                snippet = self.library.create(title, code, language, self.current_tags,
+                                              overwrite=overwrite, on_done=saved, on_error=failed)
             
-            print(f"✅ Saved snippet: {filename}")  # Debug
-            print(f"📁 File location: {filepath}")  # Debug
-            print(f"📊 Total snippets now: {len(self.snippets)}")  # Debug
+            # A later save of the snippet drops tags still being generated
+            self.tag_saves.pop(snippet['id'], None)
+            if retag:
+                token = self.tag_saves[snippet['id']] = (object(), snippet.get('modified'))
+                self.io.submit(self.library.generate_tags, code, language, title,
+                               on_done=lambda tags: self.apply_saved_tags(
+                                   snippet['id'], token, tags, removed_tags, code))
             
-            messagebox.showinfo("Success", 
-                              f"✨ Code saved as:\n{filename}\n\nLocation:\n{filepath}")
             self.show_home_page()
             
         except Exception as e:
-            messagebox.showerror("Error", f"Failed to save file: {str(e)}")
+            failed(e)
+    
+    def apply_saved_tags(self, snippet_id, token, tags, removed_tags, code):
+        """Put tags generated after a save on the snippet, unless it changed since"""
+        if self.tag_saves.get(snippet_id) is not token:
+            return
+        del self.tag_saves[snippet_id]
+        snippet = self.library.by_id.get(snippet_id)
+        # Edited outside the app meanwhile: the tags would be for old code
+        if snippet is None or snippet.get('modified') != token[1]:
+            return
+        tags = [tag for tag in tags if tag not in removed_tags]
+        if tags != snippet.get('tags'):
+            self.library.set_tags(snippet_id, tags, code)
+            self.refresh_home()
     
     def delete_snippet(self):
         if not self.current_snippet:
@@ -673,16 +1512,12 @@ class CodeSnippetManager:
         if messagebox.askyesno("Confirm Delete", 
                               f"Delete this snippet and its file?\n\n{self.current_snippet.get('filename', '')}"):
             try:
-                # Delete the actual file
-                filepath = self.current_snippet.get('filepath')
-                if filepath and os.path.exists(filepath):
-                    os.remove(filepath)
-                
-                # Remove from metadata
-                self.snippets.remove(self.current_snippet)
-                self.save_metadata()
+                self.library.delete(
+                    self.current_snippet['id'],
+                    on_done=lambda result: messagebox.showinfo(
+                        "Deleted", "✅ Snippet and file deleted successfully!"),
+                    on_error=lambda e: messagebox.showerror("Error", f"Failed to delete: {str(e)}"))
                 
-                messagebox.showinfo("Deleted", "✅ Snippet and file deleted successfully!")
                 self.show_home_page()
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to delete: {str(e)}")
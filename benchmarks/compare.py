@@ -0,0 +1,49 @@
+"""Compare two benchmark result files.
+
+    python benchmarks/compare.py before.json after.json
+
+Prints every timing found in both files, matched by corpus size, with
+the relative change. Lower is better for everything except throughput.
+"""
+import json
+import sys
+
+# Metrics where a bigger number is the improvement
+HIGHER_IS_BETTER = ("snippets_per_s", "mb_per_s")
+
+
+def flatten(value, prefix=""):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from flatten(item, f"{prefix}.{key}" if prefix else key)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, value
+
+
+def load_runs(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        report = json.load(f)
+    return {run["size"]: dict(flatten(run)) for run in report["runs"]}
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        print("usage: compare.py BEFORE.json AFTER.json")
+        return 2
+    before, after = load_runs(argv[0]), load_runs(argv[1])
+    for size in sorted(set(before) & set(after)):
+        print(f"== {size} snippets")
+        for name, old in before[size].items():
+            new = after[size].get(name)
+            if new is None or name in ("size", "count") or name.endswith(".count"):
+                continue
+            change = (new - old) / old * 100 if old else 0.0
+            better = change > 0 if name.endswith(HIGHER_IS_BETTER) else change < 0
+            marker = "" if abs(change) < 5 else ("  better" if better else "  worse")
+            print(f"  {name:<40} {old:>12.3f} {new:>12.3f} {change:>+8.1f}%{marker}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
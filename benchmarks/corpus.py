@@ -0,0 +1,135 @@
+"""Reproducible synthetic snippet libraries for the benchmarks.
+
+generate_tree() writes code files for every language in
+LANGUAGE_EXTENSIONS into a source folder; build_library() imports such a
+tree into a fresh snippets folder the same way the app's "Import Folder"
+does, and builds the search index so the library looks like one that has
+been in use. The same size and seed always give the same corpus.
+"""
+import os
+import random
+import shutil
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from snippet_core import SnippetLibrary, languages  # noqa: E402
+
+WORDS = ["user", "order", "cache", "token", "config", "request", "response", "parse",
+         "json", "http", "client", "server", "query", "index", "tree", "node", "graph",
+         "sort", "merge", "binary", "search", "stream", "buffer", "file", "path", "date",
+         "time", "retry", "queue", "worker", "event", "handler", "route", "session",
+         "matrix", "vector", "hash", "string", "format", "valid", "email", "price",
+         "report", "export", "import", "upload", "image", "resize", "color", "theme"]
+
+VERBS = ["get", "set", "load", "save", "build", "find", "parse", "format", "check",
+         "update", "create", "delete", "merge", "split", "render", "fetch", "sort"]
+
+# One template per language family; {body} repeats to vary the size
+TEMPLATES = {
+    "Python": ("import {word1}\n\n\ndef {func}({arg}):\n    \"\"\"{verb} the {word2}\"\"\"\n"
+               "    result = []\n{body}    return result\n",
+               "    for item in {arg}:\n        if item.{word3}:\n"
+               "            result.append(item.{word4})\n"),
+    "JavaScript": ("const {word1} = require('{word1}');\n\nasync function {func}({arg}) {{\n"
+                   "  const result = [];\n{body}  return result;\n}}\n",
+                   "  for (const item of {arg}) {{\n    if (item.{word3}) {{\n"
+                   "      result.push(await fetch(item.{word4}));\n    }}\n  }}\n"),
+    "TypeScript": ("import {{ {word1} }} from './{word1}';\n\nexport function {func}({arg}: any[]): string[] {{\n"
+                   "  const result: string[] = [];\n{body}  return result;\n}}\n",
+                   "  {arg}.forEach(item => {{\n    if (item.{word3}) result.push(item.{word4});\n  }});\n"),
+    "Java": ("import java.util.*;\n\npublic class {Class} {{\n    public List<String> {func}(List<String> {arg}) {{\n"
+             "        List<String> result = new ArrayList<>();\n{body}        return result;\n    }}\n}}\n",
+             "        for (String item : {arg}) {{\n            if (item.contains(\"{word3}\")) {{\n"
+             "                result.add(item.trim());\n            }}\n        }}\n"),
+    "C#": ("using System.Linq;\n\npublic class {Class}\n{{\n    public int {Func}(int[] {arg})\n    {{\n"
+           "        int result = 0;\n{body}        return result;\n    }}\n}}\n",
+           "        foreach (var item in {arg})\n        {{\n            if (item > {number}) result += item;\n        }}\n"),
+    "Kotlin": ("import kotlin.math.*\n\nfun {func}({arg}: List<Int>): Int {{\n    var result = 0\n{body}    return result\n}}\n",
+               "    for (item in {arg}) {{\n        if (item > {number}) result += item\n    }}\n"),
+    "Swift": ("import Foundation\n\nfunc {func}(_ {arg}: [Int]) -> Int {{\n    var result = 0\n{body}    return result\n}}\n",
+              "    for item in {arg} {{\n        if item > {number} {{ result += item }}\n    }}\n"),
+    "Go": ("package main\n\nimport \"fmt\"\n\nfunc {Func}({arg} []int) int {{\n    result := 0\n{body}"
+           "    fmt.Println(result)\n    return result\n}}\n",
+           "    for _, item := range {arg} {{\n        if item > {number} {{\n            result += item\n        }}\n    }}\n"),
+    "Rust": ("use std::collections::HashMap;\n\nfn {func}({arg}: &[i32]) -> i32 {{\n    let mut result = 0;\n{body}"
+             "    result\n}}\n",
+             "    for item in {arg}.iter() {{\n        if *item > {number} {{\n            result += item;\n        }}\n    }}\n"),
+    "C++": ("#include <vector>\n\nint {func}(const std::vector<int>& {arg}) {{\n    int result = 0;\n{body}"
+            "    return result;\n}}\n",
+            "    for (int item : {arg}) {{\n        if (item > {number}) {{\n            result += item;\n        }}\n    }}\n"),
+    "C": ("#include <stdio.h>\n\nint {func}(int *{arg}, int n) {{\n    int result = 0;\n{body}"
+          "    printf(\"%d\\n\", result);\n    return result;\n}}\n",
+          "    for (int i = 0; i < n; i++) {{\n        if ({arg}[i] > {number}) result += {arg}[i];\n    }}\n"),
+    "PHP": ("<?php\n\nfunction {func}(${arg}) {{\n    $result = [];\n{body}    return $result;\n}}\n",
+            "    foreach (${arg} as $item) {{\n        if ($item['{word3}']) {{\n"
+            "            $result[] = $item['{word4}'];\n        }}\n    }}\n"),
+    "Ruby": ("require '{word1}'\n\ndef {func}({arg})\n  result = []\n{body}  result\nend\n",
+             "  {arg}.each do |item|\n    result << item.{word4} if item.{word3}\n  end\n"),
+    "SQL": ("-- {verb} {word2}\n{body}",
+            "SELECT {word3}, COUNT(*) AS total\nFROM {word1}_{word2}\nWHERE {word4} > {number}\n"
+            "GROUP BY {word3}\nORDER BY total DESC;\n\n"),
+    "HTML": ("<!DOCTYPE html>\n<html>\n<head><title>{verb} {word2}</title></head>\n<body>\n{body}</body>\n</html>\n",
+             "  <div class=\"{word3}\">\n    <form action=\"/{word1}\">\n      <input name=\"{word4}\">\n"
+             "    </form>\n  </div>\n"),
+    "CSS": ("/* {verb} {word2} */\n{body}",
+            ".{word3}-{word4} {{\n  display: flex;\n  margin: {number}px;\n  color: #{number:03d}fff;\n}}\n\n"),
+    "Other": ("{verb} {word2} notes\n\n{body}",
+              "- {word3} {word4} {number}\n"),
+}
+
+
+def _code(rng, language):
+    template, block = TEMPLATES.get(language, TEMPLATES["Other"])
+    words = rng.sample(WORDS, 4)
+    verb = rng.choice(VERBS)
+    fields = {
+        "word1": words[0], "word2": words[1], "word3": words[2], "word4": words[3],
+        "verb": verb, "arg": words[1] + "s", "number": rng.randrange(1000),
+        "func": f"{verb}_{words[1]}", "Func": verb.title() + words[1].title(),
+        "Class": words[0].title() + words[1].title(),
+    }
+    # Mostly short snippets with a long tail, like a real library
+    repeats = min(int(rng.paretovariate(1.5)), 60)
+    body = "".join(block.format(**dict(fields, number=rng.randrange(1000)))
+                   for _ in range(repeats))
+    return template.format(body=body, **fields)
+
+
+def generate_tree(source_dir, size, seed=0):
+    """Write size code files, spread over every language, under source_dir"""
+    rng = random.Random(seed)
+    names = list(languages.LANGUAGE_EXTENSIONS)
+    for language in names:
+        os.makedirs(os.path.join(source_dir, language), exist_ok=True)
+    for number in range(size):
+        language = names[number % len(names)]
+        title = f"{rng.choice(VERBS)}_{rng.choice(WORDS)}_{rng.choice(WORDS)}_{number}"
+        path = os.path.join(source_dir, language,
+                            title + languages.LANGUAGE_EXTENSIONS[language])
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(_code(rng, language))
+
+
+def sample_code(count, seed=1):
+    """[(language, code)] for snippets that are not in any corpus"""
+    rng = random.Random(seed)
+    names = list(languages.LANGUAGE_EXTENSIONS)
+    return [(names[i % len(names)], _code(rng, names[i % len(names)])) for i in range(count)]
+
+
+def build_library(work_dir, size, seed=0, backend="sqlite", rebuild=False):
+    """Snippets folder holding a corpus of the given size, reused between runs"""
+    corpus_dir = os.path.join(work_dir, f"corpus-{size}-{seed}-{backend}")
+    library_dir = os.path.join(corpus_dir, "Code_Snippets")
+    if os.path.isdir(library_dir) and not rebuild:
+        return library_dir
+    shutil.rmtree(corpus_dir, ignore_errors=True)
+    source_dir = os.path.join(corpus_dir, "source")
+    generate_tree(source_dir, size, seed)
+    with SnippetLibrary(library_dir, backend) as library:
+        library.import_tree(source_dir)
+        library.search_index
+    shutil.rmtree(source_dir)
+    return library_dir
@@ -0,0 +1,345 @@
+"""Benchmark the snippet library on synthetic corpora of several sizes.
+
+    python benchmarks/run.py --sizes 1000 10000 100000
+    python benchmarks/run.py --sizes 1000 --backend json --output before.json
+    python benchmarks/compare.py before.json after.json
+
+Measures cold start, record memory, save/update/delete latency,
+per-keystroke search latency, tagging throughput and card-grid
+rendering, and writes the numbers as JSON (benchmarks/results/<timestamp>.json by default).
+Exits with status 1 when tagging a 1 MB file misses its target.
+Corpora are cached in benchmarks/.corpus and reused; --rebuild forces
+fresh ones. Rendering needs a display: an existing DISPLAY, or Xvfb on
+the PATH, which is started for the run. Without either it is skipped.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import corpus
+from snippet_core import SnippetLibrary, BackgroundIO, IncrementalSearch, TagEngine, TagMemo
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = corpus.ROOT
+GUI_PATH = os.path.join(ROOT, "Code Snippet.py")
+
+# Typed a character at a time, like the home page search box
+QUERIES = ["parse json", "http client request", "binary search tree", "lang:python sort",
+           "retry queue worker", "tag:loop cache"]
+# Misspelt queries, answered by the fuzzy index
+TYPO_QUERIES = ["bianry serach", "prase jsno", "srt_aray", "reqeust clinet"]
+COLD_START_RUNS = 3
+WRITE_SAMPLES = 40
+TAG_SAMPLE = 2000
+# Tagging one file this large must take at most LARGE_FILE_TARGET_MS
+LARGE_FILE_BYTES = 1024 * 1024
+LARGE_FILE_TARGET_MS = 50
+LARGE_FILE_LANGUAGES = ["Python", "JavaScript", "Java", "C++"]
+
+_COLD_START = """
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+from snippet_core import SnippetLibrary
+imported = time.perf_counter()
+# What the app draws first: the cards of the startup snapshot
+library = SnippetLibrary(sys.argv[2], sys.argv[3], load=False)
+snapshot = library.open_snapshot()
+cards = [snapshot[i] for i in range(min(60, len(snapshot)))] if snapshot else []
+first_screen = time.perf_counter()
+library.reload()
+opened = time.perf_counter()
+library.search_index
+indexed = time.perf_counter()
+library.close()
+print(json.dumps({"import_s": imported - start, "snapshot": snapshot is not None,
+                  "first_screen_s": first_screen - start, "open_s": opened - first_screen,
+                  "search_index_s": indexed - opened, "total_s": indexed - start}))
+"""
+
+
+def summarize(samples):
+    """p50/p95/max/mean of a list of seconds, in milliseconds"""
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "p50_ms": 1000 * ordered[len(ordered) // 2],
+        "p95_ms": 1000 * ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "max_ms": 1000 * ordered[-1],
+        "mean_ms": 1000 * statistics.mean(ordered),
+    }
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def bench_cold_start(library_dir, backend):
+    """A fresh interpreter opening the library, as when the app starts"""
+    runs = []
+    for _ in range(COLD_START_RUNS):
+        output = subprocess.run([sys.executable, "-c", _COLD_START, ROOT, library_dir, backend],
+                                check=True, capture_output=True, text=True).stdout
+        runs.append(json.loads(output))
+    # The median run by total time
+    runs.sort(key=lambda run: run["total_s"])
+    return runs[len(runs) // 2]
+
+
+def bench_writes(library_dir, backend, io=None):
+    """Latency of create, update and delete as seen by the caller.
+
+    With a BackgroundIO this is what the UI thread waits for; the file
+    and metadata writes are then timed separately as the drain.
+    """
+    samples = corpus.sample_code(WRITE_SAMPLES, seed=7)
+    with SnippetLibrary(library_dir, backend, io=io) as library:
+        library.search_index
+        times = {"create": [], "update": [], "delete": []}
+        created = []
+        for number, (language, code) in enumerate(samples):
+            elapsed, snippet = timed(library.create, f"bench write {number}", code, language)
+            times["create"].append(elapsed)
+            created.append(snippet)
+        for snippet in created:
+            elapsed, _ = timed(library.update, snippet['id'], snippet['title'],
+                               library.read_code(snippet) + "\n// edited\n",
+                               snippet['language'], snippet['tags'])
+            times["update"].append(elapsed)
+        for snippet in created:
+            elapsed, _ = timed(library.delete, snippet['id'])
+            times["delete"].append(elapsed)
+        drain, _ = timed(library.flush)
+    result = {kind: summarize(samples) for kind, samples in times.items()}
+    result["drain_s"] = drain
+    return result
+
+
+def bench_search(library):
+    """Latency of each keystroke of a few typed queries, including the first page of cards"""
+    fuzzy_build, fuzzy_index = timed(lambda: library.fuzzy_index)
+    session = IncrementalSearch(library.search_index, fuzzy_index)
+    samples = {"keystroke": [], "typo_keystroke": []}
+    full = []
+    for kind, queries in (("keystroke", QUERIES), ("typo_keystroke", TYPO_QUERIES)):
+        for query in queries:
+            session.reset()
+            for length in range(1, len(query) + 1):
+                start = time.perf_counter()
+                results = session.search(query[:length], limit=60)
+                [library.by_id[doc_id] for doc_id, score in results if doc_id in library.by_id]
+                samples[kind].append(time.perf_counter() - start)
+    for query in QUERIES:
+        full.append(timed(library.search_index.search, query)[0])
+    result = {kind: summarize(times) for kind, times in samples.items()}
+    result["full_query"] = summarize(full)
+    result["fuzzy_build_s"] = fuzzy_build
+    return result
+
+
+def bench_tagging(library):
+    """Tags generated per second over a sample of the library's code"""
+    engine = TagEngine.load()
+    sample = [(library.read_code(snippet), snippet['language'], snippet['title'])
+              for snippet in library.snippets[:TAG_SAMPLE]]
+    size = sum(len(code.encode('utf-8')) for code, language, title in sample)
+    elapsed, _ = timed(lambda: [engine.generate(*item) for item in sample])
+    # Unchanged code again, as live tagging and retag see it: hash and memo lookup only
+    memo = TagMemo()
+    [engine.generate(*item, memo) for item in sample]
+    memoized, _ = timed(lambda: [engine.generate(*item, memo) for item in sample])
+    # One large file per language, made of the corpus's code in that language
+    large_file = {}
+    for language in LARGE_FILE_LANGUAGES:
+        code = "\n".join(code for code, other, title in sample if other == language)
+        if not code:
+            continue
+        code = (code * (LARGE_FILE_BYTES // len(code) + 1))[:LARGE_FILE_BYTES]
+        large_file[language] = 1000 * min(timed(engine.generate, code, language)[0]
+                                          for _ in range(5))
+    slowest = max(large_file.values(), default=None)
+    return {"snippets": len(sample), "bytes": size, "seconds": elapsed,
+            "snippets_per_s": len(sample) / elapsed if elapsed else None,
+            "mb_per_s": size / elapsed / 1e6 if elapsed else None,
+            "memoized_snippets_per_s": len(sample) / memoized if memoized else None,
+            "large_file_ms": large_file,
+            "large_file_within_target": slowest is None or slowest <= LARGE_FILE_TARGET_MS}
+
+
+def bench_memory(library_dir, backend):
+    """Python heap used by the in-memory snippet records"""
+    library = SnippetLibrary(library_dir, backend, load=False)
+    try:
+        tracemalloc.start()
+        library.reload()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return {"bytes": size, "bytes_per_snippet": size / max(len(library.snippets), 1)}
+    finally:
+        library.close()
+
+
+def bench_reindex(library):
+    elapsed, _ = timed(library.reindex)
+    return {"seconds": elapsed}
+
+
+def start_display():
+    """(display process or None, reason to skip or None)"""
+    if os.environ.get("DISPLAY"):
+        return None, None
+    xvfb = shutil.which("Xvfb")
+    if xvfb is None:
+        return None, "no DISPLAY and Xvfb is not installed"
+    display = ":%d" % (90 + os.getpid() % 100)
+    process = subprocess.Popen([xvfb, display, "-screen", "0", "1280x800x24", "-nolisten", "tcp"],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(1.0)
+    if process.poll() is not None:
+        return None, "Xvfb failed to start"
+    os.environ["DISPLAY"] = display
+    return process, None
+
+
+def bench_render(library_dir, backend):
+    """Home page build and card-grid scrolling in the real app window"""
+    import tkinter as tk
+    spec = importlib.util.spec_from_file_location("code_snippet_app", GUI_PATH)
+    app_module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(app_module)
+
+    # The app opens the Code_Snippets folder in the working directory
+    previous_dir = os.getcwd()
+    os.chdir(os.path.dirname(library_dir))
+    root = tk.Tk()
+    try:
+        elapsed, app = timed(app_module.CodeSnippetManager, root, backend, False)
+        root.update()
+        startup = elapsed
+        # Let the deferred startup work (reconcile, similarity warm-up) finish
+        app.library.wait_for_io()
+        root.update()
+
+        start = time.perf_counter()
+        app.show_home_page()
+        root.update_idletasks()
+        root.update()
+        home = time.perf_counter() - start
+
+        scrolls = []
+        for step in range(1, 41):
+            start = time.perf_counter()
+            app.card_grid.yview("moveto", step / 40)
+            root.update_idletasks()
+            scrolls.append(time.perf_counter() - start)
+        app.on_close()
+    finally:
+        try:
+            root.destroy()
+        except tk.TclError:
+            pass
+        os.chdir(previous_dir)
+    return {"startup_s": startup, "home_page_s": home, "scroll": summarize(scrolls)}
+
+
+def run_size(size, args):
+    print(f"== {size} snippets ({args.backend})", flush=True)
+    started = time.perf_counter()
+    library_dir = corpus.build_library(args.work_dir, size, args.seed, args.backend, args.rebuild)
+    result = {"size": size, "corpus_build_s": time.perf_counter() - started}
+
+    # Writes and reindexing change the library, so they run on a scratch copy
+    scratch = tempfile.mkdtemp(prefix="snippet-bench-")
+    try:
+        scratch_dir = os.path.join(scratch, "Code_Snippets")
+        shutil.copytree(library_dir, scratch_dir)
+        result["cold_start"] = bench_cold_start(scratch_dir, args.backend)
+        result["memory"] = bench_memory(scratch_dir, args.backend)
+        result["writes_sync"] = bench_writes(scratch_dir, args.backend)
+        result["writes_background"] = bench_writes(scratch_dir, args.backend, BackgroundIO())
+        with SnippetLibrary(scratch_dir, args.backend) as library:
+            result["search"] = bench_search(library)
+            result["tagging"] = bench_tagging(library)
+            result["reindex"] = bench_reindex(library)
+        if args.skip_render:
+            result["render"] = {"skipped": "--skip-render"}
+        elif args.render_skip_reason:
+            result["render"] = {"skipped": args.render_skip_reason}
+        else:
+            result["render"] = bench_render(scratch_dir, args.backend)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    print(json.dumps(result, indent=2), flush=True)
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the snippet library at scale")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--backend", choices=["sqlite", "json"], default="sqlite")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/<time>.json)")
+    parser.add_argument("--work-dir", default=os.path.join(HERE, ".corpus"),
+                        help="Where generated corpora are kept between runs")
+    parser.add_argument("--rebuild", action="store_true", help="Regenerate cached corpora")
+    parser.add_argument("--skip-render", action="store_true", help="Don't benchmark the Tk window")
+    args = parser.parse_args(argv)
+
+    display = None
+    args.render_skip_reason = None
+    if not args.skip_render:
+        display, args.render_skip_reason = start_display()
+    try:
+        runs = [run_size(size, args) for size in args.sizes]
+    finally:
+        if display is not None:
+            display.terminate()
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "backend": args.backend,
+            "seed": args.seed,
+        },
+        "runs": runs,
+    }
+    output = args.output or os.path.join(HERE, "results", time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+    missed = [run["size"] for run in runs if not run["tagging"]["large_file_within_target"]]
+    if missed:
+        print(f"Tagging a {LARGE_FILE_BYTES // 1024} KB file took over {LARGE_FILE_TARGET_MS} ms "
+              f"(corpus sizes {', '.join(map(str, missed))})")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,21 @@
+"""Core, UI-independent building blocks of the Code Snippet Manager"""
+from . import languages
+from .storage import (StorageBackend, JsonStorage, SqliteStorage,
+                      open_storage, METADATA_FILENAME, DATABASE_FILENAME)
+from .reconcile import Reconciler, InotifyWatcher
+from .records import Snippet, SnippetCollection
+from .search import SearchIndex, IncrementalSearch, tokenize
+from .fuzzy import FuzzyIndex
+from .browse import BrowseIndex, BrowseView, SORT_KEYS
+from .similarity import SimilarityIndex, DUPLICATE_THRESHOLD
+from .tagging import TagEngine, TagMemo
+from .background import BackgroundIO, SynchronousIO
+from .importer import BulkImporter, import_tree
+from .metrics import metrics, Metrics, Sampler
+from .highlight import Highlighter, LineLexer
+from .pack import PackReader, PackWriter, PackImporter, PackError, PACK_EXTENSION
+from .service import SnippetService, serve
+from .history import RevisionStore, Revision, HistoryError
+from .largefile import PagedFile, SplicedText, LARGE_FILE_THRESHOLD
+from .library import (SnippetLibrary, SnippetError, SnippetExistsError,
+                      SnippetNotFoundError, DEFAULT_LIBRARY_DIR)
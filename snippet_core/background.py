@@ -0,0 +1,167 @@
+"""Background execution of blocking file and storage work.
+
+BackgroundIO runs submitted calls on a single worker thread, in order, so
+writes to the same file or to the metadata store never race each other.
+Results and errors are queued and handed to callbacks only when the UI
+thread calls process_completions(); the Tk app does that from a
+root.after loop, so callbacks may safely touch widgets.
+
+coalesce() merges repeated requests for the same job (such as flushing
+metadata) into one run shortly after the first request.
+
+SynchronousIO has the same interface but runs everything immediately;
+it is what command line tools and scripts use.
+"""
+import queue
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+
+_WAKE = object()
+_STOP = object()
+
+
+class SynchronousIO:
+    """Runs every call immediately on the calling thread"""
+
+    def __init__(self):
+        self.on_error = None
+
+    def submit(self, fn, *args, on_done=None, on_error=None):
+        future = Future()
+        try:
+            result = fn(*args)
+        except Exception as e:
+            future.set_exception(e)
+            if on_error is None and self.on_error is None:
+                raise
+            (on_error or self.on_error)(e)
+        else:
+            future.set_result(result)
+            if on_done is not None:
+                on_done(result)
+        return future
+
+    def call(self, fn, *args):
+        return fn(*args)
+
+    def coalesce(self, key, fn, delay=0):
+        fn()
+
+    def flush_deferred(self):
+        pass
+
+    def process_completions(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class BackgroundIO:
+    """A single worker thread fed by a queue"""
+
+    def __init__(self, name="snippet-io"):
+        self.on_error = None
+        self._tasks = queue.Queue()
+        self._completions = queue.Queue()
+        self._deferred = {}       # key -> (deadline, fn)
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    # ------------------------------------------------------------------
+    # Called from the UI thread
+
+    def submit(self, fn, *args, on_done=None, on_error=None):
+        """Queue fn(*args). on_done(result) / on_error(exc) run on the UI thread"""
+        future = Future()
+        self._tasks.put((future, fn, args, on_done, on_error, True))
+        return future
+
+    def call(self, fn, *args):
+        """Run fn on the worker after everything queued before it, and wait.
+
+        Errors are raised here instead of being reported through on_error.
+        """
+        future = Future()
+        self._tasks.put((future, fn, args, None, None, False))
+        return future.result()
+
+    def coalesce(self, key, fn, delay=0.25):
+        """Run fn once, delay seconds after the first pending request for key"""
+        with self._lock:
+            if key in self._deferred:
+                return
+            self._deferred[key] = (time.monotonic() + delay, fn)
+        self._tasks.put(_WAKE)
+
+    def flush_deferred(self):
+        """Run all coalesced jobs now and wait for them"""
+        self.call(self._run_deferred, True)
+
+    def process_completions(self):
+        """Deliver finished results and errors to their callbacks"""
+        while True:
+            try:
+                callback, value = self._completions.get_nowait()
+            except queue.Empty:
+                return
+            callback(value)
+
+    def close(self, timeout=None):
+        """Finish all queued and coalesced work, then stop the worker"""
+        self._tasks.put(_STOP)
+        self._thread.join(timeout)
+        self.process_completions()
+
+    # ------------------------------------------------------------------
+    # Worker thread
+
+    def _run(self):
+        while True:
+            try:
+                item = self._tasks.get(timeout=self._next_timeout())
+            except queue.Empty:
+                item = _WAKE
+            self._run_deferred()
+            if item is _STOP:
+                self._run_deferred(True)
+                return
+            if item is not _WAKE:
+                self._execute(*item)
+
+    def _next_timeout(self):
+        with self._lock:
+            if not self._deferred:
+                return None
+            deadline = min(deadline for deadline, fn in self._deferred.values())
+        return max(0.0, deadline - time.monotonic())
+
+    def _run_deferred(self, everything=False):
+        now = time.monotonic()
+        with self._lock:
+            due = [key for key, (deadline, fn) in self._deferred.items()
+                   if everything or deadline <= now]
+            jobs = [self._deferred.pop(key)[1] for key in due]
+        for fn in jobs:
+            self._execute(Future(), fn, (), None, None, True)
+
+    def _execute(self, future, fn, args, on_done, on_error, report):
+        try:
+            result = fn(*args)
+        except Exception as e:
+            future.set_exception(e)
+            if not report:
+                return
+            handler = on_error or self.on_error
+            if handler is not None:
+                self._completions.put((handler, e))
+            else:
+                traceback.print_exc(file=sys.stderr)
+        else:
+            future.set_result(result)
+            if on_done is not None:
+                self._completions.put((on_done, result))
@@ -0,0 +1,131 @@
+"""Content-addressed storage for snippet code.
+
+Each distinct code body is stored once under .blobs/<aa>/<sha256>, and
+the familiar <Language>/<title><ext> files are copies of it. No working
+file shares its data with a blob: an editor that saves in place changes
+that one file and nothing else, and the blob keeps the code the
+metadata says the snippet has, for verify to compare against and to
+restore from.
+
+Libraries written by earlier versions hard-linked the files to their
+blob, so an in-place edit there also changed every snippet sharing the
+blob. Reconcile and verify notice such a file (st_nlink > 1 and a wrong
+hash), store its new code as a blob of its own and restore the shared
+blob from history when a revision still has it; verify --fix replaces
+the remaining links with copies.
+"""
+import hashlib
+import os
+import shutil
+import uuid
+
+BLOB_DIRNAME = ".blobs"
+
+HASH_BLOCK = 1024 * 1024
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class BlobStore:
+    """Code bodies keyed by their SHA-256"""
+
+    def __init__(self, base_dir):
+        self.root = os.path.join(base_dir, BLOB_DIRNAME)
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def temp_path(self):
+        """A fresh path inside the store for writing a blob before adopting it"""
+        os.makedirs(self.root, exist_ok=True)
+        return os.path.join(self.root, f"tmp-{uuid.uuid4().hex}")
+
+    def put(self, data, digest=None):
+        """Store bytes unless an identical blob exists. Returns the digest"""
+        digest = digest or hash_bytes(data)
+        if not self.exists(digest):
+            tmp_path = self.temp_path()
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            self._install(tmp_path, digest)
+        return digest
+
+    def adopt(self, tmp_path):
+        """Move a finished file into the store, dropping it if already stored"""
+        digest = hash_file(tmp_path)
+        if self.exists(digest):
+            os.remove(tmp_path)
+        else:
+            self._install(tmp_path, digest)
+        return digest
+
+    def _install(self, tmp_path, digest):
+        path = self.path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Concurrent writers of the same blob write the same bytes, so
+        # whoever replaces last wins harmlessly
+        os.replace(tmp_path, path)
+
+    def checkout(self, digest, filepath, replace=True):
+        """Write the blob's contents to filepath, as a file of its own. With
+        replace=False an existing file is left alone and FileExistsError raised"""
+        blob_path = self.path(digest)
+        folder, name = os.path.split(filepath)
+        os.makedirs(folder, exist_ok=True)
+        if not replace:
+            with open(blob_path, 'rb') as src, open(filepath, 'xb') as dst:
+                shutil.copyfileobj(src, dst, HASH_BLOCK)
+            return
+        # Swapped in whole; the leading dot keeps reconcile from taking it for a snippet
+        tmp_path = os.path.join(folder, f".{name}.{uuid.uuid4().hex}.tmp")
+        try:
+            shutil.copyfile(blob_path, tmp_path)
+            os.replace(tmp_path, filepath)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def linked(self, digest, filepath):
+        """Whether filepath is still a hard link to the blob, as earlier versions made them"""
+        try:
+            return os.stat(filepath).st_nlink > 1 and os.path.samefile(filepath, self.path(digest))
+        except OSError:
+            return False
+
+    def remove(self, digest):
+        """Delete a blob, unless a file of an earlier version still links to
+        it. Another process's snippet with the same code keeps its own
+        copy, and verify --fix stores the blob again"""
+        path = self.path(digest)
+        try:
+            if os.stat(path).st_nlink > 1:
+                return
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def digests(self):
+        """Every digest in the store"""
+        if not os.path.isdir(self.root):
+            return
+        for prefix in os.listdir(self.root):
+            folder = os.path.join(self.root, prefix)
+            if os.path.isdir(folder):
+                for name in os.listdir(folder):
+                    yield name
@@ -0,0 +1,293 @@
+"""Sorted and faceted browsing of a library.
+
+BrowseIndex keeps, for each sort key, every snippet in order, and
+counts snippets per language and per tag (overall and within each
+language). Saves and deletes move one entry and adjust a few counts,
+so changing the sort or a filter never sorts the whole library. A sort
+order is only built the first time it is asked for.
+
+Pages are fetched by cursor (the sort key of the last snippet seen) or
+through a BrowseView, a sequence the card grid can index directly.
+Filtering takes a set of ids, e.g. a language's snippets from ids():
+a small set is sorted on its own, a large one is picked out of the full
+order as the pages are read.
+"""
+import bisect
+from collections import Counter
+
+# Sort key -> newest/largest first by default
+SORT_KEYS = {
+    "created": True,
+    "modified": True,
+    "title": False,
+    "language": False,
+}
+
+# A filter keeping fewer than 1/SPARSE_RATIO of the snippets is sorted on
+# its own instead of being picked out of the full order
+SPARSE_RATIO = 8
+
+
+class _Entry:
+    __slots__ = ("title", "language", "tags", "created", "modified")
+
+    def __init__(self, snippet):
+        self.title = (snippet.get('title') or "").casefold()
+        self.language = snippet.get('language') or ""
+        self.tags = tuple(snippet.get('tags') or ())
+        self.created = snippet.get('created') or ""
+        self.modified = snippet.get('modified') or self.created
+
+    def same(self, other):
+        return (self.title == other.title and self.language == other.language
+                and self.tags == other.tags and self.created == other.created
+                and self.modified == other.modified)
+
+
+def _sort_key(sort, snippet_id, entry):
+    if sort == "title":
+        return (entry.title, snippet_id)
+    if sort == "language":
+        return (entry.language, entry.title, snippet_id)
+    if sort == "modified":
+        return (entry.modified, snippet_id)
+    return (entry.created, snippet_id)
+
+
+def valid_cursor(sort, cursor):
+    """Whether cursor has the shape of a page cursor for sort: the sort key
+    of a snippet, as a list of strings ending in its id"""
+    return (isinstance(cursor, (list, tuple))
+            and len(cursor) == (3 if sort == "language" else 2)
+            and all(isinstance(value, str) for value in cursor[:-1])
+            and type(cursor[-1]) is int)
+
+
+def _adjust(counter, key, amount):
+    """Change a count, keeping the table free of zeroes"""
+    counter[key] += amount
+    if counter[key] <= 0:
+        del counter[key]
+
+
+def _file(sets, key, snippet_id, amount):
+    """Add an id to, or drop it from, the set under key, keeping no empty sets"""
+    if amount > 0:
+        sets.setdefault(key, set()).add(snippet_id)
+        return
+    members = sets.get(key)
+    if members is not None:
+        members.discard(snippet_id)
+        if not members:
+            del sets[key]
+
+
+class BrowseIndex:
+    """Sort orders and facet counts for a library, updated one snippet at a time"""
+
+    def __init__(self, snippets=()):
+        self._entries = {}            # id -> _Entry, as last indexed
+        self._orders = {}             # sort key -> sorted [(key..., id)]
+        self.language_counts = Counter()
+        self.tag_counts = Counter()
+        self.language_tag_counts = {}  # language -> Counter of tags
+        self._language_ids = {}       # lowercased language -> set of ids
+        self._tag_ids = {}            # lowercased tag -> set of ids
+        self.version = 0              # bumped by every change, so views know to catch up
+        for snippet in snippets:
+            self.add(snippet)
+
+    def __len__(self):
+        return len(self._entries)
+
+    # ------------------------------------------------------------------
+    # Updates
+
+    def _count(self, snippet_id, entry, amount):
+        language_tags = self.language_tag_counts.setdefault(entry.language, Counter())
+        _adjust(self.language_counts, entry.language, amount)
+        _file(self._language_ids, entry.language.lower(), snippet_id, amount)
+        for tag in entry.tags:
+            _adjust(self.tag_counts, tag, amount)
+            _adjust(language_tags, tag, amount)
+            _file(self._tag_ids, tag.lower(), snippet_id, amount)
+        if not language_tags:
+            del self.language_tag_counts[entry.language]
+
+    def add(self, snippet):
+        snippet_id = snippet['id']
+        if snippet_id in self._entries:
+            self.update(snippet)
+            return
+        entry = self._entries[snippet_id] = _Entry(snippet)
+        self.version += 1
+        self._count(snippet_id, entry, 1)
+        for sort, order in self._orders.items():
+            bisect.insort(order, _sort_key(sort, snippet_id, entry))
+
+    def remove(self, snippet_id):
+        entry = self._entries.pop(snippet_id, None)
+        if entry is None:
+            return
+        self.version += 1
+        self._count(snippet_id, entry, -1)
+        for sort, order in self._orders.items():
+            key = _sort_key(sort, snippet_id, entry)
+            position = bisect.bisect_left(order, key)
+            if position < len(order) and order[position] == key:
+                del order[position]
+
+    def update(self, snippet):
+        entry = self._entries.get(snippet['id'])
+        if entry is not None and entry.same(_Entry(snippet)):
+            return
+        self.remove(snippet['id'])
+        self.add(snippet)
+
+    # ------------------------------------------------------------------
+    # Queries
+
+    def order(self, sort):
+        """Every (key..., id) in ascending order of a sort key"""
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Unknown sort key: {sort}")
+        order = self._orders.get(sort)
+        if order is None:
+            order = self._orders[sort] = sorted(
+                _sort_key(sort, snippet_id, entry) for snippet_id, entry in self._entries.items())
+        return order
+
+    def facets(self, language=None):
+        """(language counts, tag counts); tags counted within language if one is given"""
+        if language is None:
+            return self.language_counts, self.tag_counts
+        return self.language_counts, self.language_tag_counts.get(language, Counter())
+
+    def ids(self, language=None, tag=None):
+        """Ids of the snippets in a language and/or with a tag, either
+        matched without regard to case; None if neither is given"""
+        ids = None
+        for sets, value in ((self._language_ids, language), (self._tag_ids, tag)):
+            if value is not None:
+                matches = sets.get(value.lower(), set())
+                ids = set(matches) if ids is None else ids & matches
+        return ids
+
+    def view(self, sort="created", descending=None, within=None):
+        """The ids in sort order, optionally only those in within, as a sequence"""
+        if descending is None:
+            descending = SORT_KEYS[sort]
+        return BrowseView(self, sort, descending, within)
+
+    def page(self, sort="created", descending=None, after=None, limit=60, within=None):
+        """(ids, cursor) for up to limit snippets following the cursor.
+
+        Pass the returned cursor as after for the next page; it is None
+        once there are no more.
+        """
+        if descending is None:
+            descending = SORT_KEYS[sort]
+        if within is not None and len(within) * SPARSE_RATIO < len(self._entries):
+            keys = self._sparse_keys(sort, within)
+        else:
+            keys = self.order(sort)
+        if after is None:
+            start = len(keys) - 1 if descending else 0
+        else:
+            after = tuple(after)
+            start = (bisect.bisect_left(keys, after) - 1 if descending
+                     else bisect.bisect_right(keys, after))
+        step = -1 if descending else 1
+        ids = []
+        position = start
+        while 0 <= position < len(keys) and len(ids) < limit:
+            key = keys[position]
+            if within is None or key[-1] in within:
+                ids.append(key[-1])
+                last = key
+            position += step
+        # Only hand out a cursor if something is left to follow it
+        if within is not None:
+            while 0 <= position < len(keys) and keys[position][-1] not in within:
+                position += step
+        more = 0 <= position < len(keys)
+        return ids, (list(last) if ids and more else None)
+
+    def _sparse_keys(self, sort, ids):
+        entries = self._entries
+        return sorted(_sort_key(sort, snippet_id, entries[snippet_id])
+                      for snippet_id in ids if snippet_id in entries)
+
+
+class BrowseView:
+    """A sorted browse as a sequence of ids, filled in as it is indexed.
+
+    A filtered view catches up with the index when snippets are added,
+    changed or deleted, so it never hands out the id of a deleted snippet.
+    """
+
+    def __init__(self, index, sort, descending, within=None):
+        self.sort = sort
+        self.descending = descending
+        self._index = index
+        self._order = None
+        self._within = within
+        if within is None:
+            # Index straight into the shared order; it stays current as snippets change
+            self._order = index.order(sort)
+            return
+        self._build()
+
+    def _build(self):
+        index, within = self._index, self._within
+        self._version = index.version
+        if len(within) * SPARSE_RATIO < len(index):
+            self._ids = [key[-1] for key in index._sparse_keys(self.sort, within)]
+            if self.descending:
+                self._ids.reverse()
+            self._length = len(self._ids)
+            self._keys = None
+        else:
+            self._ids = []
+            self._keys = index.order(self.sort)
+            self._position = len(self._keys) - 1 if self.descending else 0
+            self._length = sum(1 for snippet_id in within if snippet_id in index._entries)
+
+    def _catch_up(self):
+        if self._order is None and self._version != self._index.version:
+            self._build()
+
+    def __len__(self):
+        if self._order is not None:
+            return len(self._order)
+        self._catch_up()
+        return self._length
+
+    def _fill(self, count):
+        """Pick members of within out of the full order until count are known"""
+        keys, within = self._keys, self._within
+        step = -1 if self.descending else 1
+        position = self._position
+        while len(self._ids) < count and 0 <= position < len(keys):
+            snippet_id = keys[position][-1]
+            if snippet_id in within:
+                self._ids.append(snippet_id)
+            position += step
+        self._position = position
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        if self._order is not None:
+            return self._order[-1 - index if self.descending else index][-1]
+        if len(self._ids) <= index:
+            self._fill(index + 1)
+        return self._ids[index]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
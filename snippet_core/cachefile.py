@@ -0,0 +1,57 @@
+"""Cache files kept in a library folder.
+
+Caches are rebuilt from the snippets whenever they are missing, so they
+are written and read as plain JSON: the folder may be shared, and a
+pickle written by someone else could run their code when loaded. A
+cache is replaced in one step through a temp file of this process's own,
+so readers in other processes never see half of one; a missing, damaged
+or outdated cache simply reads as absent.
+"""
+import contextlib
+import json
+import os
+
+# What restoring a cache of the wrong shape can raise
+_DAMAGED = (AttributeError, IndexError, KeyError, TypeError, ValueError)
+
+
+@contextlib.contextmanager
+def replacing(path):
+    """A binary file for path's new contents, swapped in when the with block
+    ends, or discarded if it fails"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def save_json(path, version, state):
+    """Write state, a dict of JSON types, as the cache at path"""
+    data = json.dumps(dict(state, version=version), ensure_ascii=False,
+                      separators=(',', ':')).encode('utf-8')
+    with replacing(path) as f:
+        f.write(data)
+
+
+def load_json(path, version, restore):
+    """Call restore(state) with the cache saved at path.
+
+    Returns whether it was restored. On False nothing, or only part of
+    the state, was restored, and the caller should start afresh.
+    """
+    try:
+        with open(path, 'rb') as f:
+            state = json.loads(f.read())
+        if not isinstance(state, dict) or state.get('version') != version:
+            return False
+        restore(state)
+        return True
+    except (OSError,) + _DAMAGED:
+        return False
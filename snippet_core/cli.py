@@ -0,0 +1,407 @@
+"""Command line interface to a snippet library.
+
+    python -m snippet_core add FILE_OR_FOLDER... [--language L] [--title T] [--tags a,b]
+    python -m snippet_core search QUERY [--limit N] [--json]
+    python -m snippet_core list [--sort KEY] [--language L] [--tag T] [--limit N]
+    python -m snippet_core show ID
+    python -m snippet_core similar ID [--threshold T]
+    python -m snippet_core delete ID
+    python -m snippet_core export OUTPUT.json [--query QUERY]
+    python -m snippet_core pack OUTPUT.snippack [--query QUERY]
+    python -m snippet_core unpack PACK.snippack [--list | --show TITLE]
+    python -m snippet_core reindex [--retag]
+    python -m snippet_core verify [--fix]
+    python -m snippet_core reconcile [--watch]
+    python -m snippet_core history ID [--show N | --diff N [M] | --restore N] | --collect
+    python -m snippet_core serve [--host H] [--port P]
+
+Any command takes --metrics FILE (timings and counters as JSON) and
+--profile FILE (cProfile stats, also summarized on stderr).
+
+Nothing here imports tkinter, so it starts quickly and runs without a display.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from .background import BackgroundIO
+from .languages import EXTENSION_LANGUAGES
+from .browse import SORT_KEYS
+from .library import SnippetLibrary, SnippetError, DEFAULT_LIBRARY_DIR
+from .metrics import metrics
+from .pack import PackReader, PackError
+from .reconcile import InotifyWatcher
+from .service import serve, DEFAULT_HOST, DEFAULT_PORT
+
+
+def _print_snippet(snippet):
+    tags = " ".join(f"#{tag}" for tag in snippet.get('tags', []))
+    print(f"{snippet['id']:>6}  {snippet['language']:<10}  {snippet['title']}  "
+          f"({snippet.get('filename', '')})  {tags}")
+
+
+def _progress(done, total, path):
+    print(f"\r{done}/{total} files", end="", file=sys.stderr, flush=True)
+
+
+def cmd_add(library, args):
+    added = 0
+    for path in args.paths:
+        if os.path.isdir(path):
+            result = library.import_tree(path, progress=None if args.quiet else _progress,
+                                         workers=args.workers)
+            if not args.quiet:
+                print(file=sys.stderr)
+            for source, reason in result.skipped:
+                print(f"skipped {source}: {reason}", file=sys.stderr)
+            added += len(result.snippets)
+            continue
+
+        title, extension = os.path.splitext(os.path.basename(path))
+        language = args.language or EXTENSION_LANGUAGES.get(extension.lower(), "Other")
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                code = f.read().strip()
+        except UnicodeDecodeError as e:
+            raise SnippetError(f"{path} is not UTF-8 text ({e.reason} at byte {e.start})") from None
+        except OSError as e:
+            raise SnippetError(f"Can't read {path}: {e.strerror}") from None
+        tags = [t.strip() for t in args.tags.split(",") if t.strip()] if args.tags else None
+        try:
+            snippet = library.create(args.title or title, code, language, tags,
+                                     overwrite=args.overwrite)
+        except SnippetError as e:
+            print(f"skipped {path}: {e}", file=sys.stderr)
+            continue
+        if not args.quiet:
+            _print_snippet(snippet)
+        added += 1
+    print(f"Added {added} snippet(s)")
+    return 0
+
+
+def cmd_list(library, args):
+    descending = SORT_KEYS[args.sort] != args.reverse
+    snippets = library.browse(args.sort, descending, args.language, args.tag)
+    if args.facets:
+        language_counts, tag_counts = library.facets(args.language)
+        for name, counts in (("languages", language_counts), ("tags", tag_counts)):
+            print(f"{name}: " + ", ".join(f"{key} ({count})"
+                                          for key, count in counts.most_common(args.limit)))
+        return 0
+    for snippet in snippets[:args.limit]:
+        _print_snippet(snippet)
+    if len(snippets) > args.limit:
+        print(f"... {len(snippets) - args.limit} more", file=sys.stderr)
+    return 0
+
+
+def cmd_search(library, args):
+    results = library.search(" ".join(args.query), limit=args.limit, fuzzy=not args.exact)
+    if args.json:
+        json.dump([snippet.to_dict() for snippet in results], sys.stdout, indent=2)
+        print()
+    else:
+        for snippet in results:
+            _print_snippet(snippet)
+    return 0 if results else 1
+
+
+def cmd_show(library, args):
+    snippet = library.get(args.id)
+    if args.json:
+        record = snippet.to_dict()
+        record['code'] = library.read_code(snippet)
+        json.dump(record, sys.stdout, indent=2)
+        print()
+    else:
+        _print_snippet(snippet)
+        print(library.read_code(snippet))
+    return 0
+
+
+def cmd_similar(library, args):
+    snippet = library.get(args.id)
+    matches = library.similar(library.read_code(snippet), args.threshold, args.limit,
+                              exclude=snippet['id'])
+    for match, similarity in matches:
+        print(f"{similarity:>5.0%}", end="  ")
+        _print_snippet(match)
+    return 0 if matches else 1
+
+
+def cmd_delete(library, args):
+    library.delete(args.id)
+    print(f"Deleted snippet {args.id}")
+    return 0
+
+
+def cmd_export(library, args):
+    snippets = library.search(args.query) if args.query else None
+    if args.output == "-":
+        count = library.export_json(sys.stdout, snippets)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            count = library.export_json(f, snippets)
+    print(f"Exported {count} snippet(s)", file=sys.stderr)
+    return 0
+
+
+def cmd_pack(library, args):
+    snippets = library.search(args.query) if args.query else None
+    count = library.export_pack(args.output, snippets,
+                                progress=None if args.quiet else _progress)
+    if not args.quiet:
+        print(file=sys.stderr)
+    print(f"Packed {count} snippet(s) into {args.output}")
+    return 0
+
+
+def cmd_unpack(library, args):
+    if args.list or args.show:
+        with PackReader(args.pack) as reader:
+            if args.show:
+                record = reader.find(args.show)
+                if record is None:
+                    print(f"error: no snippet titled {args.show!r} in {args.pack}", file=sys.stderr)
+                    return 1
+                print(reader.read_code(record))
+                return 0
+            for record in reader:
+                size = record['body'][2] if record.get('body') else 0
+                print(f"{record['language']:<10}  {size:>9}  {record['title']}")
+        return 0
+
+    result = library.import_pack(args.pack, progress=None if args.quiet else _progress)
+    if not args.quiet:
+        print(file=sys.stderr)
+    for title, reason in result.skipped:
+        print(f"skipped {title}: {reason}", file=sys.stderr)
+    print(f"Unpacked {len(result.snippets)} snippet(s)")
+    return 0
+
+
+def cmd_reindex(library, args):
+    if args.retag:
+        changed = library.retag()
+        print(f"Retagged {changed} snippet(s)")
+    index = library.reindex()
+    print(f"Indexed {len(index.docs)} snippet(s)")
+    return 0
+
+
+def cmd_verify(library, args):
+    problems = library.verify(fix=args.fix)
+    for key, problem, fixed in problems:
+        what = f"blob {key[:12]}" if problem == "orphan" else f"snippet {key}"
+        print(f"{what}: {problem}{' (fixed)' if fixed else ''}")
+    unfixed = sum(1 for key, problem, fixed in problems if not fixed)
+    print(f"{len(problems)} problem(s), {unfixed} unfixed")
+    return 1 if unfixed else 0
+
+
+def _print_reconcile(result, waiting=True):
+    for snippet in result.added:
+        print(f"added    {snippet['filepath']}")
+    for snippet in result.updated:
+        print(f"updated  {snippet['filepath']}")
+    for snippet_id in result.removed:
+        print(f"removed  snippet {snippet_id}")
+    for path in result.waiting if waiting else ():
+        print(f"waiting  {path} (changed just now, run again shortly)")
+
+
+def cmd_reconcile(library, args):
+    result = library.reconcile()
+    _print_reconcile(result, waiting=not args.watch)
+    if not args.watch:
+        return 0
+
+    watcher = InotifyWatcher(library.base_dir) if InotifyWatcher.available() else None
+    print("Watching for changes" + ("" if watcher else " (polling)") + ", Ctrl+C to stop",
+          file=sys.stderr)
+    try:
+        while True:
+            time.sleep(args.interval)
+            changed = watcher.drain() if watcher else None
+            # Paths still settling are checked again until they are applied
+            if changed is None or changed or result.waiting:
+                result = library.reconcile(changed)
+                _print_reconcile(result, waiting=False)
+                library.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if watcher:
+            watcher.close()
+    return 0
+
+
+def cmd_history(library, args):
+    if args.collect:
+        dropped, freed = library.collect_history(force=True).result()
+        print(f"Dropped {dropped} revision(s), freed {freed / 1024:.1f} KB")
+        return 0
+    if args.id is None:
+        print("error: give a snippet id, or --collect", file=sys.stderr)
+        return 2
+    snippet = library.get(args.id)
+    if args.show is not None:
+        print(library.revision_text(args.id, args.show), end="")
+    elif args.diff:
+        new = args.diff[1] if len(args.diff) > 1 else None
+        sys.stdout.writelines(library.revision_diff(args.id, args.diff[0], new))
+    elif args.restore is not None:
+        library.restore_revision(args.id, args.restore)
+        print(f"Restored revision {args.restore} of {snippet['title']}")
+    else:
+        revisions = library.revisions(args.id)
+        if not revisions:
+            print(f"No history for {snippet['title']} yet; it starts with the first edit")
+            return 1
+        for revision in revisions:
+            when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(revision.time))
+            print(f"{revision.number:>5}  {when}  {revision.size:>8} bytes  {revision.title}")
+    return 0
+
+
+def cmd_serve(library, args):
+    def ready(service):
+        print(f"Serving {len(library.snippets)} snippets on http://{service.host}:{service.port}, "
+              "Ctrl+C to stop", file=sys.stderr)
+
+    serve(library, args.host, args.port, ready)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="snippet_core",
+                                     description="Manage a code snippet library from the command line")
+    parser.add_argument("--library", default=DEFAULT_LIBRARY_DIR,
+                        help="snippets folder (default: %(default)s)")
+    parser.add_argument("--backend", default="sqlite", choices=["sqlite", "json"],
+                        help="metadata storage backend")
+    parser.add_argument("--metrics", metavar="FILE", help="write timings and counters as JSON")
+    parser.add_argument("--profile", metavar="FILE", help="profile the command with cProfile")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add = commands.add_parser("add", help="add files, or import whole folders")
+    add.add_argument("paths", nargs="+")
+    add.add_argument("--language", help="language for single files (default: from extension)")
+    add.add_argument("--title", help="title for a single file (default: file name)")
+    add.add_argument("--tags", help="comma separated tags (default: generated)")
+    add.add_argument("--overwrite", action="store_true", help="replace existing files")
+    add.add_argument("--workers", type=int, help="tagging processes for folder imports")
+    add.add_argument("-q", "--quiet", action="store_true")
+    add.set_defaults(func=cmd_add)
+
+    list_ = commands.add_parser("list", help="list snippets in order, optionally one language or tag")
+    list_.add_argument("--sort", default="created", choices=list(SORT_KEYS),
+                       help="newest first for dates, A-Z otherwise (default: %(default)s)")
+    list_.add_argument("--reverse", action="store_true",
+                       help="oldest first for dates, Z-A otherwise")
+    list_.add_argument("--language")
+    list_.add_argument("--tag")
+    list_.add_argument("--limit", type=int, default=50)
+    list_.add_argument("--facets", action="store_true",
+                       help="print snippet counts per language and tag instead")
+    list_.set_defaults(func=cmd_list)
+
+    search = commands.add_parser("search", help="search snippets")
+    search.add_argument("query", nargs="+")
+    search.add_argument("--limit", type=int, default=20)
+    search.add_argument("--json", action="store_true", help="print results as JSON")
+    search.add_argument("--exact", action="store_true",
+                        help="no typo-tolerant matches when there are few exact ones")
+    search.set_defaults(func=cmd_search)
+
+    show = commands.add_parser("show", help="print a snippet and its code")
+    show.add_argument("id", type=int)
+    show.add_argument("--json", action="store_true")
+    show.set_defaults(func=cmd_show)
+
+    similar = commands.add_parser("similar", help="list snippets with code similar to a snippet")
+    similar.add_argument("id", type=int)
+    similar.add_argument("--threshold", type=float, default=0.5,
+                         help="minimum estimated similarity, 0-1 (default: %(default)s)")
+    similar.add_argument("--limit", type=int, default=10)
+    similar.set_defaults(func=cmd_similar)
+
+    delete = commands.add_parser("delete", help="delete a snippet and its file")
+    delete.add_argument("id", type=int)
+    delete.set_defaults(func=cmd_delete)
+
+    export = commands.add_parser("export", help="export snippets with their code as JSON")
+    export.add_argument("output", help="output file, or - for stdout")
+    export.add_argument("--query", help="only export snippets matching this search")
+    export.set_defaults(func=cmd_export)
+
+    pack = commands.add_parser("pack", help="write snippets and their code to one compressed file")
+    pack.add_argument("output", help="pack file to write, e.g. backup.snippack")
+    pack.add_argument("--query", help="only pack snippets matching this search")
+    pack.add_argument("-q", "--quiet", action="store_true")
+    pack.set_defaults(func=cmd_pack)
+
+    unpack = commands.add_parser("unpack", help="add the snippets of a pack to the library")
+    unpack.add_argument("pack")
+    unpack.add_argument("--list", action="store_true", help="list the pack's snippets instead")
+    unpack.add_argument("--show", metavar="TITLE", help="print one snippet's code from the pack")
+    unpack.add_argument("-q", "--quiet", action="store_true")
+    unpack.set_defaults(func=cmd_unpack)
+
+    reindex = commands.add_parser("reindex", help="rebuild the search index")
+    reindex.add_argument("--retag", action="store_true", help="regenerate all tags first")
+    reindex.set_defaults(func=cmd_reindex)
+
+    verify = commands.add_parser("verify", help="check code files against their recorded hashes")
+    verify.add_argument("--fix", action="store_true",
+                        help="relink missing files, adopt edited ones, drop unused blobs")
+    verify.set_defaults(func=cmd_verify)
+
+    reconcile = commands.add_parser("reconcile",
+                                    help="pick up files added, edited or deleted outside the app")
+    reconcile.add_argument("--watch", action="store_true", help="keep running and apply changes live")
+    reconcile.add_argument("--interval", type=float, default=1.0,
+                           help="seconds between checks when watching (default: %(default)s)")
+    reconcile.set_defaults(func=cmd_reconcile)
+
+    history = commands.add_parser("history", help="list, compare and restore earlier versions")
+    history.add_argument("id", type=int, nargs="?")
+    history.add_argument("--show", type=int, metavar="N", help="print revision N")
+    history.add_argument("--diff", type=int, nargs="+", metavar="N",
+                         help="diff revision N against revision M, or the current code")
+    history.add_argument("--restore", type=int, metavar="N", help="make revision N the current code")
+    history.add_argument("--collect", action="store_true",
+                         help="drop revisions the retention policy no longer keeps")
+    history.set_defaults(func=cmd_history)
+
+    serve_ = commands.add_parser("serve", help="answer searches and edits over local HTTP/JSON")
+    serve_.add_argument("--host", default=DEFAULT_HOST,
+                        help="address to listen on; only this machine is served (default: %(default)s)")
+    serve_.add_argument("--port", type=int, default=DEFAULT_PORT,
+                        help="port to listen on, 0 for any free one (default: %(default)s)")
+    serve_.set_defaults(func=cmd_serve, background_io=True)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.metrics:
+        metrics.enable()
+    if args.profile:
+        metrics.start_profile()
+    try:
+        # A long-running service writes on a worker thread, like the app
+        io = BackgroundIO() if getattr(args, "background_io", False) else None
+        with SnippetLibrary(args.library, args.backend, io=io) as library:
+            return args.func(library, args)
+    except (SnippetError, PackError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if args.profile:
+            print(metrics.stop_profile(args.profile, limit=20), file=sys.stderr)
+        if args.metrics:
+            metrics.export_json(args.metrics)
@@ -0,0 +1,251 @@
+"""Typo-tolerant search over titles, filenames and tags.
+
+The words of every snippet's title, filename and tags form a vocabulary
+(a few tens of thousands of words even for a large library, since titles
+share most of their words). Each word is indexed by its character
+trigrams, padded at both ends: "sort" -> "$so", "sor", "ort", "rt$".
+
+A query word is looked up by its own trigrams: vocabulary words sharing
+the most trigrams with it are the only candidates, and only those get a
+bounded edit distance (adjacent transpositions count as one edit, so
+"bianry" is one edit from "binary"). Snippets are then scored by how
+closely, and in which field, each query word matched, and must match
+every query word. The cost depends on the vocabulary words near the
+query, not on the number of snippets.
+
+The index only depends on snippet metadata and is updated one snippet at
+a time on every save and delete.
+"""
+import bisect
+import heapq
+from collections import Counter
+
+from .search import FIELD_WEIGHTS, MAX_PREFIX_EXPANSIONS, tokenize
+
+# Vocabulary words per query word whose edit distance is worked out
+MAX_CANDIDATES = 150
+
+# Fields whose words are indexed; a word in several fields counts at its best weight
+_FIELDS = ("title", "filename", "tags")
+
+
+def max_edits(length):
+    """Edits allowed in a query word of this length: none below 3 letters"""
+    if length < 3:
+        return 0
+    return 1 if length < 6 else 2
+
+
+def trigrams(word, prefix=False):
+    """The padded trigrams of a word; a prefix is open at the end"""
+    padded = "$" + word + ("" if prefix else "$")
+    return {padded[i:i + 3] for i in range(max(1, len(padded) - 2))}
+
+
+def edit_distance(a, b, limit, prefix=False):
+    """Edits (insert, delete, substitute, swap two neighbours) from a to b,
+    or to the closest prefix of b; limit + 1 if it is more than limit.
+
+    Only cells within limit of the diagonal are filled in, so the cost is
+    len(a) * (2 * limit + 1) however long b is.
+    """
+    n, m = len(a), len(b)
+    if not prefix and abs(n - m) > limit:
+        return limit + 1
+    if m < n - limit:
+        return limit + 1
+    big = limit + 1
+    previous2 = None
+    previous = [j if j <= limit else big for j in range(m + 1)]
+    for i in range(1, n + 1):
+        current = [big] * (m + 1)
+        if i <= limit:
+            current[0] = i
+        low, high = max(1, i - limit), min(m, i + limit)
+        char = a[i - 1]
+        row_min = current[0]
+        for j in range(low, high + 1):
+            value = previous[j - 1] + (char != b[j - 1])
+            if previous[j] + 1 < value:
+                value = previous[j] + 1
+            if current[j - 1] + 1 < value:
+                value = current[j - 1] + 1
+            if (i > 1 and j > 1 and char == b[j - 2] and a[i - 2] == b[j - 1]
+                    and previous2[j - 2] + 1 < value):
+                value = previous2[j - 2] + 1
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > limit:
+            return big
+        previous2, previous = previous, current
+    if prefix:
+        distance = min(previous[max(0, n - limit):min(m, n + limit) + 1] or [big])
+    else:
+        distance = previous[m]
+    return min(distance, big)
+
+
+class FuzzyIndex:
+    """Trigram-indexed vocabulary of snippet titles, filenames and tags"""
+
+    def __init__(self, snippets=()):
+        self.words = {}           # word -> {doc_id: field weight}
+        self.trigrams = {}        # trigram -> set of words
+        self.vocabulary = []      # sorted words, for prefixes too short to have trigrams
+        self.docs = {}            # doc_id -> words indexed for it
+        for snippet in snippets:
+            self.update(snippet)
+
+    def __len__(self):
+        return len(self.docs)
+
+    # ------------------------------------------------------------------
+    # Updates
+
+    @staticmethod
+    def _doc_words(snippet):
+        """{word: weight of the best field it appears in}"""
+        filename = snippet.get('filename') or ""
+        stem = filename.rsplit(".", 1)[0] if "." in filename else filename
+        texts = {"title": snippet.get('title') or "", "filename": stem,
+                 "tags": " ".join(snippet.get('tags') or ())}
+        weights = {}
+        for field in _FIELDS:
+            weight = FIELD_WEIGHTS[field]
+            for word in tokenize(texts[field]):
+                if weights.get(word, 0) < weight:
+                    weights[word] = weight
+        return weights
+
+    def update(self, snippet):
+        """Index a snippet, replacing any previous version of it"""
+        doc_id = snippet['id']
+        weights = self._doc_words(snippet)
+        old = self.docs.get(doc_id)
+        if old is not None:
+            if all(self.words.get(word, {}).get(doc_id) == weights.get(word) for word in old) \
+                    and len(old) == len(weights):
+                return
+            self.remove(doc_id)
+        for word, weight in weights.items():
+            postings = self.words.get(word)
+            if postings is None:
+                postings = self.words[word] = {}
+                bisect.insort(self.vocabulary, word)
+                for trigram in trigrams(word):
+                    self.trigrams.setdefault(trigram, set()).add(word)
+            postings[doc_id] = weight
+        self.docs[doc_id] = tuple(weights)
+
+    def remove(self, doc_id):
+        for word in self.docs.pop(doc_id, ()):
+            postings = self.words[word]
+            postings.pop(doc_id, None)
+            if postings:
+                continue
+            del self.words[word]
+            del self.vocabulary[bisect.bisect_left(self.vocabulary, word)]
+            for trigram in trigrams(word):
+                words = self.trigrams[trigram]
+                words.discard(word)
+                if not words:
+                    del self.trigrams[trigram]
+
+    # ------------------------------------------------------------------
+    # Queries
+
+    def similar_words(self, word, prefix=False):
+        """[(vocabulary word, similarity 0..1)] within max_edits(len(word)) of word"""
+        limit = max_edits(len(word))
+        if limit == 0:
+            if not prefix:
+                return [(word, 1.0)] if word in self.words else []
+            start = bisect.bisect_left(self.vocabulary, word)
+            end = bisect.bisect_left(self.vocabulary, word + "\uffff", start)
+            expansions = self.vocabulary[start:end]
+            if len(expansions) > MAX_PREFIX_EXPANSIONS:
+                expansions = heapq.nlargest(MAX_PREFIX_EXPANSIONS, expansions,
+                                            key=lambda match: len(self.words[match]))
+            return [(match, 0.8 + 0.2 * len(word) / len(match)) for match in expansions]
+
+        # Candidates: the words sharing most trigrams with the query word. An
+        # edit changes at most 4 of the query's trigrams (a transposition
+        # does), so words sharing fewer can't be within limit edits
+        grams = trigrams(word, prefix)
+        shared = Counter()
+        for trigram in grams:
+            shared.update(self.trigrams.get(trigram, ()))
+        least = len(grams) - 4 * limit
+        low = len(word) - limit
+        high = None if prefix else len(word) + limit
+        candidates = [(count, candidate) for candidate, count in shared.items()
+                      if count >= least and len(candidate) >= low
+                      and (high is None or len(candidate) <= high)]
+        matches = []
+        for count, candidate in heapq.nlargest(MAX_CANDIDATES, candidates):
+            distance = edit_distance(word, candidate, limit, prefix)
+            if distance > limit:
+                continue
+            similarity = 1 - distance / (len(word) + 1)
+            if prefix:
+                similarity *= 0.8 + 0.2 * min(1, len(word) / len(candidate))
+            matches.append((candidate, similarity))
+        return matches
+
+    def search_query(self, query, index, prefix_last=False, limit=None):
+        """Matches for a search query, keeping to its lang: and tag: filters.
+
+        index is the SearchIndex that parses the query and resolves the filters.
+        """
+        clauses, filters = index.parse_query(query, prefix_last)
+        words = [term for clause in clauses for term in clause.terms]
+        if not words:
+            return []
+        within = None
+        for kind, value in filters:
+            ids = index.filter_ids(kind, value)
+            within = ids if within is None else within & ids
+        return self.search(words, clauses[-1].kind == "prefix", limit, within)
+
+    def search(self, words, prefix_last=False, limit=None, within=None):
+        """[(doc_id, score)] for snippets matching every word, best first.
+
+        The last word is matched as a prefix if prefix_last; within
+        optionally restricts the results to a set of ids.
+        """
+        matched = []
+        for position, word in enumerate(words):
+            prefix = prefix_last and position == len(words) - 1
+            similar = self.similar_words(word, prefix)
+            if not similar:
+                return []
+            matched.append(similar)
+
+        # Start from the query word with the fewest postings to keep the scores small
+        matched.sort(key=lambda similar: sum(len(self.words[w]) for w, s in similar))
+        scores = None
+        for similar in matched:
+            word_scores = {}
+            for match, similarity in similar:
+                postings = self.words[match]
+                if scores is not None and len(scores) < len(postings):
+                    # Only snippets that matched the earlier words can still match
+                    postings = {doc_id: postings[doc_id] for doc_id in scores if doc_id in postings}
+                for doc_id, weight in postings.items():
+                    if scores is not None and doc_id not in scores:
+                        continue
+                    if within is not None and doc_id not in within:
+                        continue
+                    score = weight * similarity
+                    if word_scores.get(doc_id, 0) < score:
+                        word_scores[doc_id] = score
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = {doc_id: scores[doc_id] + score for doc_id, score in word_scores.items()}
+            if not scores:
+                return []
+        if limit is None:
+            return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], item[0]))
@@ -0,0 +1,308 @@
+"""Incremental syntax highlighting, independent of any UI.
+
+A LineLexer splits one line into (kind, start, end) tokens given the
+state the previous line ended in: inside a block comment or a
+multi-line string, or neither. A Highlighter keeps the start state of
+every line it has seen. After an edit it re-lexes from the edited line
+onwards only until a line ends in the same state it ended in before the
+edit; from there on the cached states still hold. States past the lines
+asked for are worked out lazily, so opening or editing a long file only
+lexes what is on screen, and a keystroke costs the same whatever the
+file size.
+
+    highlighter = Highlighter("Python")
+    highlighter.lines_changed(first, old_count, new_count)
+    for line, tokens in highlighter.highlight(top, bottom, get_lines): ...
+
+Lines are numbered from 0; get_lines(first, last) returns the text of
+lines first..last-1.
+"""
+import re
+
+from .metrics import metrics
+
+# Token kinds, each drawn in its own color
+KINDS = ("keyword", "constant", "string", "comment", "number", "decorator")
+
+# Lines fetched at a time while catching up on states
+_CHUNK = 256
+
+# language: (keywords, constants, line comments, block comments,
+#            single-line string quotes, multi-line string delimiters)
+SYNTAX = {
+    "Python": (
+        "and as assert async await break class continue def del elif else except finally for "
+        "from global if import in is lambda nonlocal not or pass raise return try while with "
+        "yield match case",
+        "True False None self cls",
+        ("#",), (), ('"', "'"), ('"""', "'''")),
+    "JavaScript": (
+        "async await break case catch class const continue debugger default delete do else "
+        "export extends finally for function if import in instanceof let new of return static "
+        "super switch throw try typeof var void while with yield",
+        "true false null undefined this NaN Infinity",
+        ("//",), (("/*", "*/"),), ('"', "'"), ("`",)),
+    "TypeScript": (
+        "abstract any as async await boolean break case catch class const constructor continue "
+        "declare default delete do else enum export extends finally for from function if "
+        "implements import in instanceof interface keyof let module namespace never new number "
+        "of private protected public readonly return static string super switch throw try type "
+        "typeof unknown var void while yield",
+        "true false null undefined this",
+        ("//",), (("/*", "*/"),), ('"', "'"), ("`",)),
+    "Java": (
+        "abstract assert boolean break byte case catch char class const continue default do "
+        "double else enum extends final finally float for goto if implements import instanceof "
+        "int interface long native new package private protected public return short static "
+        "strictfp super switch synchronized throw throws transient try var void volatile while",
+        "true false null this",
+        ("//",), (("/*", "*/"),), ('"', "'"), ('"""',)),
+    "C++": (
+        "alignas auto bool break case catch char class const constexpr const_cast continue "
+        "decltype default delete do double dynamic_cast else enum explicit extern float for "
+        "friend goto if inline int long mutable namespace new noexcept operator private "
+        "protected public register reinterpret_cast return short signed sizeof static "
+        "static_cast struct switch template throw try typedef typename union unsigned using "
+        "virtual void volatile while",
+        "true false nullptr NULL this",
+        ("//",), (("/*", "*/"),), ('"', "'"), ()),
+    "C": (
+        "auto break case char const continue default do double else enum extern float for goto "
+        "if inline int long register restrict return short signed sizeof static struct switch "
+        "typedef union unsigned void volatile while",
+        "NULL true false",
+        ("//",), (("/*", "*/"),), ('"', "'"), ()),
+    "C#": (
+        "abstract as async await base bool break byte case catch char checked class const "
+        "continue decimal default delegate do double else enum event explicit extern finally "
+        "fixed float for foreach goto if implicit in int interface internal is lock long "
+        "namespace new object operator out override params private protected public readonly "
+        "ref return sealed short sizeof static string struct switch throw try typeof uint "
+        "ulong unsafe ushort using var virtual void volatile while",
+        "true false null this",
+        ("//",), (("/*", "*/"),), ('"', "'"), ()),
+    "Go": (
+        "break case chan const continue default defer else fallthrough for func go goto if "
+        "import interface map package range return select struct switch type var",
+        "true false nil iota",
+        ("//",), (("/*", "*/"),), ('"', "'"), ("`",)),
+    "Rust": (
+        "as async await break const continue crate dyn else enum extern fn for if impl in let "
+        "loop match mod move mut pub ref return static struct super trait type unsafe use where "
+        "while",
+        "true false self Self None Some Ok Err",
+        ("//",), (("/*", "*/"),), ('"',), ()),
+    "Swift": (
+        "associatedtype break case catch class continue default defer deinit do else enum "
+        "extension fallthrough fileprivate for func guard if import in init inout internal let "
+        "open operator private protocol public repeat return static struct subscript switch "
+        "throw throws try typealias var where while",
+        "true false nil self Self",
+        ("//",), (("/*", "*/"),), ('"',), ('"""',)),
+    "Kotlin": (
+        "abstract as break by catch class companion const continue data do else enum finally "
+        "for fun if import in interface internal is lateinit object open override package "
+        "private protected public return sealed suspend throw try typealias val var when while",
+        "true false null this",
+        ("//",), (("/*", "*/"),), ('"', "'"), ('"""',)),
+    "PHP": (
+        "abstract and as break case catch class clone const continue declare default do echo "
+        "else elseif extends final finally fn for foreach function global if implements include "
+        "instanceof interface namespace new or print private protected public require return "
+        "static switch throw trait try use var while yield",
+        "true false null TRUE FALSE NULL",
+        ("//", "#"), (("/*", "*/"),), ('"', "'"), ()),
+    "Ruby": (
+        "alias and begin break case class def defined do else elsif end ensure for if in "
+        "module next not or redo rescue retry return then undef unless until when while yield",
+        "true false nil self",
+        ("#",), (("=begin", "=end"),), ('"', "'"), ()),
+    "SQL": (
+        "select from where and or not insert into values update set delete create table drop "
+        "alter index view join inner left right outer full on as group by order having limit "
+        "offset union all distinct case when then else end primary key foreign references "
+        "default unique check begin commit rollback transaction with in is like between exists",
+        "null true false",
+        ("--",), (("/*", "*/"),), ("'", '"'), ()),
+    "HTML": ("", "", (), (("<!--", "-->"),), ('"', "'"), ()),
+    "CSS": (
+        "important media import keyframes font-face supports",
+        "inherit initial unset none auto",
+        (), (("/*", "*/"),), ('"', "'"), ()),
+}
+
+_NUMBER_PATTERN = r'\b(?:0[xX][0-9a-fA-F_]+|\d[\d_]*(?:\.\d+)?(?:[eE][+-]?\d+)?)\b'
+
+
+class LineLexer:
+    """Tokenizes one line at a time for a language.
+
+    State 0 is plain code; state n > 0 means the line starts inside the
+    n-th open construct (a block comment or a multi-line string).
+    """
+
+    def __init__(self, language):
+        keywords, constants, line_comments, block_comments, quotes, multiline = \
+            SYNTAX.get(language, ("", "", (), (), ('"', "'"), ()))
+        # (kind, closing regex) per open construct; the state is index + 1
+        self.constructs = []
+        parts = []
+        for start, end in block_comments:
+            parts.append(f"(?P<open{len(self.constructs)}>{re.escape(start)})")
+            self.constructs.append(("comment", re.compile(r'.*?' + re.escape(end), re.DOTALL)))
+        for delimiter in multiline:
+            parts.append(f"(?P<open{len(self.constructs)}>{re.escape(delimiter)})")
+            self.constructs.append(("string", re.compile(r'(?:\\.|[^\\])*?' + re.escape(delimiter))))
+        if line_comments:
+            parts.append("(?P<comment>" + "|".join(re.escape(m) for m in line_comments) + ").*")
+        if quotes:
+            parts.append("(?P<string>" + "|".join(
+                f"{re.escape(q)}(?:\\\\.|[^{re.escape(q)}\\\\])*{re.escape(q)}?" for q in quotes) + ")")
+        if language == "Python":
+            parts.append(r"(?P<decorator>@[\w.]+)")
+        parts.append(f"(?P<number>{_NUMBER_PATTERN})")
+        parts.append(r"(?P<word>[A-Za-z_][\w\-]*)" if language == "CSS" else r"(?P<word>[A-Za-z_]\w*)")
+        self.pattern = re.compile("|".join(parts))
+        # SQL keywords are written in either case
+        self.fold = language == "SQL"
+        self.keywords = frozenset(keywords.split())
+        self.constants = frozenset(constants.split())
+
+    def lex(self, line, state=0):
+        """([(kind, start, end)], state at the end of the line)"""
+        tokens = []
+        position = 0
+        if state:
+            kind, closing = self.constructs[state - 1]
+            match = closing.match(line)
+            if match is None:
+                if line:
+                    tokens.append((kind, 0, len(line)))
+                return tokens, state
+            tokens.append((kind, 0, match.end()))
+            position = match.end()
+
+        search = self.pattern.search
+        keywords, constants, fold = self.keywords, self.constants, self.fold
+        while True:
+            match = search(line, position)
+            if match is None:
+                return tokens, 0
+            group = match.lastgroup
+            start, position = match.span()
+            if group == "word":
+                word = match.group()
+                if fold:
+                    word = word.lower()
+                if word in keywords:
+                    tokens.append(("keyword", start, position))
+                elif word in constants:
+                    tokens.append(("constant", start, position))
+            elif group.startswith("open"):
+                index = int(group[4:])
+                kind, closing = self.constructs[index]
+                end = closing.match(line, position)
+                if end is None:
+                    tokens.append((kind, start, len(line)))
+                    return tokens, index + 1
+                tokens.append((kind, start, end.end()))
+                position = end.end()
+            else:
+                tokens.append((group, start, position))
+            if position == start:
+                position += 1
+
+
+class Highlighter:
+    """Per-line lexer states for one buffer, kept up to date across edits"""
+
+    def __init__(self, language):
+        self.set_language(language)
+
+    def set_language(self, language):
+        self.language = language
+        self.lexer = LineLexer(language)
+        self.reset()
+
+    def reset(self):
+        """Forget every cached state, as for a new buffer"""
+        # _starts[n] is the state line n starts in. The first _valid are
+        # known to be right; between an edit and the next highlight() the
+        # rest are from before the edit and are trusted again once
+        # re-lexing arrives at the same state.
+        self._starts = [0]
+        self._valid = 1
+        self._edit_end = 0      # lines before this were edited and must be re-lexed
+
+    def lines_changed(self, first, old_count, new_count):
+        """Lines first..first+old_count-1 were replaced by new_count lines.
+
+        An edit within a single line is lines_changed(line, 1, 1); inserting
+        a newline in it is lines_changed(line, 1, 2).
+        """
+        starts = self._starts
+        if first >= len(starts):
+            return
+        if first + old_count >= len(starts):
+            del starts[first + 1:]
+        else:
+            starts[first + 1:first + old_count] = [0] * (new_count - 1)
+            shift = new_count - old_count
+            if self._edit_end > first + old_count:
+                self._edit_end += shift
+        self._edit_end = max(self._edit_end, first + new_count)
+        self._valid = min(self._valid, first + 1)
+
+    def _advance(self, line, state):
+        """Record that line ends in state, the line after it being the first not yet valid"""
+        starts = self._starts
+        following = line + 1
+        if following < len(starts):
+            if following >= self._edit_end and starts[following] == state:
+                # Back in step with the text before the edit: the rest still holds
+                self._valid = len(starts)
+                self._edit_end = 0
+                return
+            starts[following] = state
+        else:
+            starts.append(state)
+        self._valid = following + 1
+
+    def validate(self, last, get_lines):
+        """Bring the start states of lines up to last up to date"""
+        self._catch_up(last, get_lines)
+        self._drop_stale()
+
+    def _catch_up(self, last, get_lines):
+        lex = self.lexer.lex
+        lexed = 0
+        while self._valid <= last:
+            line = self._valid - 1
+            texts = get_lines(line, min(last, line + _CHUNK))
+            if not texts:
+                break           # past the end of the buffer
+            for text in texts:
+                self._advance(line, lex(text, self._starts[line])[1])
+                lexed += 1
+                if self._valid != line + 2:
+                    break
+                line += 1
+        metrics.count("highlight.lines_lexed", lexed)
+
+    def highlight(self, first, last, get_lines):
+        """(line, tokens) for lines first..last-1"""
+        self._catch_up(first, get_lines)
+        first = min(first, self._valid - 1)
+        lex = self.lexer.lex
+        for line, text in enumerate(get_lines(first, last), first):
+            tokens, state = lex(text, self._starts[line])
+            if line + 1 == self._valid:
+                self._advance(line, state)
+            yield line, tokens
+        self._drop_stale()
+
+    def _drop_stale(self):
+        # States after a run of re-lexing that never got back in step with
+        # them are no longer a consistent chain; work them out afresh later
+        del self._starts[self._valid:]
+        self._edit_end = 0
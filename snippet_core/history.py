@@ -0,0 +1,439 @@
+"""Revision history of snippet code.
+
+Every save of an existing snippet appends a revision to the snippet's
+log in .history/<id>.hist; the first save also records the version it
+replaces. Most revisions are stored as a line delta against the one
+before (the line ranges kept and the lines added, zlib-compressed), so
+a log grows by about the size of each change. Every KEYFRAME_INTERVAL
+revisions, or whenever a delta would be nearly as big, a full copy is
+stored instead, so any revision is rebuilt from at most
+KEYFRAME_INTERVAL - 1 deltas.
+
+    preamble    b"SNIPHIST", format version
+    revision    number, time, kind (full/delta), metadata length,
+                payload length, metadata JSON, zlib payload
+
+collect() thins logs out according to the retention policy below and
+drops the logs of deleted snippets, rewriting each log it changes.
+
+Processes sharing a library write history under .history/lock, and a
+cached log is read again once its file changed, so each revision is a
+delta against what really is the newest one.
+"""
+import difflib
+import json
+import os
+import struct
+import time
+import zlib
+from collections import OrderedDict
+
+from .locking import FileLock
+
+HISTORY_DIRNAME = ".history"
+HISTORY_EXTENSION = ".hist"
+HISTORY_VERSION = 1
+
+_MAGIC = b"SNIPHIST"
+_PREAMBLE = struct.Struct("<8sI")       # magic, version
+_HEADER = struct.Struct("<IdBHI")       # number, time, kind, metadata length, payload length
+
+FULL, DELTA = 0, 1
+
+# Longest chain of deltas between full copies
+KEYFRAME_INTERVAL = 16
+# A delta at least this fraction of a full copy is stored as a full copy
+DELTA_RATIO = 0.5
+# Larger code is not versioned
+MAX_REVISION_SIZE = 1024 * 1024
+COMPRESSION_LEVEL = 6
+
+# Retention: every revision of the last KEEP_ALL_DAYS, then the last one of
+# each day up to KEEP_DAILY_DAYS, then the last one of each 30 days. The
+# newest revision is always kept, and never more than MAX_REVISIONS.
+KEEP_ALL_DAYS = 7
+KEEP_DAILY_DAYS = 90
+MAX_REVISIONS = 100
+# History of a deleted snippet is kept this long after its last revision
+DELETED_RETENTION_DAYS = 30
+# collect_due() is True once this long has passed since the last collect()
+COLLECT_INTERVAL = 24 * 3600
+
+_DAY = 24 * 3600
+_COLLECTED_STAMP = "collected"
+_LOCK_FILENAME = "lock"
+
+
+def _log_key(path):
+    """Changes whenever a log is appended to or rewritten"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class HistoryError(Exception):
+    """A revision that does not exist, or a damaged log"""
+
+
+class Revision:
+    """One stored version of a snippet's code"""
+    __slots__ = ("number", "time", "kind", "title", "language", "size", "offset", "length")
+
+    def __init__(self, number, when, kind, meta, offset, length):
+        self.number = number
+        self.time = when
+        self.kind = kind
+        self.title = meta.get("title", "")
+        self.language = meta.get("language", "")
+        self.size = meta.get("size", 0)
+        self.offset = offset        # of the payload in the log
+        self.length = length
+
+    def to_dict(self):
+        return {"number": self.number, "time": self.time, "title": self.title,
+                "language": self.language, "size": self.size,
+                "kind": "full" if self.kind == FULL else "delta"}
+
+    def __repr__(self):
+        return f"Revision({self.number}, {self.title!r})"
+
+
+def make_delta(base_lines, lines):
+    """Ops turning base_lines into lines: [start, end] copies a range of
+    base_lines, a list of strings inserts them"""
+    ops = []
+    matcher = difflib.SequenceMatcher(None, base_lines, lines)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append(lines[j1:j2])
+    return ops
+
+
+def apply_delta(base_lines, ops):
+    lines = []
+    for op in ops:
+        if len(op) == 2 and isinstance(op[0], int):
+            lines.extend(base_lines[op[0]:op[1]])
+        else:
+            lines.extend(op)
+    return lines
+
+
+class RevisionStore:
+    """Per-snippet revision logs in a library's .history folder"""
+
+    def __init__(self, base_dir):
+        self.root = os.path.join(base_dir, HISTORY_DIRNAME)
+        self._revisions = OrderedDict()     # snippet id -> [Revision], recently used last
+        self._latest = OrderedDict()        # snippet id -> (number, lines) of the newest revision
+        self._keys = {}                     # snippet id -> _log_key of the cached log
+        self.cache_size = 64
+
+    def _write_lock(self):
+        """Held while writing, so other processes don't write the same logs at once"""
+        os.makedirs(self.root, exist_ok=True)
+        return FileLock(os.path.join(self.root, _LOCK_FILENAME))
+
+    def path(self, snippet_id):
+        return os.path.join(self.root, f"{snippet_id}{HISTORY_EXTENSION}")
+
+    def has_history(self, snippet_id):
+        return os.path.exists(self.path(snippet_id))
+
+    # ------------------------------------------------------------------
+    # Reading
+
+    def _remember(self, cache, key, value):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    def _scan(self, path):
+        """Every revision in a log, read from the headers without decompressing"""
+        revisions = []
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            preamble = f.read(_PREAMBLE.size)
+            if len(preamble) < _PREAMBLE.size or _PREAMBLE.unpack(preamble)[0] != _MAGIC:
+                raise HistoryError(f"{path} is not a revision log")
+            while True:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    # A revision cut short by a crash is dropped
+                    break
+                number, when, kind, meta_length, length = _HEADER.unpack(header)
+                meta = f.read(meta_length)
+                offset = f.tell()
+                if len(meta) < meta_length or f.seek(length, os.SEEK_CUR) > size:
+                    break
+                revisions.append(Revision(number, when, kind, json.loads(meta.decode('utf-8')),
+                                          offset, length))
+        return revisions
+
+    def _log(self, snippet_id):
+        revisions = self._revisions.get(snippet_id)
+        path = self.path(snippet_id)
+        key = _log_key(path)
+        if revisions is None or key != self._keys.get(snippet_id):
+            # Not cached, or written by another process since
+            self._forget(snippet_id)
+            revisions = self._scan(path) if key is not None else []
+            self._remember(self._revisions, snippet_id, revisions)
+            self._keys[snippet_id] = key
+        return revisions
+
+    def revisions(self, snippet_id):
+        """The snippet's revisions, oldest first; empty if it has none"""
+        return list(self._log(snippet_id))
+
+    def _find(self, revisions, number):
+        for position, revision in enumerate(revisions):
+            if revision.number == number:
+                return position
+        raise HistoryError(f"No revision {number}")
+
+    def _lines(self, snippet_id, number, revisions=None):
+        """The lines of a revision, rebuilt from the full copy before it"""
+        revisions = revisions if revisions is not None else self._log(snippet_id)
+        latest = self._latest.get(snippet_id)
+        if latest is not None and latest[0] == number:
+            return latest[1]
+        position = self._find(revisions, number)
+        start = position
+        while revisions[start].kind != FULL:
+            start -= 1
+            if start < 0:
+                raise HistoryError(f"Revision {number} has no full copy before it")
+        lines = None
+        with open(self.path(snippet_id), 'rb') as f:
+            for revision in revisions[start:position + 1]:
+                f.seek(revision.offset)
+                payload = zlib.decompress(f.read(revision.length)).decode('utf-8')
+                if revision.kind == FULL:
+                    lines = payload.splitlines(keepends=True)
+                else:
+                    lines = apply_delta(lines, json.loads(payload))
+        return lines
+
+    def text(self, snippet_id, number):
+        """The code of one revision"""
+        return "".join(self._lines(snippet_id, number))
+
+    def diff(self, snippet_id, old, new=None, context=3):
+        """Unified diff lines from revision old to revision new, or to the code
+        given as a string in new, or to the newest revision if new is None"""
+        revisions = self._log(snippet_id)
+        if not revisions:
+            return []
+        old_lines = self._lines(snippet_id, old, revisions)
+        if isinstance(new, str):
+            new_lines, new_name = new.splitlines(keepends=True), "current"
+        else:
+            new = revisions[-1].number if new is None else new
+            new_lines, new_name = self._lines(snippet_id, new, revisions), f"revision {new}"
+        return list(difflib.unified_diff(old_lines, new_lines, f"revision {old}", new_name,
+                                         n=context))
+
+    # ------------------------------------------------------------------
+    # Writing
+
+    def _encode(self, lines, base_lines, since_full):
+        """(kind, payload) for a revision following one with base_lines"""
+        full = zlib.compress("".join(lines).encode('utf-8'), COMPRESSION_LEVEL)
+        if base_lines is None or since_full >= KEYFRAME_INTERVAL - 1:
+            return FULL, full
+        delta = zlib.compress(json.dumps(make_delta(base_lines, lines)).encode('utf-8'),
+                              COMPRESSION_LEVEL)
+        if len(delta) >= len(full) * DELTA_RATIO:
+            return FULL, full
+        return DELTA, delta
+
+    @staticmethod
+    def _write_revision(f, number, when, kind, meta, payload):
+        meta = json.dumps(meta, ensure_ascii=False).encode('utf-8')
+        f.write(_HEADER.pack(number, when, kind, len(meta), len(payload)))
+        f.write(meta)
+        offset = f.tell()
+        f.write(payload)
+        return offset
+
+    def _append(self, snippet_id, revisions, text, title, language, when):
+        lines = text.splitlines(keepends=True)
+        if revisions:
+            base_lines = self._lines(snippet_id, revisions[-1].number, revisions)
+            if base_lines == lines:
+                return None
+            since_full = 0
+            for revision in reversed(revisions):
+                if revision.kind == FULL:
+                    break
+                since_full += 1
+            number = revisions[-1].number + 1
+        else:
+            base_lines, since_full, number = None, 0, 1
+        kind, payload = self._encode(lines, base_lines, since_full)
+        meta = {"title": title, "language": language, "size": len(text.encode('utf-8'))}
+        path = self.path(snippet_id)
+        if not revisions:
+            os.makedirs(self.root, exist_ok=True)
+        with open(path, 'ab') as f:
+            if f.tell() == 0:
+                f.write(_PREAMBLE.pack(_MAGIC, HISTORY_VERSION))
+            offset = self._write_revision(f, number, when, kind, meta, payload)
+        revision = Revision(number, when, kind, meta, offset, len(payload))
+        revisions.append(revision)
+        self._remember(self._latest, snippet_id, (number, lines))
+        self._keys[snippet_id] = _log_key(path)
+        return revision
+
+    def record(self, snippet_id, text, title="", language="", previous=None, when=None):
+        """Add text as the snippet's newest revision, unless it is unchanged.
+
+        previous is (path, title, language, time) of the version text
+        replaces; it is recorded first if the snippet has no history yet.
+        Returns the new Revision, or None.
+        """
+        if len(text) > MAX_REVISION_SIZE:
+            return None
+        with self._write_lock():
+            return self._record(snippet_id, text, title, language, previous, when)
+
+    def _record(self, snippet_id, text, title, language, previous, when):
+        revisions = self._log(snippet_id)
+        if not revisions and previous is not None:
+            path, old_title, old_language, old_time = previous
+            try:
+                with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                    old_text = f.read(MAX_REVISION_SIZE + 1)
+            except OSError:
+                old_text = None
+            if old_text is not None and len(old_text) <= MAX_REVISION_SIZE:
+                self._append(snippet_id, revisions, old_text, old_title, old_language, old_time)
+        return self._append(snippet_id, revisions, text, title, language,
+                            time.time() if when is None else when)
+
+    def extend(self, snippet_id, text, title="", language=""):
+        """record() for a snippet that already has history, otherwise nothing"""
+        if len(text) > MAX_REVISION_SIZE or not self.has_history(snippet_id):
+            return None
+        with self._write_lock():
+            if not self._log(snippet_id):
+                return None
+            return self._record(snippet_id, text, title, language, None, None)
+
+    # ------------------------------------------------------------------
+    # Retention
+
+    @staticmethod
+    def retained(revisions, now):
+        """Numbers of the revisions the retention policy keeps"""
+        if not revisions:
+            return set()
+        keep = {revisions[-1].number}
+        buckets = {}
+        for revision in revisions:
+            age = now - revision.time
+            if age < KEEP_ALL_DAYS * _DAY:
+                keep.add(revision.number)
+                continue
+            span = _DAY if age < KEEP_DAILY_DAYS * _DAY else 30 * _DAY
+            # Later revisions overwrite earlier ones: the last of each period stays
+            buckets[(span, int(revision.time // span))] = revision.number
+        keep.update(buckets.values())
+        return set(sorted(keep)[-MAX_REVISIONS:])
+
+    def collect_due(self, now=None):
+        stamp = os.path.join(self.root, _COLLECTED_STAMP)
+        if not os.path.isdir(self.root):
+            return False
+        try:
+            last = os.path.getmtime(stamp)
+        except OSError:
+            return True
+        return (time.time() if now is None else now) - last >= COLLECT_INTERVAL
+
+    def collect(self, live_ids, now=None):
+        """Apply the retention policy to every log; (revisions dropped, bytes freed).
+
+        live_ids are the snippets still in the library; the history of
+        any other snippet goes once it is DELETED_RETENTION_DAYS old.
+        """
+        now = time.time() if now is None else now
+        if not os.path.isdir(self.root):
+            return 0, 0
+        with self._write_lock():
+            return self._collect(live_ids, now)
+
+    def _collect(self, live_ids, now):
+        dropped = freed = 0
+        for name in os.listdir(self.root):
+            stem, extension = os.path.splitext(name)
+            if extension != HISTORY_EXTENSION or not stem.isdigit():
+                continue
+            snippet_id = int(stem)
+            path = self.path(snippet_id)
+            try:
+                size = os.path.getsize(path)
+                revisions = self._scan(path)
+            except (OSError, HistoryError, ValueError):
+                continue
+            if not revisions or (snippet_id not in live_ids and
+                                 now - revisions[-1].time > DELETED_RETENTION_DAYS * _DAY):
+                os.remove(path)
+                self._forget(snippet_id)
+                dropped += len(revisions)
+                freed += size
+                continue
+            keep = self.retained(revisions, now)
+            if len(keep) == len(revisions):
+                continue
+            self._rewrite(snippet_id, revisions, keep)
+            dropped += len(revisions) - len(keep)
+            freed += size - os.path.getsize(path)
+        with open(os.path.join(self.root, _COLLECTED_STAMP), 'w') as f:
+            f.write(str(now))
+        return dropped, freed
+
+    def _rewrite(self, snippet_id, revisions, keep):
+        """Replace a log with one holding only the revisions in keep"""
+        path = self.path(snippet_id)
+        tmp_path = path + ".tmp"
+        lines = written = None
+        since_full = 0
+        with open(path, 'rb') as source, open(tmp_path, 'wb') as f:
+            f.write(_PREAMBLE.pack(_MAGIC, HISTORY_VERSION))
+            for revision in revisions:
+                source.seek(revision.offset)
+                payload = zlib.decompress(source.read(revision.length)).decode('utf-8')
+                if revision.kind == FULL:
+                    lines = payload.splitlines(keepends=True)
+                else:
+                    lines = apply_delta(lines, json.loads(payload))
+                if revision.number not in keep:
+                    continue
+                kind, payload = self._encode(lines, written, since_full)
+                since_full = 0 if kind == FULL else since_full + 1
+                self._write_revision(f, revision.number, revision.time, kind,
+                                     {"title": revision.title, "language": revision.language,
+                                      "size": revision.size}, payload)
+                written = lines
+        os.replace(tmp_path, path)
+        self._forget(snippet_id)
+
+    def _forget(self, snippet_id):
+        self._revisions.pop(snippet_id, None)
+        self._latest.pop(snippet_id, None)
+        self._keys.pop(snippet_id, None)
+
+    def usage(self):
+        """(number of logs, bytes) used by history"""
+        if not os.path.isdir(self.root):
+            return 0, 0
+        sizes = [entry.stat().st_size for entry in os.scandir(self.root)
+                 if entry.name.endswith(HISTORY_EXTENSION)]
+        return len(sizes), sum(sizes)
@@ -0,0 +1,198 @@
+"""Bulk import of existing code trees.
+
+Files are matched to languages through their extension, stored in the
+library's blob store, copied into its language folders and tagged in a
+process pool that uses every core. Metadata is collected in memory and written to
+storage in one go at the end.
+
+The importer never touches storage from its worker threads or processes,
+so a GUI can run scan() and run() in a background thread, show progress
+from the callback, and call finish() on its own thread afterwards.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from .blobs import BlobStore, hash_bytes
+from .languages import EXTENSION_LANGUAGES, sanitize_filename, make_preview, timestamp
+from .tagging import TagEngine
+
+# Directories that never contain snippets worth importing
+SKIPPED_DIRS = {".git", ".hg", ".svn", "node_modules", "__pycache__",
+                ".venv", "venv", ".tox", ".mypy_cache", ".pytest_cache"}
+
+# Files larger than this are skipped (generated code, dumps, ...)
+MAX_IMPORT_SIZE = 5 * 1024 * 1024
+
+# Number of files handed to a worker process at a time
+CHUNK_SIZE = 32
+
+_worker_engine = None
+
+
+def _init_worker(rules):
+    global _worker_engine
+    _worker_engine = TagEngine(rules)
+
+
+def _import_file(job, engine=None):
+    """Copy one file into the library and tag it. Runs in a worker process"""
+    source, target, language, title, blobs = job
+    engine = engine or _worker_engine
+    try:
+        with open(source, 'r', encoding='utf-8') as f:
+            code = f.read()
+    except (OSError, UnicodeDecodeError) as e:
+        return source, None, str(e)
+
+    code = code.strip()
+    if not code:
+        return source, None, "empty file"
+    data = code.encode('utf-8')
+    digest = hash_bytes(data)
+    try:
+        blobs.put(data, digest)
+        blobs.checkout(digest, target)
+    except OSError as e:
+        return source, None, str(e)
+
+    snippet = {
+        "title": title,
+        "language": language,
+        "filename": os.path.basename(target),
+        "filepath": target,
+        "extension": os.path.splitext(target)[1],
+        "tags": engine.generate(code, language, title),
+        "code_preview": make_preview(code),
+        "created": timestamp(),
+        "content_hash": digest,
+    }
+    return source, snippet, None
+
+
+def _import_chunk(jobs):
+    return [_import_file(job) for job in jobs]
+
+
+class ImportResult:
+    def __init__(self, total=0):
+        self.total = total
+        self.processed = 0
+        self.snippets = []
+        self.skipped = []       # [(path, reason)]
+        self.cancelled = False
+
+
+class BulkImporter:
+    """Walks a directory tree and turns its code files into snippets"""
+
+    def __init__(self, base_dir, tag_engine, extension_languages=None, workers=None):
+        self.base_dir = base_dir
+        self.tag_engine = tag_engine
+        self.extension_languages = extension_languages or EXTENSION_LANGUAGES
+        self.workers = workers or os.cpu_count() or 1
+        self.blobs = BlobStore(base_dir)
+        self._taken = {}
+
+    def scan(self, source_dir):
+        """Return [(path, language)] for every importable file under source_dir"""
+        base_dir = os.path.abspath(self.base_dir)
+        files = []
+        for dirpath, dirnames, filenames in os.walk(source_dir):
+            # Never import the library into itself
+            dirnames[:] = [d for d in dirnames
+                           if d not in SKIPPED_DIRS
+                           and os.path.abspath(os.path.join(dirpath, d)) != base_dir]
+            for name in filenames:
+                language = self.extension_languages.get(os.path.splitext(name)[1].lower())
+                if language:
+                    files.append((os.path.join(dirpath, name), language))
+        return files
+
+    def _target_path(self, title, language, extension):
+        """Unique destination path in the language folder"""
+        folder = os.path.join(self.base_dir, language)
+        taken = self._taken.get(folder)
+        if taken is None:
+            os.makedirs(folder, exist_ok=True)
+            taken = self._taken[folder] = set(os.listdir(folder))
+        stem = sanitize_filename(title)
+        filename = stem + extension
+        counter = 2
+        while filename in taken:
+            filename = f"{stem}_{counter}{extension}"
+            counter += 1
+        taken.add(filename)
+        return os.path.join(folder, filename)
+
+    def run(self, files, progress=None, cancel_event=None):
+        """Copy and tag the scanned files.
+
+        progress(done, total, path) is called after each file, from the
+        calling thread. Setting cancel_event stops the import early.
+        """
+        result = ImportResult()
+        jobs = []
+        for path, language in files:
+            try:
+                if os.path.getsize(path) > MAX_IMPORT_SIZE:
+                    result.skipped.append((path, "too large"))
+                    continue
+            except OSError as e:
+                result.skipped.append((path, str(e)))
+                continue
+            title, extension = os.path.splitext(os.path.basename(path))
+            jobs.append((path, self._target_path(title, language, extension.lower()),
+                         language, title, self.blobs))
+
+        result.total = len(jobs)
+        if self.workers > 1 and len(jobs) > CHUNK_SIZE:
+            self._run_parallel(jobs, result, progress, cancel_event)
+        else:
+            for job in jobs:
+                self._collect([_import_file(job, self.tag_engine)], result, progress, cancel_event)
+                if result.cancelled:
+                    break
+        return result
+
+    def _run_parallel(self, jobs, result, progress, cancel_event):
+        chunks = iter([jobs[i:i + CHUNK_SIZE] for i in range(0, len(jobs), CHUNK_SIZE)])
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=(self.tag_engine.rules,)) as executor:
+            # Keep a bounded number of chunks in flight so cancelling is quick
+            in_flight = set()
+            while True:
+                while not result.cancelled and len(in_flight) < self.workers * 2:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    in_flight.add(executor.submit(_import_chunk, chunk))
+                if not in_flight:
+                    break
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    self._collect(future.result(), result, progress, cancel_event)
+
+    def _collect(self, results, result, progress, cancel_event):
+        for source, snippet, error in results:
+            result.processed += 1
+            if snippet is not None:
+                result.snippets.append(snippet)
+            else:
+                result.skipped.append((source, error))
+            if progress:
+                progress(result.processed, result.total, source)
+        if cancel_event is not None and cancel_event.is_set():
+            result.cancelled = True
+
+    def finish(self, result, storage):
+        """Write all imported metadata to storage in a single batch"""
+        storage.insert_many(result.snippets)
+        return result.snippets
+
+
+def import_tree(source_dir, base_dir, storage, tag_engine=None, progress=None, workers=None):
+    """Scan, copy, tag and store a whole tree in one call"""
+    importer = BulkImporter(base_dir, tag_engine or TagEngine.load(), workers=workers)
+    result = importer.run(importer.scan(source_dir), progress)
+    importer.finish(result, storage)
+    return result
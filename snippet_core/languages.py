@@ -0,0 +1,48 @@
+"""Supported languages and the naming rules for snippet files"""
+import re
+from datetime import datetime
+
+# File extensions mapping
+LANGUAGE_EXTENSIONS = {
+    "Python": ".py",
+    "JavaScript": ".js",
+    "Java": ".java",
+    "C++": ".cpp",
+    "HTML": ".html",
+    "CSS": ".css",
+    "SQL": ".sql",
+    "Ruby": ".rb",
+    "Go": ".go",
+    "Rust": ".rs",
+    "TypeScript": ".ts",
+    "PHP": ".php",
+    "C": ".c",
+    "C#": ".cs",
+    "Swift": ".swift",
+    "Kotlin": ".kt",
+    "Other": ".txt"
+}
+
+# Reverse mapping used when importing existing files
+EXTENSION_LANGUAGES = {ext: language for language, ext in LANGUAGE_EXTENSIONS.items()}
+
+PREVIEW_LENGTH = 100
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def sanitize_filename(title):
+    """Convert title to valid filename"""
+    # Remove invalid characters
+    valid = re.sub(r'[<>:"/\\|?*]', '', title)
+    # Replace spaces with underscores
+    valid = valid.replace(' ', '_')
+    return valid if valid else "untitled"
+
+
+def make_preview(code):
+    """Short text shown on the snippet card"""
+    return code[:PREVIEW_LENGTH] + "..." if len(code) > PREVIEW_LENGTH else code
+
+
+def timestamp():
+    return datetime.now().strftime(TIMESTAMP_FORMAT)
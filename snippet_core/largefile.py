@@ -0,0 +1,116 @@
+"""Paged access to snippet files too large to load into the editor at once.
+
+A PagedFile memory-maps the file and hands it out one page at a time, so
+the editor only decodes and displays what the user has scrolled to. On
+save, the edited text of the loaded pages is written out followed by the
+untouched rest of the file, copied straight from the mapping; the rest
+is never decoded. Unmodified files are not rewritten at all.
+"""
+import mmap
+import os
+
+# Files bigger than this open in paged mode
+LARGE_FILE_THRESHOLD = 1024 * 1024
+
+# Roughly how much text is loaded per page; pages end on a line break
+PAGE_SIZE = 256 * 1024
+
+# Lines longer than this (minified code, dumps) are split mid-line
+MAX_PAGE_SIZE = 4 * PAGE_SIZE
+
+COPY_BLOCK = 1024 * 1024
+
+
+def is_large(filepath, threshold=LARGE_FILE_THRESHOLD):
+    try:
+        return os.path.getsize(filepath) > threshold
+    except OSError:
+        return False
+
+
+class PagedFile:
+    """A read-only, memory-mapped file read forward one page at a time"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self.size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+        self.offset = 0     # bytes handed out so far
+
+    @property
+    def at_end(self):
+        return self.offset >= self.size
+
+    def _page_end(self, start):
+        end = start + PAGE_SIZE
+        if end >= self.size:
+            return self.size
+        newline = self._map.find(b"\n", end, start + MAX_PAGE_SIZE)
+        if newline >= 0:
+            return newline + 1
+        # No line break nearby; cut anywhere that isn't inside a UTF-8 sequence
+        end = start + MAX_PAGE_SIZE
+        if end >= self.size:
+            return self.size
+        while end > start and self._map[end] & 0xC0 == 0x80:
+            end -= 1
+        return end
+
+    def read_page(self):
+        """Text of the next page, or "" once the whole file has been read"""
+        if self.at_end:
+            return ""
+        end = self._page_end(self.offset)
+        text = self._map[self.offset:end].decode('utf-8', errors='replace')
+        self.offset = end
+        return text
+
+    def splice(self, head, modified=True):
+        """The file with everything read so far replaced by head, ready to save"""
+        return SplicedText(self, head, self.offset, modified)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class SplicedText:
+    """Edited head text followed by the unread tail of a PagedFile.
+
+    Library writes accept this in place of a code string. Writing it
+    closes the PagedFile.
+    """
+
+    def __init__(self, source, head, tail_offset, modified=True):
+        self.source = source
+        self.head = head
+        self.tail_offset = tail_offset
+        self.modified = modified
+
+    def write(self, filepath):
+        source = self.source
+        if not self.modified:
+            source.close()
+            if os.path.abspath(filepath) != os.path.abspath(source.path):
+                os.replace(source.path, filepath)
+            return
+
+        # Stream into a temp file; the source may be the file being replaced
+        tmp_path = filepath + ".tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(self.head.encode('utf-8'))
+                for start in range(self.tail_offset, source.size, COPY_BLOCK):
+                    f.write(source._map[start:min(start + COPY_BLOCK, source.size)])
+        finally:
+            source.close()
+        os.replace(tmp_path, filepath)
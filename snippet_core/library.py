@@ -0,0 +1,1084 @@
+"""The snippet library: storage, search, tagging and files behind one API.
+
+SnippetLibrary has no UI dependencies. The Tk app, the command line
+tool and scripts all go through it, so creating, updating and deleting a
+snippet keeps the code file, the metadata store and the search index in
+step no matter who makes the change.
+
+In-memory state and the search index change immediately. File writes,
+deletes and metadata writes go through an I/O executor: synchronous by
+default, or a BackgroundIO worker in the GUI. Metadata changes are
+buffered and written to storage in one batch, so several quick edits
+cost a single flush.
+
+With load=False the metadata is not read up front: load_in_background()
+reads it and the search index on the I/O worker, while open_snapshot()
+gives the cards saved at the last close for the first screen.
+
+Several processes may use one library folder at once. New ids come from
+blocks reserved in storage, and merge_changes() folds in what the other
+processes saved since the last call, one snippet at a time.
+"""
+import json
+import os
+import shutil
+import threading
+import time
+from collections import Counter
+
+from . import languages
+from .background import SynchronousIO
+from .blobs import BlobStore, hash_bytes, hash_file
+from .browse import BrowseIndex, SORT_KEYS, valid_cursor
+from .importer import BulkImporter
+from .largefile import PagedFile, SplicedText, is_large
+from .metrics import metrics
+from .pack import PackImporter, export_pack
+from .reconcile import Reconciler, ReconcileResult
+from .records import Snippet, SnippetCollection
+from .fuzzy import FuzzyIndex
+from .history import RevisionStore, HistoryError
+from .search import SearchIndex, INDEX_FILENAME, with_fuzzy
+from .similarity import SimilarityIndex
+from .snapshot import Snapshot, write_snapshot
+from .storage import open_storage, storage_stamp, copy_snippet
+from .tagging import TagEngine, TagMemo
+
+DEFAULT_LIBRARY_DIR = "Code_Snippets"
+USER_RULES_FILENAME = "tag_rules.json"
+
+# How long metadata changes may wait so that rapid edits share one write
+FLUSH_DELAY = 0.25
+
+# Ids reserved from storage at a time, and how few may be left before
+# the next block is reserved in the background
+ID_BLOCK = 16
+ID_LOW = ID_BLOCK // 2
+
+
+class SnippetError(Exception):
+    """Base class for library errors"""
+
+
+class SnippetExistsError(SnippetError):
+    """A new snippet would overwrite an existing file"""
+
+    def __init__(self, filepath):
+        super().__init__(f"File '{os.path.basename(filepath)}' already exists")
+        self.filepath = filepath
+
+
+class SnippetNotFoundError(SnippetError, KeyError):
+    def __init__(self, snippet_id):
+        super().__init__(f"No snippet with id {snippet_id}")
+        self.snippet_id = snippet_id
+
+    def __str__(self):
+        return self.args[0]
+
+
+class _SnippetView:
+    """A sequence of snippet ids read as the snippets themselves. A
+    BrowseView keeps up with deletes, so its ids are always in by_id"""
+
+    def __init__(self, ids, by_id):
+        self.ids = ids
+        self.by_id = by_id
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.by_id[snippet_id] for snippet_id in self.ids[index]]
+        return self.by_id[self.ids[index]]
+
+    def __iter__(self):
+        return (self.by_id[snippet_id] for snippet_id in self.ids)
+
+
+class SnippetLibrary:
+    """A folder of code snippets and their metadata"""
+
+    def __init__(self, base_dir=DEFAULT_LIBRARY_DIR, backend="sqlite",
+                 language_extensions=None, io=None, load=True):
+        self.base_dir = base_dir
+        os.makedirs(self.base_dir, exist_ok=True)
+        self.language_extensions = dict(language_extensions or languages.LANGUAGE_EXTENSIONS)
+        self.io = io or SynchronousIO()
+        self.backend = backend
+        # Taken before opening: the snapshot is only valid for this exact store
+        self._stamp = storage_stamp(self.base_dir, backend)
+        self.storage = open_storage(self.base_dir, backend)
+        self.blobs = BlobStore(self.base_dir)
+        self.history = RevisionStore(self.base_dir)
+        self._search_index = None
+        self._browse_index = None
+        self._fuzzy_index = None
+        self._similarity_index = None
+        self._reconciler = None
+        self._tag_engine = None
+        self._tag_memo = None
+        self._pending = {}            # id -> ("insert" | "update" | "delete", snapshot)
+        self._pending_lock = threading.Lock()
+        self._changed = False         # anything queued since opening
+        self.loaded = False
+        self.snippets = SnippetCollection()
+        self.by_id = self.snippets.by_id
+        self._blob_refs = Counter()
+        self._free_ids = []           # reserved in storage, not used yet; next one last
+        self._reserving_ids = False
+        if load:
+            self.reload()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Finish all queued writes and release the storage"""
+        self.flush()
+        self.io.close()
+        # Completion callbacks run by io.close() may have queued more metadata
+        self.flush_metadata()
+        if self._search_index is not None:
+            self._search_index.save()
+        if self._similarity_index is not None:
+            self._similarity_index.save()
+        if self._reconciler is not None:
+            self._reconciler.save()
+        if self._tag_memo is not None:
+            if self.loaded:
+                self._tag_memo.prune(self._blob_refs)
+            self._tag_memo.save()
+        self.storage.close()
+        if self.loaded and (self._changed or not self._snapshot_current()):
+            write_snapshot(self.base_dir, self.snippets, storage_stamp(self.base_dir, self.backend))
+
+    # ------------------------------------------------------------------
+    # Lazily built services; a CLI command only pays for what it uses
+
+    @property
+    def search_index(self):
+        if self._search_index is None:
+            with metrics.span("index.load"):
+                self._search_index = SearchIndex.load(self.base_dir)
+                self._search_index.sync(self.snippets, self.read_code)
+        return self._search_index
+
+    @property
+    def browse_index(self):
+        if self._browse_index is None:
+            self._browse_index = BrowseIndex(self.snippets)
+        return self._browse_index
+
+    @property
+    def fuzzy_index(self):
+        if self._fuzzy_index is None:
+            with metrics.span("fuzzy.build"):
+                self._fuzzy_index = FuzzyIndex(self.snippets)
+        return self._fuzzy_index
+
+    @property
+    def similarity_index(self):
+        if self._similarity_index is None:
+            self._similarity_index = SimilarityIndex.load(self.base_dir)
+            self._similarity_index.sync(self.snippets, self.read_code)
+        return self._similarity_index
+
+    @property
+    def similarity_ready(self):
+        return self._similarity_index is not None
+
+    def warm_similarity_index(self, chunk_size=500, on_done=None):
+        """Build the similarity index on the I/O worker, a chunk at a time.
+
+        Working in chunks keeps saves queued behind the build from waiting
+        long. Until on_done is called, similarity_ready is False.
+        """
+        def loaded(index):
+            build(index, index.stale(self.snippets))
+
+        def build(index, stale):
+            if self._similarity_index is not None:
+                return
+            if not stale:
+                # Catch up with edits made while building
+                index.sync(self.snippets, self.read_code)
+                self._similarity_index = index
+                if on_done is not None:
+                    on_done(index)
+                return
+            chunk, rest = stale[:chunk_size], stale[chunk_size:]
+            self.io.submit(self._index_similarity, index, chunk,
+                           on_done=lambda result: build(index, rest))
+
+        self.io.submit(SimilarityIndex.load, self.base_dir, on_done=loaded)
+
+    def _index_similarity(self, index, snippets):
+        for snippet in snippets:
+            index.update(snippet, self.read_code(snippet))
+
+    @property
+    def tag_engine(self):
+        if self._tag_engine is None:
+            # A tag_rules.json in the library folder overrides the built-in rules
+            rules_path = os.path.join(self.base_dir, USER_RULES_FILENAME)
+            self._tag_engine = TagEngine.load(rules_path if os.path.exists(rules_path) else None)
+        return self._tag_engine
+
+    @property
+    def tag_memo(self):
+        if self._tag_memo is None:
+            self._tag_memo = TagMemo.load(self.base_dir)
+        return self._tag_memo
+
+    # ------------------------------------------------------------------
+    # Reading
+
+    @metrics.timed("load")
+    def reload(self):
+        """Re-read all metadata from storage"""
+        self.flush()
+        self._install(self.io.call(self._read_metadata))
+
+    def _read_metadata(self):
+        return self.storage.load_all()
+
+    def _install(self, snippets):
+        self.snippets = SnippetCollection(snippets)
+        self.by_id = self.snippets.by_id
+        self._browse_index = None
+        self._fuzzy_index = None
+        self._blob_refs = Counter(s['content_hash'] for s in self.snippets
+                                  if s.get('content_hash'))
+        self.loaded = True
+
+    def load_in_background(self, on_done=None):
+        """Read the metadata and search index on the I/O worker.
+
+        Until on_done(library) runs, the library is empty and loaded is
+        False; nothing may be written before then.
+        """
+        def read():
+            with metrics.span("load"):
+                metadata = self._read_metadata()
+            with metrics.span("index.load"):
+                index = SearchIndex.load(self.base_dir)
+                index.sync(metadata, self.read_code)
+                # So the first keystrokes find the common words ready to rank
+                index.warm()
+            with metrics.span("fuzzy.build"):
+                fuzzy = FuzzyIndex(metadata)
+            return metadata, index, fuzzy
+
+        def loaded(result):
+            metadata, index, fuzzy = result
+            self._install(metadata)
+            if self._search_index is None:
+                self._search_index = index
+            self._fuzzy_index = fuzzy
+            if on_done is not None:
+                on_done(self)
+
+        self.io.submit(read, on_done=loaded)
+        # Right behind the load, so the first save never waits for ids
+        self._prefetch_ids()
+
+    def open_snapshot(self):
+        """The card records saved when the library was last closed, or None if
+        the metadata changed since (see snapshot.Snapshot)"""
+        return Snapshot.open(self.base_dir, self._stamp)
+
+    def _snapshot_current(self):
+        snapshot = self.open_snapshot()
+        if snapshot is None:
+            return False
+        snapshot.close()
+        return True
+
+    def get(self, snippet_id):
+        try:
+            return self.by_id[snippet_id]
+        except KeyError:
+            raise SnippetNotFoundError(snippet_id) from None
+
+    @metrics.timed("io.read")
+    def read_code(self, snippet):
+        """Read the code file behind a snippet, empty if it is missing"""
+        filepath = snippet.get('filepath')
+        if filepath and os.path.exists(filepath):
+            with open(filepath, 'r', encoding='utf-8', errors='replace') as f:
+                return f.read()
+        return ""
+
+    def open_paged(self, snippet):
+        """A PagedFile for the snippet's code if it is large, otherwise None"""
+        filepath = snippet.get('filepath')
+        if filepath and is_large(filepath):
+            return PagedFile(filepath)
+        return None
+
+    def target_path(self, title, language):
+        """(filename, filepath) a snippet with this title and language is saved to"""
+        filename = languages.sanitize_filename(title) + self.language_extensions[language]
+        folder = os.path.join(self.base_dir, language)
+        return filename, os.path.join(folder, filename)
+
+    @metrics.timed("search")
+    def search(self, query, limit=None, prefix_last=False, fuzzy=False):
+        """Snippets matching a query, best match first; with fuzzy, snippets
+        whose title, filename or tags nearly match follow when there are few"""
+        results, matched = self.search_index.search_matches(query, limit, prefix_last)
+        if fuzzy:
+            results = with_fuzzy(results, self.fuzzy_index, self.search_index, query,
+                                 prefix_last, limit, len(matched))
+        metrics.count("search.results", len(results))
+        return [self.by_id[doc_id] for doc_id, score in results if doc_id in self.by_id]
+
+    def browse(self, sort="created", descending=None, language=None, tag=None, within=None):
+        """Snippets in sort order ("created", "modified", "title" or "language"),
+        optionally only one language's, one tag's or those with ids in within.
+
+        Returns a lazily filled sequence of snippets, suitable for paging
+        by index; see BrowseIndex.page for cursor-based paging.
+        """
+        if sort not in SORT_KEYS:
+            raise SnippetError(f"Unknown sort key: {sort}")
+        ids = self.facet_ids(language, tag)
+        if ids is not None:
+            within = ids if within is None else ids & set(within)
+        view = self.browse_index.view(sort, descending, within)
+        return _SnippetView(view, self.by_id)
+
+    def page(self, sort="created", descending=None, after=None, limit=60, language=None, tag=None):
+        """([snippets], cursor) for one page of browse(); pass cursor as after for the next"""
+        if sort not in SORT_KEYS:
+            raise SnippetError(f"Unknown sort key: {sort}")
+        if after is not None and not valid_cursor(sort, after):
+            raise SnippetError(f"Not a cursor for sorting by {sort}: {after!r}")
+        ids, cursor = self.browse_index.page(sort, descending, after, limit,
+                                             self.facet_ids(language, tag))
+        return [self.by_id[snippet_id] for snippet_id in ids], cursor
+
+    def facet_ids(self, language=None, tag=None):
+        """Ids of the snippets in a language and/or with a tag; None if neither is given"""
+        # From the browse entries: the search index would read every file to build
+        return self.browse_index.ids(language, tag)
+
+    def facets(self, language=None):
+        """(snippets per language, snippets per tag), tags within language if one is given"""
+        return self.browse_index.facets(language)
+
+    def similar(self, code, threshold=0.5, limit=10, exclude=None):
+        """[(snippet, similarity)] for snippets whose code resembles code"""
+        return [(self.by_id[doc_id], similarity)
+                for doc_id, similarity in self.similarity_index.similar(code, threshold,
+                                                                        limit, exclude)
+                if doc_id in self.by_id]
+
+    @metrics.timed("tag")
+    def generate_tags(self, code, language, title="", digest=None):
+        """Tags for code, scanning it only if it wasn't tagged under the current
+        rules before. Safe to call on the I/O worker"""
+        return self.tag_engine.generate(code, language, title, self.tag_memo, digest)
+
+    # ------------------------------------------------------------------
+    # Writing
+
+    @metrics.timed("io.write")
+    def _write_code(self, filepath, code, digest=None, old_filepath=None, garbage=None):
+        """Store code as a blob and point filepath at it. Returns the digest.
+
+        code is bytes, a SplicedText, or None when the blob is already stored.
+        """
+        if isinstance(code, SplicedText):
+            tmp_path = self.blobs.temp_path()
+            code.write(tmp_path)
+            digest = self.blobs.adopt(tmp_path)
+        elif code is not None:
+            self.blobs.put(code, digest)
+        self.blobs.checkout(digest, filepath)
+        # Delete old file if name/language changed
+        if old_filepath and old_filepath != filepath and os.path.exists(old_filepath):
+            os.remove(old_filepath)
+        if garbage:
+            self.blobs.remove(garbage)
+        return digest
+
+    @metrics.timed("io.remove")
+    def _remove_file(self, filepath, garbage=None):
+        if filepath and os.path.exists(filepath):
+            os.remove(filepath)
+        if garbage:
+            self.blobs.remove(garbage)
+
+    def _release_blob(self, digest):
+        """Drop one reference to a blob; returns the digest if it became unused"""
+        if not digest or digest not in self._blob_refs:
+            return None
+        self._blob_refs[digest] -= 1
+        if self._blob_refs[digest] > 0:
+            return None
+        del self._blob_refs[digest]
+        return digest
+
+    def _save_code(self, snippet, code, old_filepath, old_hash, on_done, on_error):
+        """Queue the write of a snippet's code and update its content_hash"""
+        if isinstance(code, SplicedText) and not code.modified and old_hash:
+            # Unchanged large file: nothing to write, at most a new link
+            code.source.close()
+            code, digest = None, old_hash
+        elif isinstance(code, SplicedText):
+            # The digest is only known once the file has been streamed out
+            digest = None
+            user_on_done = on_done
+
+            def on_done(stored):
+                snippet['content_hash'] = stored
+                if snippet['id'] in self.by_id:
+                    self._blob_refs[stored] += 1
+                    self._queue_change("update", snippet)
+                if user_on_done is not None:
+                    user_on_done(stored)
+        else:
+            code = code.encode('utf-8')
+            digest = hash_bytes(code)
+        if digest:
+            self._blob_refs[digest] += 1
+        snippet['content_hash'] = digest
+        garbage = self._release_blob(old_hash)
+        self.io.submit(self._write_code, snippet['filepath'], code, digest, old_filepath, garbage,
+                       on_done=on_done, on_error=on_error)
+
+    def _allocate_id(self):
+        return self._allocate_ids(1)[0]
+
+    def _allocate_ids(self, count):
+        """New snippet ids, from blocks reserved in storage so that no other
+        process sharing the library hands out the same ones"""
+        if len(self._free_ids) < count:
+            # Only a bulk import, or saves outrunning the prefetch, wait here
+            self._ids_reserved(self.io.call(self.storage.reserve_ids,
+                                            max(ID_BLOCK, count - len(self._free_ids))))
+        ids = self._free_ids[-count:][::-1]
+        del self._free_ids[-count:]
+        self._prefetch_ids()
+        return ids
+
+    def _prefetch_ids(self):
+        """Reserve the next block of ids on the I/O worker once few are left"""
+        if self._reserving_ids or len(self._free_ids) >= ID_LOW:
+            return
+        self._reserving_ids = True
+
+        def reserved(block):
+            self._reserving_ids = False
+            self._ids_reserved(block)
+
+        def failed(error):
+            # Storage busy; the next allocation tries again
+            self._reserving_ids = False
+
+        self.io.submit(self.storage.reserve_ids, ID_BLOCK, on_done=reserved, on_error=failed)
+
+    def _ids_reserved(self, block):
+        first, last = block
+        self._free_ids[:0] = range(last, first - 1, -1)
+
+    def _queue_change(self, kind, snippet):
+        """Buffer a metadata change and schedule a coalesced flush"""
+        snippet_id = snippet['id']
+        self._changed = True
+        for index in (self._browse_index, self._fuzzy_index):
+            if index is None:
+                continue
+            if kind == "delete":
+                index.remove(snippet_id)
+            else:
+                index.update(snippet)
+        with self._pending_lock:
+            previous = self._pending.get(snippet_id)
+            if kind == "delete":
+                if previous and previous[0] == "insert":
+                    # Never reached storage, nothing to delete
+                    del self._pending[snippet_id]
+                else:
+                    self._pending[snippet_id] = ("delete", None)
+            elif previous and previous[0] == "insert":
+                self._pending[snippet_id] = ("insert", copy_snippet(snippet))
+            else:
+                self._pending[snippet_id] = (kind, copy_snippet(snippet))
+        self.io.coalesce("metadata", self.flush_metadata, FLUSH_DELAY)
+
+    @metrics.timed("storage.flush")
+    def flush_metadata(self):
+        """Write all buffered metadata changes to storage. Runs on the I/O thread"""
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        changes = {"insert": [], "update": [], "delete": []}
+        for snippet_id, (kind, snapshot) in pending.items():
+            changes[kind].append(snippet_id if kind == "delete" else snapshot)
+        metrics.count("storage.changes", len(pending))
+        try:
+            self.storage.apply_changes(changes["insert"], changes["update"], changes["delete"])
+        except Exception:
+            # Keep the changes for the next flush unless newer ones replaced them
+            with self._pending_lock:
+                for snippet_id, change in pending.items():
+                    self._pending.setdefault(snippet_id, change)
+            raise
+        if self.storage.needs_compaction():
+            # A job of its own, so this write doesn't wait for the rewrite
+            self.io.coalesce("compact", self.storage.compact, 0)
+
+    def flush(self):
+        """Write buffered metadata now and wait until it is stored"""
+        self.io.flush_deferred()
+        self.io.call(self.flush_metadata)
+
+    @metrics.timed("save.create")
+    def create(self, title, code, language, tags=None, overwrite=False,
+               on_done=None, on_error=None):
+        """Save a new snippet. Tags are generated when none are given.
+
+        code is a string or a SplicedText from a PagedFile. on_done(result) /
+        on_error(exc) are called once the code file is written. With
+        overwrite, a snippet already saved at the same file is updated.
+        """
+        text = code.head if isinstance(code, SplicedText) else code
+        if language not in self.language_extensions:
+            raise SnippetError(f"Unknown language: {language}")
+        filename, filepath = self.target_path(title, language)
+        if not overwrite and os.path.exists(filepath):
+            raise SnippetExistsError(filepath)
+        if tags is None:
+            tags = self.generate_tags(text, language, title)
+        existing = self.snippets.at_path(filepath) if overwrite else None
+        if existing is not None:
+            # One record per file: overwriting saves over the snippet already there
+            return self.update(existing['id'], title, code, language, tags, on_done, on_error)
+
+        snippet = Snippet.from_dict({
+            "id": self._allocate_id(),
+            "title": title,
+            "language": language,
+            "filename": filename,
+            "filepath": filepath,
+            "extension": self.language_extensions[language],
+            "tags": tags,
+            "code_preview": languages.make_preview(text),
+            "created": languages.timestamp()
+        })
+        self._save_code(snippet, code, None, None, on_done, on_error)
+        self.snippets.add(snippet)
+        self._queue_change("insert", snippet)
+        self.search_index.update(snippet, text)
+        if self._similarity_index is not None:
+            self._similarity_index.update(snippet, text)
+        return snippet
+
+    @metrics.timed("save.update")
+    def update(self, snippet_id, title, code, language, tags, on_done=None, on_error=None):
+        """Save new contents for an existing snippet, renaming its file if needed"""
+        snippet = self.get(snippet_id)
+        text = code.head if isinstance(code, SplicedText) else code
+        if language not in self.language_extensions:
+            raise SnippetError(f"Unknown language: {language}")
+        filename, filepath = self.target_path(title, language)
+        old_filepath = snippet.get('filepath')
+        previous = self._revision_source(snippet)
+
+        snippet['title'] = title
+        snippet['language'] = language
+        snippet['filename'] = filename
+        snippet['filepath'] = filepath
+        snippet['extension'] = self.language_extensions[language]
+        snippet['tags'] = tags
+        snippet['code_preview'] = languages.make_preview(text)
+        snippet['modified'] = languages.timestamp()
+        self.snippets.moved(snippet, old_filepath)
+        if not isinstance(code, SplicedText):
+            # Queued ahead of the write, while the code it replaces is still stored
+            self.io.submit(self.history.record, snippet_id, code, title, language, previous)
+        self._save_code(snippet, code, old_filepath, snippet.get('content_hash'), on_done, on_error)
+        self._queue_change("update", snippet)
+        self.search_index.update(snippet, text)
+        if self._similarity_index is not None:
+            self._similarity_index.update(snippet, text)
+        return snippet
+
+    def _revision_source(self, snippet):
+        """(path, title, language, time) of a snippet's current code, for history"""
+        digest = snippet.get('content_hash')
+        path = self.blobs.path(digest) if digest else snippet.get('filepath')
+        stamp = snippet.get('modified') or snippet.get('created')
+        try:
+            when = time.mktime(time.strptime(stamp, languages.TIMESTAMP_FORMAT))
+        except (TypeError, ValueError):
+            when = time.time()
+        return path, snippet['title'], snippet['language'], when
+
+    def revisions(self, snippet_id):
+        """The stored revisions of a snippet's code, oldest first"""
+        return self.io.call(self.history.revisions, snippet_id)
+
+    def revision_text(self, snippet_id, number):
+        try:
+            return self.io.call(self.history.text, snippet_id, number)
+        except HistoryError as e:
+            raise SnippetError(str(e)) from None
+
+    def revision_diff(self, snippet_id, old, new=None):
+        """Unified diff lines from revision old to revision new (a number), to
+        code given as a string, or to the snippet's current code if new is None"""
+        if new is None:
+            new = self.read_code(self.get(snippet_id))
+        try:
+            return self.io.call(self.history.diff, snippet_id, old, new)
+        except HistoryError as e:
+            raise SnippetError(str(e)) from None
+
+    def restore_revision(self, snippet_id, number, on_done=None, on_error=None):
+        """Save an earlier revision's code as the snippet's code; a new revision itself"""
+        snippet = self.get(snippet_id)
+        code = self.revision_text(snippet_id, number)
+        return self.update(snippet_id, snippet['title'], code, snippet['language'],
+                           list(snippet.get('tags', [])), on_done, on_error)
+
+    def collect_history(self, force=False, on_done=None):
+        """Thin out revision history by the retention policy on the I/O worker,
+        at most once a day unless forced. Returns a future of (revisions
+        dropped, bytes freed), or None if it wasn't due"""
+        if not force and not self.history.collect_due():
+            return None
+        return self.io.submit(self.history.collect, set(self.by_id), on_done=on_done)
+
+    @metrics.timed("delete")
+    def delete(self, snippet_id, on_done=None, on_error=None):
+        """Remove a snippet and its file"""
+        snippet = self.get(snippet_id)
+        garbage = self._release_blob(snippet.get('content_hash'))
+        self.io.submit(self._remove_file, snippet.get('filepath'), garbage,
+                       on_done=on_done, on_error=on_error)
+        self._queue_change("delete", snippet)
+        self.search_index.remove(snippet_id)
+        if self._similarity_index is not None:
+            self._similarity_index.remove(snippet_id)
+        self.snippets.remove(snippet_id)
+
+    # ------------------------------------------------------------------
+    # Bulk operations
+
+    def make_importer(self, workers=None):
+        """A BulkImporter for this library; see import_tree for the one-call version"""
+        extension_languages = {ext: lang for lang, ext in self.language_extensions.items()}
+        return BulkImporter(self.base_dir, self.tag_engine, extension_languages, workers)
+
+    def finish_import(self, importer, result):
+        """Store the snippets of a finished import and index them"""
+        added = []
+        for snippet, snippet_id in zip(result.snippets, self._allocate_ids(len(result.snippets))):
+            snippet['id'] = snippet_id
+            if snippet.get('content_hash'):
+                self._blob_refs[snippet['content_hash']] += 1
+            record = self.snippets.add(snippet)
+            added.append(record)
+            self._queue_change("insert", record)
+        result.snippets = added
+        if self._search_index is not None:
+            self._search_index.sync(self.snippets, self.read_code)
+        if self._similarity_index is not None:
+            self._similarity_index.sync(self.snippets, self.read_code)
+        return result.snippets
+
+    @metrics.timed("import")
+    def import_tree(self, source_dir, progress=None, cancel_event=None, workers=None):
+        importer = self.make_importer(workers)
+        result = importer.run(importer.scan(source_dir), progress, cancel_event)
+        self.finish_import(importer, result)
+        return result
+
+    def make_pack_importer(self, path):
+        """A PackImporter for a pack file; see import_pack for the one-call version"""
+        return PackImporter(self.base_dir, path, self.language_extensions)
+
+    @metrics.timed("import")
+    def import_pack(self, path, progress=None, cancel_event=None):
+        """Add the snippets of a pack written by export_pack, skipping ones already here"""
+        importer = self.make_pack_importer(path)
+        result = importer.run(progress, cancel_event)
+        self.finish_import(importer, result)
+        return result
+
+    @metrics.timed("export")
+    def export_pack(self, path, snippets=None, progress=None):
+        """Write snippets (all by default) and their code to a single pack file.
+
+        Reads the code files as they are on disk, so queued writes should
+        have finished; the app runs it on its I/O worker, behind them.
+        """
+        return export_pack(path, list(self.snippets if snippets is None else snippets), progress)
+
+    def set_tags(self, snippet_id, tags=None, code=None):
+        """Replace a snippet's tags, or generate them afresh from its code if tags is None.
+
+        Pass code if it has already been read, to keep the file read off this thread.
+        """
+        snippet = self.get(snippet_id)
+        if code is None:
+            code = self.read_code(snippet)
+        if tags is None:
+            tags = self.generate_tags(code, snippet['language'], snippet['title'],
+                                      snippet.get('content_hash'))
+        snippet['tags'] = tags
+        snippet['modified'] = languages.timestamp()
+        self._queue_change("update", snippet)
+        self.search_index.update(snippet, code)
+        return snippet
+
+    def retag(self, progress=None):
+        """Regenerate the tags of every snippet from its code.
+
+        Code tagged before under the current rules comes from the tag memo
+        without being read, so after a rule change only the languages whose
+        rules changed are scanned. Returns the number of snippets whose
+        tags changed; only those are written.
+        """
+        engine, memo = self.tag_engine, self.tag_memo
+        changed = 0
+        for done, snippet in enumerate(self.snippets, 1):
+            digest = snippet.get('content_hash')
+            tags = None
+            if digest:
+                tags = engine.recall(digest, snippet['language'], snippet['title'], memo)
+            if tags is None:
+                tags = self.generate_tags(self.read_code(snippet), snippet['language'],
+                                          snippet['title'], digest)
+            if tags != list(snippet['tags']):
+                snippet['tags'] = tags
+                self._queue_change("update", snippet)
+                changed += 1
+            if progress:
+                progress(done, len(self.snippets), snippet)
+        if changed and self._search_index is not None:
+            self._search_index.sync(self.snippets, self.read_code)
+        memo.save()
+        return changed
+
+    def reindex(self):
+        """Rebuild the search index from scratch"""
+        self._search_index = SearchIndex(os.path.join(self.base_dir, INDEX_FILENAME))
+        self._search_index.sync(self.snippets, self.read_code)
+        self._search_index.dirty = True
+        self._search_index.save()
+        return self._search_index
+
+    @metrics.timed("reconcile")
+    def reconcile(self, paths=None, on_done=None, on_error=None):
+        """Pick up files added, edited or deleted outside the app.
+
+        Checks the given paths, or every known file and any new ones in
+        the language folders. Only files whose mtime or size changed since
+        the last pass are read. Without on_done, waits and returns a
+        ReconcileResult; with it, the files are checked on the I/O worker
+        and on_done(result) follows.
+        """
+        if self._reconciler is None:
+            self._reconciler = Reconciler(self)
+        request = self._reconciler.prepare(paths)
+        if on_done is None:
+            checked = self.io.call(self._check_files, request)
+            self.io.process_completions()
+            return self._apply_files(checked)
+        return self.io.submit(self._check_files, request,
+                              on_done=lambda checked: on_done(self._apply_files(checked)),
+                              on_error=on_error)
+
+    @metrics.timed("reconcile.check")
+    def _check_files(self, request):
+        """Other processes' news, then the files; queued behind our own writes"""
+        changes = self._fetch_changes() if self.loaded else None
+        return changes, self._reconciler.check(request)
+
+    def _apply_files(self, checked):
+        changes, checked = checked
+        # Snippets other processes saved explain their files
+        if changes is not None:
+            self._merge(changes)
+        return self._reconciler.apply(checked)
+
+    @metrics.timed("verify")
+    def verify(self, fix=False):
+        """Check every code file against its recorded content hash.
+
+        Returns [(snippet id or blob digest, problem, fixed)] where problem
+        is "missing" (file deleted), "modified" (file changed on disk),
+        "untracked" (saved before content hashing), "lost" (file and blob
+        both gone), "unstored" (blob gone, file intact), "linked" (a hard
+        link to its blob, as earlier versions made) or "orphan" (a blob no
+        snippet uses). With fix=True, missing files are restored from
+        their blob, modified and untracked files become the snippet's
+        code, unstored blobs are stored again from the file, linked files
+        get their own copy, and orphans are removed.
+        """
+        self.flush()
+        self.wait_for_io()
+        # Blobs only other processes' snippets use are not orphans
+        self.merge_changes()
+        problems = []
+        for snippet in list(self.snippets):
+            digest = snippet.get('content_hash')
+            filepath = snippet.get('filepath')
+            changed = []
+            on_disk = hash_file(filepath) if filepath and os.path.exists(filepath) else None
+            if on_disk == digest and digest:
+                if not self.blobs.exists(digest):
+                    # Removed while another process's snippet still had the code
+                    problem = "unstored"
+                    if fix:
+                        with open(filepath, 'rb') as f:
+                            self.blobs.put(f.read(), digest)
+                elif self.blobs.linked(digest, filepath):
+                    problem = "linked"
+                    if fix:
+                        self.blobs.checkout(digest, filepath)
+                else:
+                    continue
+            elif on_disk == digest:
+                continue
+            elif on_disk is not None:
+                problem = "modified" if digest else "untracked"
+                if fix:
+                    changed = self.adopt_file(snippet)
+            elif digest and self.blobs.exists(digest) and hash_file(self.blobs.path(digest)) == digest:
+                problem = "missing"
+                if fix:
+                    self.blobs.checkout(digest, filepath)
+            else:
+                problem = "lost"
+            problems.append((snippet['id'], problem, fix and problem != "lost"))
+            # Snippets sharing a blob edited in place changed along with it
+            problems.extend((other['id'], "modified", True) for other in changed)
+
+        for digest in list(self.blobs.digests()):
+            if digest not in self._blob_refs:
+                problems.append((digest, "orphan", fix))
+                if fix:
+                    self.blobs.remove(digest)
+        if fix:
+            self.flush()
+        return problems
+
+    def adopt_file(self, snippet, retag=False):
+        """Make the snippet's file, as it is on disk now, the snippet's code.
+
+        Returns the other snippets whose code changed with it: an edit made
+        in place through a link to a blob other snippets share changed
+        their files too, and is only undone for them when a revision still
+        has the old code.
+        """
+        digest = snippet.get('content_hash')
+        users = []
+        if self._edited_shared_blob(snippet['filepath'], digest):
+            users = [other for other in self.snippets
+                     if other.get('content_hash') == digest and other is not snippet]
+        if not users:
+            self._adopt_file(snippet, retag)
+            return []
+        # Looked up before adopting, while the edited snippet's history still ends with the old code
+        code = self.io.call(self._code_from_history, digest, [snippet] + users)
+        self._adopt_file(snippet, retag)
+        if code is None:
+            # Nothing has the old code any more: it is the edited code now for all of them
+            for other in users:
+                self._adopt_file(other, retag)
+            return users
+        # The edited inode stays with the other files until each is rewritten
+        os.remove(self.blobs.path(digest))
+        self.blobs.put(code, digest)
+        for other in users:
+            self.blobs.checkout(digest, other['filepath'])
+        return []
+
+    def _edited_shared_blob(self, filepath, digest):
+        """Whether filepath links to the blob digest, along with other files,
+        and the blob no longer holds that code"""
+        if not digest:
+            return False
+        if not self.blobs.linked(digest, filepath):
+            return False
+        try:
+            return hash_file(self.blobs.path(digest)) != digest
+        except OSError:
+            return False
+
+    def _code_from_history(self, digest, snippets):
+        """The bytes hashing to digest from the newest revision of any of snippets, or None"""
+        for snippet in snippets:
+            revisions = self.history.revisions(snippet['id'])
+            if not revisions:
+                continue
+            try:
+                code = self.history.text(snippet['id'], revisions[-1].number).encode('utf-8')
+            except (HistoryError, OSError):
+                continue
+            if hash_bytes(code) == digest:
+                return code
+        return None
+
+    def _adopt_file(self, snippet, retag):
+        filepath = snippet['filepath']
+        # Copy rather than move: the file stays where it is
+        tmp_path = self.blobs.temp_path()
+        shutil.copyfile(filepath, tmp_path)
+        digest = self.blobs.adopt(tmp_path)
+        if os.stat(filepath).st_nlink > 1:
+            # An earlier version's link: give the file its own data
+            self.blobs.checkout(digest, filepath)
+        self._blob_refs[digest] += 1
+        garbage = self._release_blob(snippet.get('content_hash'))
+        if garbage:
+            self.blobs.remove(garbage)
+        snippet['content_hash'] = digest
+        snippet['modified'] = languages.timestamp()
+        code = self.read_code(snippet)
+        # Edited in place, so the old version is gone; the new one continues any history
+        self.io.submit(self.history.extend, snippet['id'], code, snippet['title'],
+                       snippet['language'])
+        snippet['code_preview'] = languages.make_preview(code)
+        if retag:
+            snippet['tags'] = self.generate_tags(code, snippet['language'], snippet['title'], digest)
+        self._queue_change("update", snippet)
+        self.search_index.update(snippet, code)
+        if self._similarity_index is not None:
+            self._similarity_index.update(snippet, code)
+
+    def add_file(self, filepath, language):
+        """Turn a file that appeared in a language folder into a snippet"""
+        filename = os.path.basename(filepath)
+        snippet = self.snippets.add({
+            "id": self._allocate_id(),
+            "title": os.path.splitext(filename)[0],
+            "language": language,
+            "filename": filename,
+            "filepath": filepath,
+            "extension": self.language_extensions[language],
+            "tags": [],
+            "code_preview": "",
+            "created": languages.timestamp()
+        })
+        self._queue_change("insert", snippet)
+        self.adopt_file(snippet, retag=True)
+        return snippet
+
+    def forget(self, snippet_id):
+        """Drop a snippet whose file is already gone, keeping everything else"""
+        snippet = self.get(snippet_id)
+        garbage = self._release_blob(snippet.get('content_hash'))
+        if garbage:
+            self.blobs.remove(garbage)
+        self._queue_change("delete", snippet)
+        self.search_index.remove(snippet_id)
+        if self._similarity_index is not None:
+            self._similarity_index.remove(snippet_id)
+        self.snippets.remove(snippet_id)
+
+    # ------------------------------------------------------------------
+    # Other processes
+
+    def merge_changes(self, on_done=None, on_error=None):
+        """Merge the snippets other processes using this folder saved or
+        deleted since the last call. Cheap when nothing changed.
+
+        Without on_done, waits and returns a ReconcileResult; with it, the
+        check runs on the I/O worker and on_done(result) follows. Snippets
+        with changes of our own not yet written are left alone: ours are
+        newer and will be written over theirs.
+        """
+        if not self.loaded:
+            result = ReconcileResult()
+            return result if on_done is None else on_done(result)
+        if on_done is None:
+            return self._merge(self.io.call(self._fetch_changes))
+        return self.io.submit(self._fetch_changes,
+                              on_done=lambda changes: on_done(self._merge(changes)),
+                              on_error=on_error)
+
+    @metrics.timed("merge.fetch")
+    def _fetch_changes(self):
+        """The storage's news, and the code of changed snippets for the indexes"""
+        puts, deletes = self.storage.changes()
+        if deletes is None:
+            # Storage lost track and sent everything: keep what differs from ours
+            stored = {data['id'] for data in puts}
+            deletes = [snippet_id for snippet_id in list(self.by_id) if snippet_id not in stored]
+            puts = [data for data in puts if not self._same_record(data)]
+        return puts, deletes, [self.read_code(data) for data in puts]
+
+    def _same_record(self, data):
+        snippet = self.by_id.get(data['id'])
+        return snippet is not None and snippet.to_dict() == data
+
+    def _merge(self, changes):
+        puts, deletes, codes = changes
+        result = ReconcileResult()
+        with self._pending_lock:
+            pending = set(self._pending)
+        for data, code in zip(puts, codes):
+            if data['id'] in pending:
+                continue
+            snippet = self.by_id.get(data['id'])
+            if snippet is None:
+                snippet = self.snippets.add(data)
+                result.added.append(snippet)
+            else:
+                old_filepath = snippet.get('filepath')
+                self._release_blob(snippet.get('content_hash'))
+                for key, value in data.items():
+                    snippet[key] = value
+                if snippet.get('filepath') != old_filepath:
+                    self.snippets.moved(snippet, old_filepath)
+                result.updated.append(snippet)
+            if snippet.get('content_hash'):
+                self._blob_refs[snippet['content_hash']] += 1
+            for index in (self._browse_index, self._fuzzy_index):
+                if index is not None:
+                    index.update(snippet)
+            for index in (self._search_index, self._similarity_index):
+                if index is not None:
+                    index.update(snippet, code)
+        for snippet_id in deletes:
+            if snippet_id in pending or snippet_id not in self.by_id:
+                continue
+            # The process that deleted it removed the file and any unused blob
+            self._release_blob(self.by_id[snippet_id].get('content_hash'))
+            for index in (self._browse_index, self._fuzzy_index,
+                          self._search_index, self._similarity_index):
+                if index is not None:
+                    index.remove(snippet_id)
+            self.snippets.remove(snippet_id)
+            result.removed.append(snippet_id)
+        if result:
+            metrics.count("merge.changes", len(result.added) + len(result.updated)
+                          + len(result.removed))
+        return result
+
+    def wait_for_io(self):
+        """Wait until every queued file write has happened"""
+        self.io.call(lambda: None)
+        self.io.process_completions()
+
+    def export_json(self, out, snippets=None):
+        """Write snippets, including their code, as a JSON list to a text stream"""
+        records = []
+        for snippet in self.snippets if snippets is None else snippets:
+            record = snippet.to_dict()
+            record['code'] = self.read_code(snippet)
+            records.append(record)
+        json.dump(records, out, indent=2)
+        return len(records)
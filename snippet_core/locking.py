@@ -0,0 +1,61 @@
+"""Advisory file locks for processes sharing one library folder.
+
+Locks are whole-file and exclusive: fcntl.flock on POSIX, msvcrt.locking
+on Windows. Where neither exists they do nothing, and a library should
+only be used by one process at a time.
+"""
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+
+def lock(f):
+    """Block until this process holds the lock on an open file"""
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    elif msvcrt is not None:
+        f.seek(0)
+        while True:
+            try:
+                # Retries for about ten seconds before giving up; keep waiting
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                continue
+
+
+def unlock(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    elif msvcrt is not None:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class FileLock:
+    """Holds the lock on a lock file for the length of a with block. Not reentrant"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, 'a+b')
+        try:
+            lock(self._file)
+        except BaseException:
+            self._file.close()
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            unlock(self._file)
+        finally:
+            self._file.close()
+            self._file = None
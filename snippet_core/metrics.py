@@ -0,0 +1,254 @@
+"""Timing spans, counters and opt-in profiling.
+
+The library, the CLI and the app record into the shared `metrics`
+object. Recording is off by default and then costs one attribute check
+per call; turn it on with SNIPPET_METRICS=1, `--metrics` on the command
+line, or the app's diagnostics panel (F12).
+
+    with metrics.span("search"):
+        ...
+    @metrics.timed("save")
+    def create(...): ...
+    metrics.count("widgets.cards")
+
+For a closer look, a cProfile profile (exact, slows everything down) or
+the Sampler (a stack sample every few milliseconds, cheap enough to
+leave on while using the app) can run alongside.
+"""
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+# Recent durations kept per span for percentiles
+RECENT_SAMPLES = 1000
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class SpanStats:
+    __slots__ = ("count", "total", "max", "recent")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def as_dict(self):
+        recent = sorted(self.recent)
+        return {
+            "count": self.count,
+            "total_ms": 1000 * self.total,
+            "mean_ms": 1000 * self.total / self.count if self.count else 0.0,
+            "p50_ms": 1000 * recent[len(recent) // 2] if recent else 0.0,
+            "p95_ms": 1000 * recent[min(len(recent) - 1, int(len(recent) * 0.95))] if recent else 0.0,
+            "max_ms": 1000 * self.max,
+        }
+
+
+class Sampler:
+    """Samples one thread's stack at an interval; a low-overhead profiler"""
+
+    def __init__(self, thread_id=None, interval=0.005):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.self_counts = Counter()     # function the thread was in
+        self.total_counts = Counter()    # function anywhere on the stack
+        self.samples = 0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="snippet-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            self.self_counts[self._label(frame)] += 1
+            seen = set()
+            while frame is not None:
+                label = self._label(frame)
+                if label not in seen:
+                    seen.add(label)
+                    self.total_counts[label] += 1
+                frame = frame.f_back
+
+    @staticmethod
+    def _label(frame):
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def report(self, limit=25):
+        if not self.samples:
+            return "No samples"
+        lines = [f"{self.samples} samples every {self.interval * 1000:g} ms",
+                 f"{'self %':>7} {'total %':>8}  function"]
+        for label, count in self.self_counts.most_common(limit):
+            lines.append(f"{100 * count / self.samples:>7.1f} "
+                         f"{100 * self.total_counts[label] / self.samples:>8.1f}  {label}")
+        return "\n".join(lines)
+
+
+class Metrics:
+    """Named timing spans and counters, recorded only while enabled"""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.spans = {}
+        self.counters = Counter()
+        self.started = time.time()
+        self.profiler = None
+        self.sampler = None
+        self._lock = threading.Lock()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def reset(self):
+        with self._lock:
+            self.spans = {}
+            self.counters = Counter()
+            self.started = time.time()
+
+    def span(self, name):
+        """Context manager timing a block under name"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def timed(self, name):
+        """Decorator timing every call of a function under name"""
+        def decorate(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - start)
+            return wrapper
+        return decorate
+
+    def record(self, name, seconds):
+        with self._lock:
+            stats = self.spans.get(name)
+            if stats is None:
+                stats = self.spans[name] = SpanStats()
+            stats.count += 1
+            stats.total += seconds
+            stats.recent.append(seconds)
+            if seconds > stats.max:
+                stats.max = seconds
+
+    def count(self, name, amount=1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] += amount
+
+    def snapshot(self):
+        """Everything recorded so far as plain data"""
+        with self._lock:
+            return {
+                "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+                "elapsed_s": time.time() - self.started,
+                "spans": {name: stats.as_dict() for name, stats in sorted(self.spans.items())},
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+    def export_json(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(tmp_path, path)
+
+    def report(self):
+        """The snapshot as a text table"""
+        snapshot = self.snapshot()
+        lines = [f"{'span':<28} {'count':>7} {'total ms':>10} {'mean':>8} {'p50':>8} "
+                 f"{'p95':>8} {'max':>8}"]
+        for name, stats in snapshot["spans"].items():
+            lines.append(f"{name:<28} {stats['count']:>7} {stats['total_ms']:>10.1f} "
+                         f"{stats['mean_ms']:>8.2f} {stats['p50_ms']:>8.2f} "
+                         f"{stats['p95_ms']:>8.2f} {stats['max_ms']:>8.2f}")
+        lines.append("")
+        lines.extend(f"{name:<28} {value:>7}" for name, value in snapshot["counters"].items())
+        return "\n".join(lines)
+
+    # ------------------------------------------------------------------
+    # Profiling
+
+    def start_profile(self):
+        """Start a cProfile profile of the calling thread"""
+        if self.profiler is None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def stop_profile(self, path=None, limit=30):
+        """Stop profiling; save the raw stats to path and return the top functions as text"""
+        profiler, self.profiler = self.profiler, None
+        if profiler is None:
+            return ""
+        profiler.disable()
+        if path:
+            profiler.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
+
+    def start_sampling(self, thread_id=None, interval=0.005):
+        if self.sampler is None:
+            self.sampler = Sampler(thread_id, interval)
+            self.sampler.start()
+
+    def stop_sampling(self, limit=25):
+        sampler, self.sampler = self.sampler, None
+        if sampler is None:
+            return ""
+        sampler.stop()
+        return sampler.report(limit)
+
+
+metrics = Metrics(enabled=os.environ.get("SNIPPET_METRICS", "") not in ("", "0"))
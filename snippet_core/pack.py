@@ -0,0 +1,352 @@
+"""Single-file library packs, for backups and moving a library.
+
+A pack holds every snippet's metadata and code in one file:
+
+    preamble    b"SNIPPACK", format version
+    bodies      each distinct code body once, as its own zlib stream
+    index       zlib-compressed JSON lines: a header, then one snippet
+                record per line with "body": [offset, length, size]
+    trailer     index offset, index length, b"SNIPEND!"
+
+The trailer and the index locate any snippet's body, so one snippet can
+be read without unpacking the rest. Export and import both stream: code
+is copied a block at a time, and the index is written to a spooled
+temporary file and read back a line at a time, so memory stays flat
+whatever the size of the library.
+
+A pack may come from anyone, so importing trusts none of its names: the
+file name is reduced to a plain name inside its language folder, the
+content hash must look like one, and no existing file is replaced.
+"""
+import json
+import os
+import re
+import struct
+import tempfile
+import zlib
+
+from .blobs import BlobStore, hash_file
+from .importer import ImportResult
+from .languages import sanitize_filename, timestamp
+
+PACK_EXTENSION = ".snippack"
+PACK_VERSION = 1
+
+_MAGIC = b"SNIPPACK"
+_END_MAGIC = b"SNIPEND!"
+_PREAMBLE = struct.Struct("<8sI")      # magic, version
+_TRAILER = struct.Struct("<QQ8s")      # index offset, index length, magic
+
+# Bytes read or decompressed at a time
+BLOCK_SIZE = 1024 * 1024
+# Index data kept in memory while exporting before it spills to disk
+SPOOL_SIZE = 4 * 1024 * 1024
+COMPRESSION_LEVEL = 6
+
+# Not carried over: they only make sense inside the library that wrote them
+_LOCAL_FIELDS = ("id", "filepath")
+
+_DIGEST_RE = re.compile(r'[0-9a-f]{64}')
+
+
+class PackError(Exception):
+    """The file is not a snippet pack, or is damaged"""
+
+
+class PackWriter:
+    """Writes a pack, one snippet at a time"""
+
+    def __init__(self, path, count=None, level=COMPRESSION_LEVEL):
+        self.path = path
+        self.level = level
+        self.count = 0
+        self._tmp_path = path + ".tmp"
+        self._file = open(self._tmp_path, 'wb')
+        self._file.write(_PREAMBLE.pack(_MAGIC, PACK_VERSION))
+        self._bodies = {}       # content hash -> [offset, length, size], so each body is stored once
+        self._index = tempfile.SpooledTemporaryFile(SPOOL_SIZE)
+        self._index_compressor = zlib.compressobj(self.level)
+        self._write_index_line({"format": "snippet-pack", "version": PACK_VERSION,
+                                "exported": timestamp(), "count": count})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _write_index_line(self, record):
+        line = json.dumps(record, ensure_ascii=False).encode('utf-8') + b"\n"
+        self._index.write(self._index_compressor.compress(line))
+
+    def _write_body(self, source):
+        """Compress a file's contents into the pack; returns [offset, length, size]"""
+        offset = self._file.tell()
+        compressor = zlib.compressobj(self.level)
+        size = 0
+        with open(source, 'rb') as f:
+            for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+                size += len(block)
+                self._file.write(compressor.compress(block))
+        self._file.write(compressor.flush())
+        return [offset, self._file.tell() - offset, size]
+
+    def add(self, snippet):
+        """Add a snippet and the code file it points to"""
+        record = {key: value for key, value in snippet.items() if key not in _LOCAL_FIELDS}
+        record['tags'] = list(record.get('tags') or [])
+        filepath = snippet.get('filepath')
+        digest = snippet.get('content_hash')
+        if not filepath or not os.path.exists(filepath):
+            body = None
+        elif digest and digest in self._bodies:
+            body = self._bodies[digest]
+        else:
+            body = self._write_body(filepath)
+            if digest:
+                self._bodies[digest] = body
+        record['body'] = body
+        self._write_index_line(record)
+        self.count += 1
+
+    def close(self):
+        """Append the index and trailer and move the pack into place"""
+        self._index.write(self._index_compressor.flush())
+        index_offset = self._file.tell()
+        self._index.seek(0)
+        for block in iter(lambda: self._index.read(BLOCK_SIZE), b""):
+            self._file.write(block)
+        index_length = self._file.tell() - index_offset
+        self._file.write(_TRAILER.pack(index_offset, index_length, _END_MAGIC))
+        self._index.close()
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        self._index.close()
+        self._file.close()
+        try:
+            os.remove(self._tmp_path)
+        except OSError:
+            pass
+
+
+class PackReader:
+    """Reads the snippets of a pack without unpacking it"""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            self._file = open(path, 'rb')
+        except OSError as e:
+            raise PackError(f"Cannot read {path}: {e}") from e
+        try:
+            preamble = self._file.read(_PREAMBLE.size)
+            if len(preamble) < _PREAMBLE.size:
+                raise PackError(f"{path} is not a snippet pack")
+            magic, version = _PREAMBLE.unpack(preamble)
+            if magic != _MAGIC:
+                raise PackError(f"{path} is not a snippet pack")
+            if version > PACK_VERSION:
+                raise PackError(f"{path} was written by a newer version (pack format {version})")
+            self._file.seek(-_TRAILER.size, os.SEEK_END)
+            self._index_offset, self._index_length, end_magic = _TRAILER.unpack(
+                self._file.read(_TRAILER.size))
+            if end_magic != _END_MAGIC:
+                raise PackError(f"{path} is incomplete or damaged")
+            records = self._index_lines()
+            self.header = next(records)
+            records.close()
+        except (OSError, struct.error, ValueError, zlib.error, StopIteration) as e:
+            self._file.close()
+            raise PackError(f"Cannot read {path}: {e}") from e
+        except Exception:
+            self._file.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def _index_lines(self):
+        decompressor = zlib.decompressobj()
+        remaining = self._index_length
+        position = self._index_offset
+        pending = b""
+        while remaining:
+            self._file.seek(position)
+            block = self._file.read(min(BLOCK_SIZE, remaining))
+            if not block:
+                raise PackError(f"{self.path} is truncated")
+            position += len(block)
+            remaining -= len(block)
+            lines = (pending + decompressor.decompress(block)).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                yield json.loads(line)
+        if pending.strip():
+            yield json.loads(pending)
+
+    def __iter__(self):
+        """Every snippet record in the pack, streamed from the index"""
+        records = self._index_lines()
+        next(records)           # the header
+        return records
+
+    def find(self, title, language=None):
+        """The first record with this title (and language), or None"""
+        for record in self:
+            if record['title'] == title and (language is None or record['language'] == language):
+                return record
+        return None
+
+    def body_blocks(self, record):
+        """The record's code as a series of byte blocks"""
+        body = record.get('body')
+        if not body:
+            return
+        offset, length, size = body
+        decompressor = zlib.decompressobj()
+        while length:
+            self._file.seek(offset)
+            block = self._file.read(min(BLOCK_SIZE, length))
+            if not block:
+                raise PackError(f"{self.path} is truncated")
+            offset += len(block)
+            length -= len(block)
+            data = decompressor.decompress(block, BLOCK_SIZE)
+            while data:
+                yield data
+                data = decompressor.decompress(decompressor.unconsumed_tail, BLOCK_SIZE)
+        data = decompressor.flush()
+        if data:
+            yield data
+
+    def read_code(self, record):
+        return b"".join(self.body_blocks(record)).decode('utf-8', errors='replace')
+
+
+def export_pack(path, snippets, progress=None):
+    """Write snippets and their code files to a pack. Returns the number written"""
+    total = len(snippets)
+    with PackWriter(path, total) as writer:
+        for snippet in snippets:
+            writer.add(snippet)
+            if progress:
+                progress(writer.count, total, snippet.get('filepath'))
+    return writer.count
+
+
+class PackImporter:
+    """Unpacks a pack into a library's folders.
+
+    Like BulkImporter, run() only writes files and never touches
+    storage, so it can run on a background thread; the library's
+    finish_import() adds the returned snippets afterwards.
+    """
+
+    def __init__(self, base_dir, path, language_extensions):
+        self.base_dir = base_dir
+        self.path = path
+        self.language_extensions = language_extensions
+        self.blobs = BlobStore(base_dir)
+        self._taken = {}
+
+    def _target_path(self, record):
+        """Where a record's file goes; None if the same code is already there"""
+        language = record['language']
+        folder = os.path.join(self.base_dir, language)
+        taken = self._taken.get(folder)
+        if taken is None:
+            os.makedirs(folder, exist_ok=True)
+            taken = self._taken[folder] = set(os.listdir(folder))
+        extension = self.language_extensions[language]
+        # Only the last part of the name, so "../x" or "/etc/x" stays in the folder
+        name = os.path.basename(str(record.get('filename') or "").replace("\\", "/"))
+        stem = os.path.splitext(name)[0].lstrip('.') or str(record.get('title') or "")
+        stem = sanitize_filename(stem).lstrip('.') or "untitled"
+        filename = stem + extension
+        counter = 2
+        while filename in taken:
+            existing = os.path.join(folder, filename)
+            digest = record.get('content_hash')
+            if digest and os.path.isfile(existing) and hash_file(existing) == digest:
+                return None
+            filename = f"{stem}_{counter}{extension}"
+            counter += 1
+        target = os.path.join(folder, filename)
+        if os.path.dirname(os.path.realpath(target)) != os.path.realpath(folder):
+            raise PackError(f"{self.path} names a file outside its language folder")
+        taken.add(filename)
+        return target
+
+    def _unpack_body(self, reader, record):
+        """Store a record's code as a blob; returns its digest"""
+        digest = record.get('content_hash')
+        if not isinstance(digest, str) or not _DIGEST_RE.fullmatch(digest):
+            # Not a hash of ours: hashed afresh from the body below
+            digest = None
+        if digest and self.blobs.exists(digest):
+            return digest
+        tmp_path = self.blobs.temp_path()
+        try:
+            with open(tmp_path, 'wb') as f:
+                for block in reader.body_blocks(record):
+                    f.write(block)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return self.blobs.adopt(tmp_path)
+
+    def _unpack(self, reader, record):
+        """Write one record's file; returns (snippet, None) or (None, why it was skipped)"""
+        try:
+            target = self._target_path(record)
+        except PackError as e:
+            return None, str(e)
+        if target is None:
+            return None, "already in library"
+        digest = self._unpack_body(reader, record)
+        try:
+            self.blobs.checkout(digest, target, replace=False)
+        except FileExistsError:
+            return None, "a file of that name already exists"
+        snippet = {key: value for key, value in record.items() if key != 'body'}
+        snippet['filename'] = os.path.basename(target)
+        snippet['filepath'] = target
+        snippet['extension'] = self.language_extensions[record['language']]
+        snippet['content_hash'] = digest
+        return snippet, None
+
+    def run(self, progress=None, cancel_event=None):
+        """Write the pack's code files; progress(done, total, title) after each snippet"""
+        result = ImportResult()
+        with PackReader(self.path) as reader:
+            result.total = reader.header.get("count") or 0
+            for record in reader:
+                result.processed += 1
+                title = record.get('title', "")
+                if record.get('language') not in self.language_extensions:
+                    result.skipped.append((title, f"unknown language {record.get('language')}"))
+                elif not record.get('body'):
+                    result.skipped.append((title, "no code in pack"))
+                else:
+                    snippet, reason = self._unpack(reader, record)
+                    if snippet is None:
+                        result.skipped.append((title, reason))
+                    else:
+                        result.snippets.append(snippet)
+                if progress:
+                    progress(result.processed, result.total, title)
+                if cancel_event is not None and cancel_event.is_set():
+                    result.cancelled = True
+                    break
+        return result
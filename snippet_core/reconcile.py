@@ -0,0 +1,342 @@
+"""Keep the metadata in step with files changed outside the app.
+
+The Reconciler remembers the mtime and size of every file in the
+language folders, and the mtime of the folders themselves
+(file_state.json). A pass only stats files, and lists just the folders
+whose mtime changed; the few files whose stats changed are read and
+hashed, and only if their contents really differ from the recorded
+content_hash is the snippet updated: new code, preview and tags. Files
+that appear in a language folder become snippets, snippets whose file
+was deleted are dropped. A file an earlier version left hard-linked to
+a blob other snippets share is, once edited in place, given a blob of
+its own, and the others get their code back from history where it has
+it.
+
+InotifyWatcher (Linux) reports changed paths as they happen, so the
+reconciler can check just those instead of stat-ing the whole tree.
+
+The stat-ing and hashing (check) only touches the file system and can
+run on the I/O worker; prepare and apply read and change the metadata
+on the thread that owns it.
+
+Another process sharing the folder writes a snippet's file a moment
+before its metadata. So a pass first merges the other processes'
+metadata, and a change it still can't explain is only acted on once it
+is SETTLE_TIME old; until then the path waits for a later pass.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+
+from .blobs import hash_file
+from .cachefile import load_json, save_json
+
+STATE_FILENAME = "file_state.json"
+STATE_VERSION = 3
+
+# Seconds an unexplained change must stay unexplained before it is applied
+SETTLE_TIME = 2.0
+
+
+def stat_key(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class ReconcileResult:
+    def __init__(self):
+        self.added = []         # new snippets
+        self.updated = []       # snippets whose file changed
+        self.removed = []       # ids of snippets whose file was deleted
+        self.waiting = []       # paths to check again once their change settles
+
+    def __bool__(self):
+        return bool(self.added or self.updated or self.removed)
+
+
+class Reconciler:
+    """Applies file system changes in a library's language folders to its metadata"""
+
+    def __init__(self, library):
+        self.library = library
+        self.path = os.path.join(library.base_dir, STATE_FILENAME)
+        self.stats = {}         # filepath -> (mtime_ns, size) when last reconciled
+        self.folders = {}       # language folder -> mtime_ns when last listed
+        self.waiting = {}       # filepath -> when its unexplained change was first seen
+        self.dirty = False
+        if not load_json(self.path, STATE_VERSION, self._restore):
+            self.stats, self.folders = {}, {}
+
+    def _restore(self, state):
+        self.stats = {path: (mtime_ns, size) for path, (mtime_ns, size) in state['stats'].items()}
+        self.folders = {folder: int(mtime_ns) for folder, mtime_ns in state['folders'].items()}
+
+    def save(self):
+        if not self.dirty:
+            return
+        save_json(self.path, STATE_VERSION, {'stats': self.stats, 'folders': self.folders})
+        self.dirty = False
+
+    def language_of(self, filepath):
+        """The language a file in a language folder belongs to, or None"""
+        folder, filename = os.path.split(filepath)
+        if (os.path.normpath(os.path.dirname(folder)) != os.path.normpath(self.library.base_dir)
+                or filename.startswith('.')):
+            return None
+        language = os.path.basename(folder)
+        extension = self.library.language_extensions.get(language)
+        if extension is None or os.path.splitext(filename)[1].lower() != extension.lower():
+            return None
+        return language
+
+    def scan(self, folders):
+        """Every snippet-looking file in the language folders whose mtime
+        differs from the one in folders, and {folder: mtime_ns} of those.
+
+        A folder's mtime only changes when files are added, removed or
+        renamed in it; the files of the others are already known.
+        """
+        paths = []
+        listed = {}
+        for language in self.library.language_extensions:
+            folder = os.path.join(self.library.base_dir, language)
+            key = stat_key(folder)
+            if key is None or folders.get(folder) == key[0]:
+                continue
+            try:
+                entries = list(os.scandir(folder))
+            except OSError:
+                continue
+            # Taken before listing, so a file added meanwhile is found next time
+            listed[folder] = key[0]
+            paths.extend(entry.path for entry in entries
+                         if entry.is_file() and self.language_of(entry.path))
+        return paths, listed
+
+    def settled(self, path, key, now):
+        """Whether an unexplained change to path is old enough to act on"""
+        first_seen = self.waiting.setdefault(path, now)
+        if key is not None and now - key[0] / 1e9 >= SETTLE_TIME:
+            return True
+        return now - first_seen >= SETTLE_TIME
+
+    def prepare(self, paths=None):
+        """What a pass checks: the given paths, or every known file and the
+        language folders, plus the paths still waiting to settle.
+
+        Taken on the thread that owns the metadata, with each path's last
+        stats and the (id, content_hash) of the snippet at it, for check().
+        """
+        snippets = self.library.snippets
+        folders = None
+        if paths is None:
+            paths = set(snippets.paths()) | set(self.stats)
+            folders = dict(self.folders)
+        paths = set(paths) | set(self.waiting)
+        known = {}
+        for path in paths:
+            snippet = snippets.at_path(path)
+            state = None if snippet is None else (snippet['id'], snippet.get('content_hash'))
+            known[path] = (self.stats.get(path), state)
+        return known, folders
+
+    def check(self, request):
+        """Stat the paths of a prepared pass and hash the files whose stats
+        changed. Only touches the file system, so it can run on the I/O worker.
+
+        Returns ([(path, stat key, hash or None, known)], listed folders).
+        """
+        known, folders = request
+        listed = {}
+        paths = list(known)
+        if folders is not None:
+            found, listed = self.scan(folders)
+            paths.extend(path for path in found if path not in known)
+        observed = []
+        for path in paths:
+            recorded, state = known.get(path, (None, None))
+            key = stat_key(path)
+            digest = None
+            if key is not None and key != recorded:
+                try:
+                    digest = hash_file(path)
+                except OSError:
+                    key = None
+            observed.append((path, key, digest, state))
+        return observed, listed
+
+    def apply(self, checked):
+        """Bring the metadata in line with what check() found"""
+        observed, listed = checked
+        library = self.library
+        snippets = library.snippets
+        if listed:
+            self.folders.update(listed)
+            self.dirty = True
+
+        result = ReconcileResult()
+        now = time.time()
+        for path, key, digest, state in observed:
+            snippet = snippets.at_path(path)
+            if snippet is not None and digest is not None and digest == snippet.get('content_hash'):
+                # Matches the metadata, however it got there
+                pass
+            elif (None if snippet is None else (snippet['id'], snippet.get('content_hash'))) != state:
+                # Saved, moved or merged since the check: look again next pass
+                self.waiting.setdefault(path, now)
+                continue
+            elif key is None:
+                if snippet is not None:
+                    if not self.settled(path, key, now):
+                        continue
+                    library.forget(snippet['id'])
+                    result.removed.append(snippet['id'])
+                self.waiting.pop(path, None)
+                if self.stats.pop(path, None) is not None:
+                    self.dirty = True
+                continue
+            elif self.stats.get(path) == key:
+                self.waiting.pop(path, None)
+                continue
+            elif snippet is None:
+                language = self.language_of(path)
+                if language is None:
+                    self.waiting.pop(path, None)
+                    continue
+                if not self.settled(path, key, now):
+                    continue
+                result.added.append(library.add_file(path, language))
+                key = stat_key(path)
+            else:
+                if not self.settled(path, key, now):
+                    continue
+                shared = library.adopt_file(snippet, retag=True)
+                result.updated.append(snippet)
+                result.updated.extend(shared)
+                # Adopting may rewrite the file, so stat it again
+                key = stat_key(path)
+            self.waiting.pop(path, None)
+            self.stats[path] = key
+            self.dirty = True
+        result.waiting = sorted(self.waiting)
+        return result
+
+    def reconcile(self, paths=None):
+        """Check the given paths, or the whole tree, against the metadata,
+        all on the calling thread.
+
+        Paths still waiting to settle from earlier passes are checked too.
+        """
+        return self.apply(self.check(self.prepare(paths)))
+
+
+# inotify constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+_EVENT = struct.Struct("iIII")
+_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+
+def _load_libc():
+    if not hasattr(os, "O_CLOEXEC"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.inotify_init1
+    except (OSError, AttributeError, TypeError):
+        return None
+    return libc
+
+
+class InotifyWatcher:
+    """Collects paths changed under a snippets folder, using Linux inotify"""
+
+    def __init__(self, base_dir):
+        self.libc = _load_libc()
+        if self.libc is None:
+            raise OSError("inotify is not available on this system")
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.base_dir = base_dir
+        self.watches = {}       # watch descriptor -> directory
+        self._changed = set()
+        self._overflow = False
+        self._lock = threading.Lock()
+        self._stopped = False
+
+        self._watch(base_dir)
+        for entry in os.scandir(base_dir):
+            if entry.is_dir() and not entry.name.startswith('.'):
+                self._watch(entry.path)
+        self._thread = threading.Thread(target=self._run, name="snippet-watch", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def available():
+        return _load_libc() is not None
+
+    def _watch(self, directory):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), _WATCH_MASK)
+        if wd >= 0:
+            self.watches[wd] = directory
+
+    def _run(self):
+        while not self._stopped:
+            ready, _, _ = select.select([self.fd], [], [], 0.5)
+            if not ready:
+                continue
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            except OSError:
+                return
+            self._parse(data)
+
+    def _parse(self, data):
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+            name = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b"\0")
+            offset += _EVENT.size + length
+            with self._lock:
+                if mask & IN_Q_OVERFLOW:
+                    self._overflow = True
+                    continue
+                directory = self.watches.get(wd)
+                if directory is None or not name:
+                    continue
+                path = os.path.join(directory, os.fsdecode(name))
+                if mask & IN_ISDIR:
+                    # A new language folder: watch it and check what is already in it
+                    if directory == self.base_dir and mask & (IN_CREATE | IN_MOVED_TO):
+                        self._watch(path)
+                        self._overflow = True
+                    continue
+                if directory != self.base_dir:
+                    self._changed.add(path)
+
+    def drain(self):
+        """Return the changed paths since the last call, or None if events were lost"""
+        with self._lock:
+            changed, self._changed = self._changed, set()
+            overflow, self._overflow = self._overflow, False
+        return None if overflow else changed
+
+    def close(self):
+        self._stopped = True
+        self._thread.join()
+        os.close(self.fd)
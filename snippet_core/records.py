@@ -0,0 +1,206 @@
+"""Compact in-memory snippet records.
+
+A library keeps every snippet's metadata in memory. As plain dicts each
+one repeats the same ten keys, and SQLite hands back fresh copies of the
+language, extension, folder and tag strings for every row. A Snippet
+keeps its fields in slots, shares one copy of those repeated strings
+(and of the timestamps a bulk import gives many snippets) and holds the
+content hash as 32 raw bytes. It still reads and writes like the dicts
+the storage backends use (snippet['title'], snippet.get('tags'),
+dict(snippet)), so callers don't need to care.
+
+SnippetCollection holds a library's snippets in insertion order with
+O(1) lookup by id and by file path, and O(1) adding and removing.
+"""
+import os
+import sys
+
+FIELDS = ("id", "title", "language", "filename", "filepath", "extension",
+          "tags", "code_preview", "created", "modified", "content_hash")
+
+_intern = sys.intern
+
+
+class Snippet:
+    """One snippet's metadata"""
+
+    __slots__ = ("id", "title", "language", "filename", "extension", "code_preview",
+                 "created", "modified", "_folder", "_name", "_tags", "_hash", "_extra")
+
+    def __init__(self):
+        self.id = None
+        self.title = ""
+        self.language = ""
+        self.filename = ""
+        self.extension = ""
+        self.code_preview = ""
+        self.created = ""
+        self.modified = None    # None until first edited; older records have none
+        self._folder = None
+        self._name = None
+        self._tags = ()
+        self._hash = None
+        self._extra = None      # keys beyond FIELDS, from older metadata files
+
+    @classmethod
+    def from_dict(cls, data):
+        snippet = cls()
+        for key, value in data.items():
+            snippet[key] = value
+        return snippet
+
+    # The fields stored in a different shape
+    @property
+    def filepath(self):
+        if self._folder is None:
+            return self._name
+        return os.path.join(self._folder, self._name)
+
+    @filepath.setter
+    def filepath(self, value):
+        if not value:
+            self._folder, self._name = None, value
+            return
+        folder, name = os.path.split(value)
+        self._folder = _intern(folder)
+        # Usually the file name; share the string
+        self._name = self.filename if name == self.filename else name
+
+    @property
+    def tags(self):
+        """The tags, as a tuple"""
+        return self._tags
+
+    @tags.setter
+    def tags(self, value):
+        self._tags = tuple(_intern(tag) for tag in value or ())
+
+    @property
+    def content_hash(self):
+        return self._hash.hex() if self._hash is not None else None
+
+    @content_hash.setter
+    def content_hash(self, value):
+        self._hash = bytes.fromhex(value) if value else None
+
+    # Dict-style access
+    def __getitem__(self, key):
+        if key in _FIELD_SET:
+            return getattr(self, key)
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in _INTERNED:
+            value = _intern(value) if isinstance(value, str) else value
+        if key in _FIELD_SET:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __contains__(self, key):
+        return key in _FIELD_SET or (self._extra is not None and key in self._extra)
+
+    def get(self, key, default=None):
+        try:
+            value = self[key]
+        except KeyError:
+            return default
+        return default if value is None and default is not None else value
+
+    def keys(self):
+        if self._extra is None:
+            return FIELDS
+        return FIELDS + tuple(self._extra)
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def to_dict(self):
+        record = dict(self.items())
+        record['tags'] = list(self._tags)
+        return record
+
+    def __repr__(self):
+        return f"Snippet(id={self.id!r}, title={self.title!r}, language={self.language!r})"
+
+
+_FIELD_SET = frozenset(FIELDS)
+_INTERNED = frozenset(("language", "extension", "created", "modified"))
+
+
+class SnippetCollection:
+    """Snippets in insertion order, indexed by id and by file path"""
+
+    def __init__(self, snippets=()):
+        # Dicts keep insertion order, so by_id doubles as the ordered list
+        self.by_id = {}
+        self._folders = {}      # folder -> {file name: snippet}; shares the records' strings
+        self._ordered = []
+        for snippet in snippets:
+            self.add(snippet)
+
+    def add(self, snippet):
+        if not isinstance(snippet, Snippet):
+            snippet = Snippet.from_dict(snippet)
+        self.by_id[snippet.id] = snippet
+        self._index_path(snippet)
+        if self._ordered is not None:
+            self._ordered.append(snippet)
+        return snippet
+
+    def remove(self, snippet_id):
+        snippet = self.by_id.pop(snippet_id)
+        self._unindex_path(snippet._folder, snippet._name, snippet)
+        # Rebuilt from by_id the next time it is needed
+        self._ordered = None
+        return snippet
+
+    def moved(self, snippet, old_filepath):
+        """Re-index a snippet whose filepath changed"""
+        if old_filepath:
+            self._unindex_path(*os.path.split(old_filepath), snippet)
+        self._index_path(snippet)
+
+    def _index_path(self, snippet):
+        if snippet._name:
+            self._folders.setdefault(snippet._folder, {})[snippet._name] = snippet
+
+    def _unindex_path(self, folder, name, snippet):
+        names = self._folders.get(folder)
+        if names is not None and names.get(name) is snippet:
+            del names[name]
+            if not names:
+                del self._folders[folder]
+
+    def at_path(self, filepath):
+        """The snippet whose file is filepath, or None"""
+        folder, name = os.path.split(filepath)
+        return self._folders.get(folder, {}).get(name)
+
+    def paths(self):
+        """The file path of every snippet"""
+        for folder, names in self._folders.items():
+            for name in names:
+                yield os.path.join(folder, name)
+
+    def _list(self):
+        if self._ordered is None:
+            self._ordered = list(self.by_id.values())
+        return self._ordered
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def __getitem__(self, index):
+        return self._list()[index]
+
+    def __iter__(self):
+        # Removing while iterating is safe: removal starts a new list
+        return iter(self._list())
+
+    def __bool__(self):
+        return bool(self.by_id)
@@ -0,0 +1,603 @@
+"""Inverted index and ranked search over snippets.
+
+Titles, tags, filenames, languages and the code files themselves are
+tokenized into per-term postings that keep token positions, so the index
+can answer plain terms, prefixes (``bin*``), phrases (``"binary search"``)
+and ``lang:`` / ``tag:`` filters. Results are ranked with BM25F, where
+each field has its own weight and length normalization.
+
+The index is updated in place when a single snippet changes. It is
+saved to disk between sessions as JSON laid out like the postings
+themselves, so loading it is mostly the JSON decoder's work; ``sync`` compares each snippet's
+signature (metadata plus code file mtime and size) with the stored one
+and only re-indexes what changed.
+"""
+import bisect
+import heapq
+import math
+import os
+import re
+
+from .cachefile import load_json, save_json
+from .metrics import metrics
+
+INDEX_FILENAME = "search_index.json"
+INDEX_VERSION = 2
+
+# Relative importance of a match in each field
+FIELD_WEIGHTS = {
+    "title": 3.0,
+    "tags": 2.0,
+    "filename": 2.0,
+    "language": 1.0,
+    "code": 1.0,
+}
+FIELDS = tuple(FIELD_WEIGHTS)
+
+# Only the start of very large code files is indexed
+MAX_INDEXED_CODE = 256 * 1024
+
+# Upper bounds on the number of vocabulary terms a prefix expands to, and
+# on the postings merged for them beyond its most frequent term
+MAX_PREFIX_EXPANSIONS = 64
+MAX_PREFIX_POSTINGS = 8000
+
+# Postings whose term frequencies warm() works out in advance
+WARM_POSTINGS = 200000
+
+# Relative change in average field length after which cached term
+# frequencies are recomputed
+NORM_DRIFT = 0.02
+
+# With fewer exact matches than this, typo-tolerant matches are added after them
+FUZZY_FALLBACK = 10
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_WORD_RE = re.compile(r'[A-Za-z0-9]+')
+_PART_RE = re.compile(r'[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+')
+_QUERY_RE = re.compile(r'(\w+):("[^"]*"?|\S*)|"([^"]*)"?|(\S+)')
+
+FILTER_FIELDS = {"lang": "language", "language": "language", "tag": "tag", "tags": "tag"}
+
+
+def tokenize(text):
+    """Split text into lowercase tokens, breaking snake_case and camelCase apart"""
+    tokens = []
+    for word in _WORD_RE.findall(text):
+        tokens.extend(part.lower() for part in _PART_RE.findall(word))
+    return tokens
+
+
+def snippet_signature(snippet):
+    """Everything that affects how a snippet is indexed"""
+    filepath = snippet.get('filepath')
+    try:
+        stat = os.stat(filepath) if filepath else None
+    except OSError:
+        stat = None
+    return (snippet.get('title', ''), snippet.get('language', ''),
+            snippet.get('filename', ''), tuple(snippet.get('tags', [])),
+            stat.st_mtime_ns if stat else None, stat.st_size if stat else None)
+
+
+class _IndexedDoc:
+    __slots__ = ("signature", "language", "tags", "lengths", "terms")
+
+    def __init__(self, signature, language, tags, lengths, terms):
+        self.signature = signature
+        self.language = language
+        self.tags = tags
+        self.lengths = lengths
+        self.terms = terms
+
+
+class _Clause:
+    __slots__ = ("kind", "terms")
+
+    def __init__(self, kind, terms):
+        self.kind = kind      # "term", "prefix" or "phrase"
+        self.terms = terms
+
+
+class SearchIndex:
+    """Incrementally updated, positional inverted index with BM25F ranking"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.postings = {}        # term -> {doc_id: {field: [positions]}}
+        self.vocabulary = []      # sorted list of terms, used for prefix lookups
+        self.docs = {}            # doc_id -> _IndexedDoc
+        self.field_lengths = {field: 0 for field in FIELD_WEIGHTS}
+        self.by_language = {}     # language -> set of doc ids
+        self.by_tag = {}          # tag -> set of doc ids
+        self._tf_cache = {}       # term -> {doc_id: weighted, normalized tf}
+        self._slopes = None       # length normalization the cached tf used
+        self.dirty = False
+
+    # ------------------------------------------------------------------
+    # Persistence
+
+    @classmethod
+    def load(cls, base_dir):
+        """Load the index saved in a snippets folder, or start an empty one"""
+        path = os.path.join(base_dir, INDEX_FILENAME)
+        index = cls(path)
+        if not load_json(path, INDEX_VERSION, index._restore):
+            # A missing or damaged cache is simply rebuilt by the next sync
+            index = cls(path)
+        return index
+
+    def _restore(self, state):
+        vocabulary = state['terms']
+        self.postings = {term: dict(zip(doc_ids, fields))
+                         for term, (doc_ids, fields) in zip(vocabulary, state['postings'])}
+        term_at = vocabulary.__getitem__
+        for doc_id, signature, language, tags, lengths, terms in state['docs']:
+            signature[3] = tuple(signature[3])
+            doc = _IndexedDoc(tuple(signature), language, tuple(tags),
+                              dict(zip(FIELDS, lengths)),
+                              {field: tuple(map(term_at, field_terms))
+                               for field, field_terms in zip(FIELDS, terms)})
+            self.docs[doc_id] = doc
+            for field, length in doc.lengths.items():
+                self.field_lengths[field] += length
+            self._add_filters(doc_id, doc)
+        self.vocabulary = sorted(self.postings)
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        # Each term is written once; snippets refer to it by its place in the vocabulary
+        numbers = {term: number for number, term in enumerate(self.vocabulary)}
+        postings = [[list(doc_postings), list(doc_postings.values())]
+                    for doc_postings in map(self.postings.__getitem__, self.vocabulary)]
+        docs = [[doc_id, doc.signature, doc.language, doc.tags,
+                 [doc.lengths[field] for field in FIELDS],
+                 [[numbers[term] for term in doc.terms[field]] for field in FIELDS]]
+                for doc_id, doc in self.docs.items()]
+        save_json(self.path, INDEX_VERSION,
+                  {'terms': self.vocabulary, 'postings': postings, 'docs': docs})
+        self.dirty = False
+
+    def sync(self, snippets, read_code):
+        """Bring the index in line with the given snippets.
+
+        read_code(snippet) is only called for snippets that are new or
+        whose signature changed since they were indexed.
+        """
+        seen = set()
+        for snippet in snippets:
+            seen.add(snippet['id'])
+            signature = snippet_signature(snippet)
+            doc = self.docs.get(snippet['id'])
+            if doc is None or doc.signature != signature:
+                self.update(snippet, read_code(snippet), signature)
+        for doc_id in [doc_id for doc_id in self.docs if doc_id not in seen]:
+            self.remove(doc_id)
+
+    # ------------------------------------------------------------------
+    # Updates
+
+    def update(self, snippet, code, signature=None):
+        """Index a snippet, replacing any previous version of it"""
+        doc_id = snippet['id']
+        if doc_id in self.docs:
+            self.remove(doc_id)
+
+        fields = {
+            "title": snippet.get('title', ''),
+            "tags": " ".join(snippet.get('tags', [])),
+            "filename": snippet.get('filename', ''),
+            "language": snippet.get('language', ''),
+            "code": (code or '')[:MAX_INDEXED_CODE],
+        }
+        lengths = {}
+        terms = {}
+        for field, text in fields.items():
+            tokens = tokenize(text)
+            lengths[field] = len(tokens)
+            self.field_lengths[field] += len(tokens)
+            positions = {}
+            for pos, token in enumerate(tokens):
+                positions.setdefault(token, []).append(pos)
+            for token, token_positions in positions.items():
+                doc_postings = self.postings.get(token)
+                if doc_postings is None:
+                    doc_postings = self.postings[token] = {}
+                    bisect.insort(self.vocabulary, token)
+                doc_postings.setdefault(doc_id, {})[field] = token_positions
+            terms[field] = tuple(positions)
+        if self._tf_cache:
+            # Patched rather than dropped, so editing one snippet keeps them warm
+            for token in set().union(*terms.values()):
+                term_tf = self._tf_cache.get(token)
+                if term_tf is not None:
+                    term_tf[doc_id] = self._doc_tf(self.postings[token][doc_id], lengths)
+
+        doc = _IndexedDoc(signature or snippet_signature(snippet),
+                          snippet.get('language', '').lower(),
+                          tuple(tag.lower() for tag in snippet.get('tags', [])),
+                          lengths, terms)
+        self.docs[doc_id] = doc
+        self._add_filters(doc_id, doc)
+        self.dirty = True
+
+    def remove(self, doc_id):
+        doc = self.docs.pop(doc_id, None)
+        if doc is None:
+            return
+        for field, field_terms in doc.terms.items():
+            self.field_lengths[field] -= doc.lengths[field]
+            for term in field_terms:
+                term_tf = self._tf_cache.get(term)
+                if term_tf is not None:
+                    term_tf.pop(doc_id, None)
+                doc_postings = self.postings[term]
+                fields = doc_postings.get(doc_id)
+                if fields is None:
+                    continue
+                fields.pop(field, None)
+                if not fields:
+                    del doc_postings[doc_id]
+                if not doc_postings:
+                    del self.postings[term]
+                    del self.vocabulary[bisect.bisect_left(self.vocabulary, term)]
+        self._discard_filter(self.by_language, doc.language, doc_id)
+        for tag in doc.tags:
+            self._discard_filter(self.by_tag, tag, doc_id)
+        self.dirty = True
+
+    def _add_filters(self, doc_id, doc):
+        self.by_language.setdefault(doc.language, set()).add(doc_id)
+        for tag in doc.tags:
+            self.by_tag.setdefault(tag, set()).add(doc_id)
+
+    @staticmethod
+    def _discard_filter(mapping, key, doc_id):
+        ids = mapping.get(key)
+        if ids is not None:
+            ids.discard(doc_id)
+            if not ids:
+                del mapping[key]
+
+    # ------------------------------------------------------------------
+    # Queries
+
+    def parse_query(self, query, prefix_last=False):
+        """Turn a query string into (clauses, filters)"""
+        clauses = []
+        filters = []
+        last_word = None
+        for match in _QUERY_RE.finditer(query):
+            field, value, phrase, word = match.groups()
+            last_word = None
+            if field is not None and field.lower() in FILTER_FIELDS:
+                value = value.strip('"').lower()
+                if value:
+                    filters.append((FILTER_FIELDS[field.lower()], value))
+                continue
+            if field is not None:
+                word = match.group(0)
+            if phrase is not None:
+                tokens = tokenize(phrase)
+                if tokens:
+                    clauses.append(_Clause("phrase" if len(tokens) > 1 else "term", tokens))
+                continue
+            is_prefix = word.endswith('*')
+            tokens = tokenize(word)
+            if not tokens:
+                continue
+            if len(tokens) > 1:
+                clauses.append(_Clause("phrase", tokens))
+            else:
+                clauses.append(_Clause("prefix" if is_prefix else "term", tokens))
+                last_word = clauses[-1]
+
+        # While typing, the last word is usually incomplete
+        if prefix_last and last_word is not None and not query[-1:].isspace():
+            last_word.kind = "prefix"
+        return clauses, filters
+
+    def search(self, query, limit=None, prefix_last=False, within=None):
+        """Return [(doc_id, score), ...] best match first, at most limit of them.
+
+        within optionally restricts the search to a set of doc ids.
+        """
+        return self.search_matches(query, limit, prefix_last, within)[0]
+
+    def search_matches(self, query, limit=None, prefix_last=False, within=None):
+        """(ranked results as search returns them, ids of every match)"""
+        clauses, filters = self.parse_query(query, prefix_last)
+        if not clauses and not filters:
+            return [], set()
+
+        candidates = None if within is None else set(within)
+        for kind, value in filters:
+            ids = self.filter_ids(kind, value)
+            candidates = ids if candidates is None else candidates & ids
+
+        # Drops the cached term frequencies if the field lengths moved on
+        self._field_norms()
+        hits = []
+        narrowed = candidates
+        # Prefixes go last, so they only merge over what the other clauses matched
+        for clause in sorted(clauses, key=lambda clause: clause.kind == "prefix"):
+            clause_tf, df = self._clause_tf(clause, narrowed)
+            if not clause_tf:
+                return [], set()
+            hits.append((clause_tf, df))
+            narrowed = set(clause_tf) if narrowed is None else narrowed.intersection(clause_tf)
+
+        if not hits:
+            return [(doc_id, 0.0) for doc_id in sorted(candidates)][:limit], candidates
+
+        # Intersect starting from the rarest clause
+        hits.sort(key=lambda hit: len(hit[0]))
+        matched = set(hits[0][0])
+        for clause_tf, df in hits[1:]:
+            matched.intersection_update(clause_tf)
+        if candidates is not None:
+            matched &= candidates
+
+        if len(hits) == 1 and limit is not None and limit < len(matched):
+            # One clause ranks by its term frequency alone: score just the best
+            clause_tf = hits[0][0]
+            if len(matched) < len(clause_tf):
+                clause_tf = {doc_id: clause_tf[doc_id] for doc_id in matched}
+            best = heapq.nsmallest(limit, clause_tf, key=lambda doc_id: (-clause_tf[doc_id], doc_id))
+            scores = self._score(best, hits)
+        else:
+            scores = self._score(matched, hits)
+        if limit is None or limit >= len(scores):
+            return sorted(scores.items(), key=lambda item: (-item[1], item[0])), matched
+        return heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], item[0])), matched
+
+    def filter_ids(self, kind, value):
+        """Ids passing a "language" or "tag" filter: an exact match, or a
+        prefix match when the value ends with '*'"""
+        mapping = self.by_language if kind == "language" else self.by_tag
+        if not value.endswith('*'):
+            return mapping.get(value, set())
+        ids = set()
+        for key, key_ids in mapping.items():
+            if key.startswith(value[:-1]):
+                ids |= key_ids
+        return ids
+
+    def expand_prefix(self, prefix):
+        """The vocabulary terms a prefix stands for, most frequent first"""
+        return self._expansions(prefix)[0]
+
+    def prefix_complete(self, prefix):
+        """Whether expand_prefix returns every term starting with prefix"""
+        return self._expansions(prefix)[1]
+
+    def _expansions(self, prefix):
+        start = bisect.bisect_left(self.vocabulary, prefix)
+        end = bisect.bisect_left(self.vocabulary, prefix + "\uffff", start)
+        postings = self.postings
+        terms = sorted(self.vocabulary[start:end], key=lambda term: -len(postings[term]))
+        # The most frequent terms are kept, up to a bound on how many
+        # postings get merged; a short prefix stands for its common words
+        kept = 0
+        total = 0
+        for term in terms[:MAX_PREFIX_EXPANSIONS]:
+            if kept and total + len(postings[term]) > MAX_PREFIX_POSTINGS:
+                break
+            kept += 1
+            total += len(postings[term])
+        return terms[:kept], kept == len(terms)
+
+    def _field_norms(self):
+        """BM25F length normalization, base + slope * field length, per field.
+
+        The cached term frequencies were computed with the slopes returned
+        last; they are kept until the average field lengths drift by more
+        than NORM_DRIFT, then dropped all at once.
+        """
+        total_docs = len(self.docs) or 1
+        slopes = {field: BM25_B / ((length / total_docs) or 1.0)
+                  for field, length in self.field_lengths.items()}
+        cached = self._slopes
+        if cached is not None and all(abs(slopes[field] - cached[field]) <= cached[field] * NORM_DRIFT
+                                      for field in slopes):
+            return 1 - BM25_B, cached
+        self._tf_cache.clear()
+        self._slopes = slopes
+        return 1 - BM25_B, slopes
+
+    def _term_tf(self, term):
+        """{doc_id: BM25F term frequency} of one term, field weights and length
+        normalization applied; cached until the index changes"""
+        term_tf = self._tf_cache.get(term)
+        if term_tf is not None:
+            return term_tf
+        weights = FIELD_WEIGHTS
+        base, slopes = self._field_norms()
+        docs = self.docs
+        term_tf = {}
+        for doc_id, fields in self.postings.get(term, {}).items():
+            lengths = docs[doc_id].lengths
+            tf = 0.0
+            for field, positions in fields.items():
+                tf += weights[field] * len(positions) / (base + slopes[field] * lengths[field])
+            term_tf[doc_id] = tf
+        self._tf_cache[term] = term_tf
+        return term_tf
+
+    def _doc_tf(self, fields, lengths):
+        """One document's term frequency from its {field: positions}"""
+        base, slopes = 1 - BM25_B, self._slopes
+        return sum(FIELD_WEIGHTS[field] * len(positions) / (base + slopes[field] * lengths[field])
+                   for field, positions in fields.items())
+
+    def warm(self, max_postings=WARM_POSTINGS):
+        """Work out the term frequencies of the most frequent terms ahead of
+        the first search that needs them, up to max_postings in all"""
+        self._field_norms()
+        total = 0
+        for term in heapq.nlargest(1000, self.postings, key=lambda term: len(self.postings[term])):
+            total += len(self.postings[term])
+            if total > max_postings:
+                break
+            self._term_tf(term)
+
+    def _clause_tf(self, clause, candidates):
+        """({doc_id: term frequency}, document frequency) for one clause.
+
+        Matches may be limited to candidates, but the document frequency
+        never is, so rankings don't depend on how the search was narrowed.
+        """
+        if clause.kind == "term":
+            term_tf = self._term_tf(clause.terms[0])
+            return term_tf, len(term_tf)
+
+        if clause.kind == "prefix":
+            expansions = self.expand_prefix(clause.terms[0])
+            if not expansions:
+                return {}, 0
+            if len(expansions) == 1:
+                term_tf = self._term_tf(expansions[0])
+                return term_tf, len(term_tf)
+            tfs = [self._term_tf(term) for term in expansions]
+            df = sum(map(len, tfs))
+            if candidates is not None and len(candidates) < df:
+                merged = {}
+                for doc_id in candidates:
+                    tf = 0.0
+                    for term_tf in tfs:
+                        tf += term_tf.get(doc_id, 0.0)
+                    if tf:
+                        merged[doc_id] = tf
+                return merged, df
+            merged = dict(tfs[0])
+            get = merged.get
+            for term_tf in tfs[1:]:
+                for doc_id, tf in term_tf.items():
+                    merged[doc_id] = get(doc_id, 0.0) + tf
+            return merged, df
+
+        matches, df = self._phrase_hits(clause, candidates)
+        weights = FIELD_WEIGHTS
+        base, slopes = self._field_norms()
+        phrase_tf = {}
+        for doc_id, fields in matches.items():
+            lengths = self.docs[doc_id].lengths
+            phrase_tf[doc_id] = sum(weights[field] * len(starts)
+                                    / (base + slopes[field] * lengths[field])
+                                    for field, starts in fields.items())
+        return phrase_tf, df
+
+    def _phrase_hits(self, clause, candidates):
+        """({doc_id: {field: start positions}}, document frequency) for a phrase:
+        every term in the same field at consecutive positions"""
+        term_postings = [self.postings.get(term) for term in clause.terms]
+        if not all(term_postings):
+            return {}, 0
+        term_postings.sort(key=len)
+        # Estimated from the rarest term; exact counts would mean matching every document
+        df = len(term_postings[0])
+        docs = set(term_postings[0])
+        for doc_postings in term_postings[1:]:
+            docs.intersection_update(doc_postings)
+        if candidates is not None:
+            docs &= candidates
+
+        ordered = [self.postings[term] for term in clause.terms]
+        matches = {}
+        for doc_id in docs:
+            for field, first_positions in ordered[0][doc_id].items():
+                following = []
+                for offset, doc_postings in enumerate(ordered[1:], 1):
+                    positions = doc_postings[doc_id].get(field)
+                    if positions is None:
+                        break
+                    following.append((offset, set(positions)))
+                else:
+                    starts = tuple(pos for pos in first_positions
+                                   if all(pos + offset in later for offset, later in following))
+                    if starts:
+                        matches.setdefault(doc_id, {})[field] = starts
+        return matches, df
+
+    def _score(self, matched, hits):
+        """{doc_id: BM25F score} for the matched docs"""
+        total_docs = len(self.docs) or 1
+        k1 = BM25_K1
+        scores = dict.fromkeys(matched, 0.0)
+        for clause_tf, df in hits:
+            df = min(df, total_docs)
+            boost = math.log(1 + (total_docs - df + 0.5) / (df + 0.5)) * (k1 + 1)
+            for doc_id in scores:
+                tf = clause_tf[doc_id]
+                scores[doc_id] += boost * tf / (k1 + tf)
+        return scores
+
+
+class IncrementalSearch:
+    """Runs a query as it is typed, narrowing the previous results when possible.
+
+    When the new query only adds to the previous one (more letters in the
+    last word, or more words), every match must already be among the
+    previous matches, so only those are searched again.
+    """
+
+    def __init__(self, index, fuzzy=None):
+        self.index = index
+        self.fuzzy = fuzzy
+        self.reset()
+
+    def reset(self):
+        """Forget the previous query; call after the index changes"""
+        self.query = None
+        self.matched = None
+
+    def _narrows(self, query):
+        previous = self.query
+        if previous is None or not previous.strip() or not query.startswith(previous):
+            return False
+        # Filters, phrases and explicit prefixes don't narrow character by character
+        if any(char in query for char in ':"*'):
+            return False
+        if not previous[-1].isspace():
+            # The last word was matched as a prefix; it must have been a
+            # single token whose expansion wasn't cut short
+            tokens = tokenize(previous.split()[-1])
+            if len(tokens) > 1:
+                return False
+            if tokens and not self.index.prefix_complete(tokens[0]):
+                return False
+        return True
+
+    def search(self, query, limit=None):
+        """Return [(doc_id, score), ...] for the query, best match first, at
+        most limit of them. Only those are scored in full and sorted"""
+        within = None
+        if self._narrows(query):
+            within = self.matched
+            metrics.count("search.narrowed")
+        results, self.matched = self.index.search_matches(query, limit, True, within)
+        self.query = query
+        # Typo-tolerant matches don't narrow, so they are kept out of self.matched
+        return with_fuzzy(results, self.fuzzy, self.index, query, prefix_last=True, limit=limit,
+                          total=len(self.matched))
+
+
+def with_fuzzy(results, fuzzy, index, query, prefix_last=False, limit=None, total=None):
+    """Ranked results followed by a FuzzyIndex's matches for the query that
+    are not among them, if there are fewer than FUZZY_FALLBACK. total is how
+    many matched in all when results were cut short by a limit"""
+    if fuzzy is None or (len(results) if total is None else total) >= FUZZY_FALLBACK:
+        return results
+    with metrics.span("search.fuzzy"):
+        found = {doc_id for doc_id, score in results}
+        # Only as many as could make it into the limit are ranked
+        extra_limit = None if limit is None else limit + len(found)
+        extra = [(doc_id, score) for doc_id, score
+                 in fuzzy.search_query(query, index, prefix_last, extra_limit)
+                 if doc_id not in found]
+    metrics.count("search.fuzzy_results", len(extra))
+    merged = results + extra
+    return merged if limit is None else merged[:limit]
@@ -0,0 +1,513 @@
+"""A local HTTP/JSON service over a snippet library.
+
+Editors, IDE plugins and shell scripts talk to one long-running process
+that keeps the library, its search index and its browse index in
+memory, instead of each loading the library for every call:
+
+    GET  /status                              library size
+    GET  /search?q=QUERY[&limit=N&offset=N]   ranked search, one page
+    GET  /snippets[?sort=&order=&language=&tag=&limit=&after=]
+                                              browse, one page per cursor
+    GET  /snippets/ID[?code=0]                a snippet and its code
+    POST /snippets                            create: {"title", "code", "language", "tags"?}
+    PUT  /snippets/ID/tags                    set tags: {"tags": [...]}, or null to regenerate
+    POST /tags                                suggest tags: {"code", "language", "title"?}
+    GET  /facets[?language=]                  snippets per language and tag
+
+Add stream=1 to /search or /snippets to get every result as JSON lines,
+sent in chunks as they are produced. Connections are kept alive between
+requests (HTTP/1.1), so a client pays for its connection only once.
+
+Only local clients are served: connections from other machines are
+refused, whatever address the service listens on. Requests must name
+this machine in their Host header, so a web page can't reach the
+service through DNS rebinding; requests from a browser page on another
+origin are refused, and POST/PUT bodies must be sent as
+application/json, which a page can't send cross-origin without the
+browser asking first.
+
+Everything runs on one asyncio event loop, so requests never see the
+library half-way through a change. Snippets other processes save to the
+same library (the app, scripts) are merged in about once a second. File and metadata writes go to the
+library's BackgroundIO worker, as in the app; code files are read on
+the loop's thread pool.
+"""
+import asyncio
+import ipaddress
+import json
+import re
+import signal
+import sys
+import traceback
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs
+
+from .browse import SORT_KEYS, valid_cursor
+from .library import SnippetError, SnippetExistsError, SnippetNotFoundError
+from .metrics import metrics
+from .search import with_fuzzy
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+KEEPALIVE_TIMEOUT = 30      # seconds an idle connection is kept open
+MAX_BODY = 16 * 1024 * 1024
+MAX_HEADERS = 100
+PAGE_SIZE = 50              # results per page unless the request says otherwise
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH = 100          # JSON lines per chunk when streaming
+SEARCH_CACHE_SIZE = 32      # recent queries whose ranked results are kept for paging
+PUMP_INTERVAL = 0.05        # seconds between deliveries of finished background writes
+MERGE_INTERVAL = 1.0        # seconds between checks for other processes' changes
+
+LOCAL_NAMES = ("127.0.0.1", "localhost", "[::1]")
+
+_REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 403: "Forbidden",
+            404: "Not Found", 405: "Method Not Allowed", 409: "Conflict",
+            413: "Payload Too Large", 415: "Unsupported Media Type",
+            500: "Internal Server Error"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _is_loopback(peername):
+    """Whether a connection's peer address is this machine"""
+    try:
+        address = ipaddress.ip_address(peername[0])
+    except (TypeError, IndexError, ValueError):
+        return False
+    mapped = getattr(address, 'ipv4_mapped', None)
+    return (mapped or address).is_loopback
+
+
+class _Request:
+    __slots__ = ("method", "path", "query", "headers", "body", "keep_alive", "chunked")
+
+    def param(self, name, default=None):
+        values = self.query.get(name)
+        return values[-1] if values else default
+
+    def int_param(self, name, default, maximum=None):
+        value = self.param(name)
+        if value is None:
+            return default
+        try:
+            number = int(value)
+        except ValueError:
+            raise HTTPError(400, f"{name} must be a number") from None
+        if number < 0:
+            raise HTTPError(400, f"{name} must not be negative")
+        return number if maximum is None else min(number, maximum)
+
+    def json(self):
+        try:
+            data = json.loads(self.body or b"{}")
+        except ValueError as e:
+            raise HTTPError(400, f"Invalid JSON: {e}") from None
+        if not isinstance(data, dict):
+            raise HTTPError(400, "Expected a JSON object")
+        return data
+
+
+def _text(data, name, required=True):
+    """A string field of a request body"""
+    value = data.get(name)
+    if value is None and not required:
+        return ""
+    if value is None:
+        raise HTTPError(400, f"{name} is required")
+    if not isinstance(value, str):
+        raise HTTPError(400, f"{name} must be a string")
+    return value
+
+
+def _tag_list(data, message):
+    """The tags field of a request body: a list of strings, or None"""
+    tags = data.get('tags')
+    if tags is not None and not (isinstance(tags, list)
+                                 and all(isinstance(tag, str) for tag in tags)):
+        raise HTTPError(400, message)
+    return tags
+
+
+class _Stream:
+    """A response sent as JSON lines, one record per line, as it is produced"""
+
+    def __init__(self, records):
+        self.records = records
+
+
+class SnippetService:
+    """Serves one library over HTTP until stopped"""
+
+    def __init__(self, library, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.library = library
+        self.host = host
+        self.port = port
+        self.server = None
+        self._search_cache = OrderedDict()     # query -> ranked [(id, score)]
+        self._merging = False
+        self._hosts = set()           # Host headers that name this service
+        self._origins = set()         # Origin headers of pages it serves itself
+        self._routes = [
+            ("GET", re.compile(r"/status"), self.get_status),
+            ("GET", re.compile(r"/search"), self.get_search),
+            ("GET", re.compile(r"/snippets"), self.get_snippets),
+            ("POST", re.compile(r"/snippets"), self.post_snippet),
+            ("GET", re.compile(r"/snippets/(\d+)"), self.get_snippet),
+            ("PUT", re.compile(r"/snippets/(\d+)/tags"), self.put_tags),
+            ("POST", re.compile(r"/tags"), self.post_tags),
+            ("GET", re.compile(r"/facets"), self.get_facets),
+        ]
+
+    # ------------------------------------------------------------------
+    # Running
+
+    async def start(self):
+        # Warm everything a request may need so the first one is as fast as the rest
+        with metrics.span("service.warm"):
+            self.library.search_index
+            self.library.fuzzy_index
+            self.library.browse_index.order("created")
+        self.server = await asyncio.start_server(self._serve_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self._hosts = {f"{name}:{self.port}" for name in LOCAL_NAMES + (self.host,)}
+        self._origins = {f"http://{host}" for host in self._hosts}
+        self._pump_task = asyncio.ensure_future(self._pump())
+        return self.server
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self._pump_task.cancel()
+
+    async def serve_forever(self, on_ready=None):
+        await self.start()
+        if on_ready is not None:
+            on_ready(self)
+        stopped = asyncio.Event()
+        loop = asyncio.get_event_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, stopped.set)
+            except (NotImplementedError, RuntimeError):
+                pass            # Windows: Ctrl+C ends asyncio.run instead
+        await stopped.wait()
+        await self.stop()
+
+    async def _pump(self):
+        """Deliver finished background writes, as the app's Tk loop does, and
+        merge other processes' changes now and then"""
+        loop = asyncio.get_event_loop()
+        merged = loop.time()
+        while True:
+            self.library.io.process_completions()
+            if not self._merging and loop.time() - merged >= MERGE_INTERVAL:
+                merged = loop.time()
+                self._merging = True
+                self.library.merge_changes(on_done=self._merged, on_error=self._merged)
+            await asyncio.sleep(PUMP_INTERVAL)
+
+    def _merged(self, result):
+        """Called with the merge result, or the error that stopped it"""
+        self._merging = False
+        if result:
+            self._changed()
+
+    # ------------------------------------------------------------------
+    # HTTP
+
+    async def _serve_connection(self, reader, writer):
+        try:
+            if not _is_loopback(writer.get_extra_info('peername')):
+                metrics.count("service.refused")
+                await self._send(writer, 403, {"error": "Only local clients are served"}, False)
+                return
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), KEEPALIVE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                except HTTPError as e:
+                    await self._send(writer, e.status, {"error": str(e)}, False)
+                    break
+                if request is None:
+                    break
+                await self._respond(request, writer)
+                if not request.keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        """The next request on a connection, or None once the client has gone"""
+        line = await reader.readline()
+        if not line.strip():
+            return None
+        try:
+            method, target, version = line.decode('latin-1').split()
+        except ValueError:
+            raise HTTPError(400, "Malformed request line") from None
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            if len(headers) >= MAX_HEADERS:
+                raise HTTPError(400, "Too many headers")
+            name, _, value = line.decode('latin-1').partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        request = _Request()
+        url = urlsplit(target)
+        request.method = method.upper()
+        request.path = url.path.rstrip("/") or "/"
+        request.query = parse_qs(url.query)
+        request.headers = headers
+        connection = headers.get("connection", "").lower()
+        request.keep_alive = (connection != "close" if version == "HTTP/1.1"
+                              else connection == "keep-alive")
+        request.chunked = version == "HTTP/1.1"
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise HTTPError(400, "Invalid Content-Length") from None
+        if length > MAX_BODY:
+            raise HTTPError(413, f"Request body over {MAX_BODY} bytes")
+        request.body = await reader.readexactly(length) if length else b""
+        return request
+
+    async def _respond(self, request, writer):
+        metrics.count("service.requests")
+        try:
+            with metrics.span("service.request"):
+                self._check_client(request)
+                handler, args = self._route(request)
+                result = handler(request, *args)
+                if asyncio.iscoroutine(result):
+                    result = await result
+            status, payload = result if isinstance(result, tuple) else (200, result)
+        except HTTPError as e:
+            status, payload = e.status, {"error": str(e)}
+        except SnippetNotFoundError as e:
+            status, payload = 404, {"error": str(e)}
+        except SnippetExistsError as e:
+            status, payload = 409, {"error": str(e)}
+        except SnippetError as e:
+            status, payload = 400, {"error": str(e)}
+        except Exception as e:
+            traceback.print_exc(file=sys.stderr)
+            status, payload = 500, {"error": str(e)}
+        if isinstance(payload, _Stream):
+            await self._send_stream(writer, payload.records, request)
+        else:
+            await self._send(writer, status, payload, request.keep_alive)
+
+    def _check_client(self, request):
+        """Refuse requests a web page could have sent on the user's behalf"""
+        host = request.headers.get("host")
+        if host is not None and host.lower() not in self._hosts:
+            metrics.count("service.refused")
+            raise HTTPError(403, f"Unknown host: {host}")
+        origin = request.headers.get("origin")
+        if origin is not None and origin.lower() not in self._origins:
+            metrics.count("service.refused")
+            raise HTTPError(403, f"Requests from {origin} are not allowed")
+        if request.method in ("POST", "PUT"):
+            content_type = request.headers.get("content-type", "")
+            if content_type.partition(";")[0].strip().lower() != "application/json":
+                raise HTTPError(415, "Request body must be sent as application/json")
+
+    def _route(self, request):
+        allowed = False
+        for method, pattern, handler in self._routes:
+            match = pattern.fullmatch(request.path)
+            if match is None:
+                continue
+            if method == request.method:
+                return handler, [int(group) for group in match.groups()]
+            allowed = True
+        if allowed:
+            raise HTTPError(405, f"{request.method} not allowed on {request.path}")
+        raise HTTPError(404, f"No such endpoint: {request.path}")
+
+    @staticmethod
+    def _head(status, headers):
+        lines = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}"]
+        lines.extend(f"{name}: {value}" for name, value in headers)
+        return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+
+    async def _send(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        writer.write(self._head(status, [
+            ("Content-Type", "application/json; charset=utf-8"),
+            ("Content-Length", len(body)),
+            ("Connection", "keep-alive" if keep_alive else "close")]) + body)
+        await writer.drain()
+
+    async def _send_stream(self, writer, records, request):
+        """Send records as JSON lines, a batch per chunk, waiting for slow readers"""
+        if request.chunked:
+            headers = [("Transfer-Encoding", "chunked"),
+                       ("Connection", "keep-alive" if request.keep_alive else "close")]
+        else:
+            # HTTP/1.0 has no chunks: the end of the body is the end of the connection
+            headers = [("Connection", "close")]
+            request.keep_alive = False
+        writer.write(self._head(200, [("Content-Type", "application/x-ndjson; charset=utf-8")]
+                                + headers))
+        batch = []
+        sent = 0
+        for record in records:
+            batch.append(json.dumps(record, ensure_ascii=False))
+            if len(batch) >= STREAM_BATCH:
+                self._write_chunk(writer, batch, request.chunked)
+                sent += len(batch)
+                batch = []
+                await writer.drain()
+        if batch:
+            self._write_chunk(writer, batch, request.chunked)
+            sent += len(batch)
+        if request.chunked:
+            writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        metrics.count("service.streamed", sent)
+
+    @staticmethod
+    def _write_chunk(writer, lines, chunked):
+        data = ("\n".join(lines) + "\n").encode('utf-8')
+        if chunked:
+            writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+        else:
+            writer.write(data)
+
+    # ------------------------------------------------------------------
+    # Endpoints
+
+    def get_status(self, request):
+        library = self.library
+        return {"library": library.base_dir, "backend": library.backend,
+                "snippets": len(library.snippets)}
+
+    def _ranked(self, query):
+        """Ranked (id, score) results for a query, kept for the next page"""
+        results = self._search_cache.pop(query, None)
+        if results is None:
+            metrics.count("service.search_cache_misses")
+            index = self.library.search_index
+            results = with_fuzzy(index.search(query), self.library.fuzzy_index, index, query)
+        self._search_cache[query] = results
+        while len(self._search_cache) > SEARCH_CACHE_SIZE:
+            self._search_cache.popitem(last=False)
+        return results
+
+    def _changed(self):
+        self._search_cache.clear()
+
+    def get_search(self, request):
+        query = request.param("q", "").strip()
+        if not query:
+            raise HTTPError(400, "q is required")
+        by_id = self.library.by_id
+        results = [(doc_id, score) for doc_id, score in self._ranked(query) if doc_id in by_id]
+        if request.param("stream") == "1":
+            limit = request.int_param("limit", len(results))
+            return _Stream(dict(by_id[doc_id].to_dict(), score=score)
+                           for doc_id, score in results[:limit])
+        offset = request.int_param("offset", 0)
+        limit = request.int_param("limit", PAGE_SIZE, MAX_PAGE_SIZE)
+        page = results[offset:offset + limit]
+        following = offset + limit
+        return {"query": query, "total": len(results),
+                "results": [dict(by_id[doc_id].to_dict(), score=score) for doc_id, score in page],
+                "next": following if following < len(results) else None}
+
+    def _browse_params(self, request):
+        sort = request.param("sort", "created")
+        if sort not in SORT_KEYS:
+            raise HTTPError(400, f"sort must be one of: {', '.join(SORT_KEYS)}")
+        order = request.param("order")
+        if order not in (None, "asc", "desc"):
+            raise HTTPError(400, "order must be asc or desc")
+        descending = None if order is None else order == "desc"
+        return sort, descending, request.param("language"), request.param("tag")
+
+    def get_snippets(self, request):
+        sort, descending, language, tag = self._browse_params(request)
+        if request.param("stream") == "1":
+            snippets = self.library.browse(sort, descending, language, tag)
+            limit = request.int_param("limit", len(snippets))
+            return _Stream(snippet.to_dict() for snippet in snippets[:limit])
+        after = request.param("after")
+        if after is not None:
+            try:
+                after = json.loads(after)
+            except ValueError:
+                after = None
+            if not valid_cursor(sort, after):
+                raise HTTPError(400, "after must be the next value of a previous page")
+        limit = request.int_param("limit", PAGE_SIZE, MAX_PAGE_SIZE)
+        snippets, cursor = self.library.page(sort, descending, after, limit, language, tag)
+        return {"snippets": [snippet.to_dict() for snippet in snippets],
+                "next": None if cursor is None else json.dumps(cursor)}
+
+    async def get_snippet(self, request, snippet_id):
+        snippet = self.library.get(snippet_id)
+        record = snippet.to_dict()
+        if request.param("code") != "0":
+            loop = asyncio.get_event_loop()
+            record['code'] = await loop.run_in_executor(None, self.library.read_code, snippet)
+        return record
+
+    async def post_snippet(self, request):
+        data = request.json()
+        title, code, language = _text(data, 'title'), _text(data, 'code'), _text(data, 'language')
+        tags = _tag_list(data, "tags must be a list of strings")
+        # Answer once the code file is written, so a follow-up GET finds it
+        written = asyncio.get_event_loop().create_future()
+        snippet = self.library.create(title, code, language, tags,
+                                      overwrite=bool(data.get('overwrite')),
+                                      on_done=written.set_result,
+                                      on_error=written.set_exception)
+        self._changed()
+        await written
+        return 201, snippet.to_dict()
+
+    async def put_tags(self, request, snippet_id):
+        data = request.json()
+        tags = _tag_list(data, "tags must be a list of strings, or null to generate them")
+        snippet = self.library.get(snippet_id)
+        loop = asyncio.get_event_loop()
+        code = await loop.run_in_executor(None, self.library.read_code, snippet)
+        snippet = self.library.set_tags(snippet_id, tags, code)
+        self._changed()
+        return snippet.to_dict()
+
+    def post_tags(self, request):
+        data = request.json()
+        code, language = _text(data, 'code'), _text(data, 'language')
+        return {"tags": self.library.generate_tags(code, language,
+                                                   _text(data, 'title', required=False))}
+
+    def get_facets(self, request):
+        language_counts, tag_counts = self.library.facets(request.param("language"))
+        return {"languages": dict(language_counts.most_common()),
+                "tags": dict(tag_counts.most_common())}
+
+
+def serve(library, host=DEFAULT_HOST, port=DEFAULT_PORT, on_ready=None):
+    """Serve a library until interrupted; on_ready(service) is called once listening.
+
+    Give the library a BackgroundIO so writes don't hold up other requests.
+    """
+    service = SnippetService(library, host, port)
+    try:
+        asyncio.run(service.serve_forever(on_ready))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,173 @@
+"""Near-duplicate detection with MinHash and locality-sensitive hashing.
+
+Each snippet's code is cut into overlapping shingles of SHINGLE_SIZE
+tokens. A MinHash signature of NUM_HASHES values summarizes the shingle
+set: the fraction of positions where two signatures agree estimates the
+Jaccard similarity of the two sets. Signatures are split into BANDS
+bands of ROWS values, and snippets that agree on a whole band share a
+bucket, so a query only compares against the few snippets it shares a
+bucket with instead of the whole library.
+
+With 16 bands of 4 rows, pairs that are 80% similar become candidates
+almost always, pairs below about 30% almost never.
+"""
+import os
+import random
+import re
+import zlib
+from array import array
+
+from .cachefile import load_json, save_json
+from .search import snippet_signature
+
+SIMILARITY_FILENAME = "similarity_index.json"
+SIMILARITY_VERSION = 2
+
+SHINGLE_SIZE = 5
+NUM_HASHES = 64
+BANDS = 16
+ROWS = NUM_HASHES // BANDS
+
+# Only the start of very large files is compared
+MAX_COMPARED_CODE = 64 * 1024
+
+# Similarity from which a save warns about a near-duplicate
+DUPLICATE_THRESHOLD = 0.8
+
+_TOKEN_RE = re.compile(r'\w+|[^\w\s]')
+_MASK = 0xFFFFFFFF
+
+# Fixed seed: signatures are saved and must stay comparable between runs
+_rng = random.Random(0x5EED)
+_HASH_PARAMS = [(_rng.randrange(1, _MASK, 2), _rng.randrange(0, _MASK))
+                for _ in range(NUM_HASHES)]
+
+
+def shingles(code):
+    """Set of 32-bit hashes of the token shingles in code"""
+    tokens = _TOKEN_RE.findall(code[:MAX_COMPARED_CODE].lower())
+    if len(tokens) <= SHINGLE_SIZE:
+        return {zlib.crc32(" ".join(tokens).encode('utf-8'))} if tokens else set()
+    return {zlib.crc32(" ".join(tokens[i:i + SHINGLE_SIZE]).encode('utf-8'))
+            for i in range(len(tokens) - SHINGLE_SIZE + 1)}
+
+
+def minhash(code):
+    """MinHash signature of code, or None when it has no tokens"""
+    values = shingles(code)
+    if not values:
+        return None
+    # (a * x + b) mod 2**32 with odd a permutes the 32-bit hashes
+    return array('I', [min([(a * x + b) & _MASK for x in values])
+                       for a, b in _HASH_PARAMS])
+
+
+def estimate(first, second):
+    """Estimated Jaccard similarity of two signatures"""
+    return sum(1 for x, y in zip(first, second) if x == y) / NUM_HASHES
+
+
+def _code_key(snippet):
+    """What a signature depends on: the code's hash, or its file's mtime and size"""
+    return snippet.get('content_hash') or snippet_signature(snippet)[-2:]
+
+
+class SimilarityIndex:
+    """MinHash signatures of every snippet, bucketed by LSH band"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.signatures = {}      # doc_id -> (code key, signature)
+        self.buckets = [{} for _ in range(BANDS)]   # band -> {band bytes: [doc ids]}
+        self.dirty = False
+
+    @classmethod
+    def load(cls, base_dir):
+        """Load the index saved in a snippets folder, or start an empty one"""
+        path = os.path.join(base_dir, SIMILARITY_FILENAME)
+        index = cls(path)
+        if not load_json(path, SIMILARITY_VERSION, index._restore):
+            # A missing or damaged cache is simply rebuilt by the next sync
+            index = cls(path)
+        index.dirty = False
+        return index
+
+    def _restore(self, state):
+        # Signatures are saved as hex, in this machine's byte order
+        for doc_id, key, signature in state['signatures']:
+            if signature is not None:
+                signature = array('I', bytes.fromhex(signature))
+                if len(signature) != NUM_HASHES:
+                    raise ValueError("signature of the wrong length")
+            self._add(doc_id, key if isinstance(key, str) else tuple(key), signature)
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        signatures = [[doc_id, key, None if signature is None else signature.tobytes().hex()]
+                      for doc_id, (key, signature) in self.signatures.items()]
+        save_json(self.path, SIMILARITY_VERSION, {'signatures': signatures})
+        self.dirty = False
+
+    def stale(self, snippets):
+        """The snippets whose code changed since they were indexed, or were never indexed"""
+        result = []
+        for snippet in snippets:
+            entry = self.signatures.get(snippet['id'])
+            if entry is None or entry[0] != _code_key(snippet):
+                result.append(snippet)
+        return result
+
+    def sync(self, snippets, read_code):
+        """Bring the index in line with the given snippets"""
+        for snippet in self.stale(snippets):
+            self.update(snippet, read_code(snippet))
+        seen = {snippet['id'] for snippet in snippets}
+        for doc_id in [doc_id for doc_id in self.signatures if doc_id not in seen]:
+            self.remove(doc_id)
+
+    @staticmethod
+    def _bands(signature):
+        for band in range(BANDS):
+            yield band, signature[band * ROWS:(band + 1) * ROWS].tobytes()
+
+    def _add(self, doc_id, key, signature):
+        self.signatures[doc_id] = (key, signature)
+        if signature is not None:
+            for band, value in self._bands(signature):
+                self.buckets[band].setdefault(value, []).append(doc_id)
+        self.dirty = True
+
+    def update(self, snippet, code):
+        """Index a snippet's code, replacing any previous signature"""
+        self.remove(snippet['id'])
+        self._add(snippet['id'], _code_key(snippet), minhash(code or ''))
+
+    def remove(self, doc_id):
+        entry = self.signatures.pop(doc_id, None)
+        if entry is None:
+            return
+        if entry[1] is not None:
+            for band, value in self._bands(entry[1]):
+                bucket = self.buckets[band][value]
+                bucket.remove(doc_id)
+                if not bucket:
+                    del self.buckets[band][value]
+        self.dirty = True
+
+    def similar(self, code, threshold=0.5, limit=10, exclude=None):
+        """[(doc_id, similarity)] for indexed snippets similar to code, most similar first"""
+        signature = minhash(code)
+        if signature is None:
+            return []
+        candidates = set()
+        for band, value in self._bands(signature):
+            candidates.update(self.buckets[band].get(value, ()))
+        candidates.discard(exclude)
+        matches = []
+        for doc_id in candidates:
+            similarity = estimate(signature, self.signatures[doc_id][1])
+            if similarity >= threshold:
+                matches.append((doc_id, similarity))
+        matches.sort(key=lambda match: (-match[1], match[0]))
+        return matches[:limit]
@@ -0,0 +1,168 @@
+"""A compact, memory-mapped copy of what the home page shows, for fast startup.
+
+When a library closes it writes startup_snapshot.bin: one column per
+field (ids, interned language/extension/tag ids, and offset-indexed
+UTF-8 strings for titles, filenames, dates and previews). Opening it
+maps the file and parses only a small header, so the first screen of
+cards can be drawn from it immediately; each record is decoded only
+when the card grid asks for it. Meanwhile the real metadata and the
+search index load in the background.
+
+The snapshot records the stamp (sizes and mtimes) of the metadata store
+it was written from and is ignored once the store has changed.
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from .cachefile import replacing
+
+SNAPSHOT_FILENAME = "startup_snapshot.bin"
+SNAPSHOT_VERSION = 1
+
+_MAGIC = b"SNIPSNAP"
+_PREAMBLE = struct.Struct("<8sII")     # magic, version, header length
+_ALIGN = 8
+
+STRING_FIELDS = ("title", "filename", "created", "code_preview")
+INTERNED_FIELDS = ("language", "extension")
+
+
+def _strings(values):
+    """(offsets, blob) for a column of strings"""
+    offsets = array('I', [0])
+    parts = []
+    total = 0
+    for value in values:
+        data = (value or "").encode('utf-8')
+        parts.append(data)
+        total += len(data)
+        offsets.append(total)
+    return offsets, b"".join(parts)
+
+
+def write_snapshot(base_dir, snippets, stamp):
+    """Write the snapshot of a library's snippets, in their current order"""
+    interned = {field: {} for field in INTERNED_FIELDS}
+    tag_table = {}
+    columns = {"id": array('q', [snippet['id'] for snippet in snippets])}
+    for field in INTERNED_FIELDS:
+        table = interned[field]
+        columns[field] = array('H', [table.setdefault(snippet.get(field) or "", len(table))
+                                     for snippet in snippets])
+    tag_offsets = array('I', [0])
+    tag_ids = array('I')
+    for snippet in snippets:
+        tag_ids.extend(tag_table.setdefault(tag, len(tag_table)) for tag in snippet.get('tags', []))
+        tag_offsets.append(len(tag_ids))
+    columns["tag_offsets"], columns["tag_ids"] = tag_offsets, tag_ids
+    for field in STRING_FIELDS:
+        offsets, blob = _strings(snippet.get(field) for snippet in snippets)
+        columns[field + "_offsets"] = offsets
+        columns[field] = blob
+
+    # Lay the columns out one after another, aligned, behind the header
+    layout = {}
+    position = 0
+    for name, column in columns.items():
+        data = column.tobytes() if isinstance(column, array) else column
+        typecode = column.typecode if isinstance(column, array) else "B"
+        layout[name] = [position, len(data), typecode]
+        position += -(-len(data) // _ALIGN) * _ALIGN
+    header = json.dumps({
+        "count": len(snippets),
+        "stamp": stamp,
+        "byteorder": sys.byteorder,
+        "tables": {field: list(table) for field, table in interned.items()},
+        "tags": list(tag_table),
+        "columns": layout,
+    }).encode('utf-8')
+    header += b" " * (-(_PREAMBLE.size + len(header)) % _ALIGN)
+
+    with replacing(os.path.join(base_dir, SNAPSHOT_FILENAME)) as f:
+        f.write(_PREAMBLE.pack(_MAGIC, SNAPSHOT_VERSION, len(header)))
+        f.write(header)
+        for name, column in columns.items():
+            data = column.tobytes() if isinstance(column, array) else column
+            f.write(data)
+            f.write(b"\0" * (-len(data) % _ALIGN))
+
+
+class Snapshot:
+    """Read-only view of a startup snapshot; a sequence of card records"""
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._map = None
+        self._views = {}
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, header_length = _PREAMBLE.unpack_from(self._map, 0)
+            if magic != _MAGIC or version != SNAPSHOT_VERSION:
+                raise ValueError("not a current snapshot")
+            start = _PREAMBLE.size + header_length
+            header = json.loads(bytes(self._map[_PREAMBLE.size:start]))
+            if header["byteorder"] != sys.byteorder:
+                raise ValueError("snapshot written on a different platform")
+            self.count = header["count"]
+            self.stamp = header["stamp"]
+            self.tables = header["tables"]
+            self.tags = header["tags"]
+            data = memoryview(self._map)
+            for name, (offset, length, typecode) in header["columns"].items():
+                view = data[start + offset:start + offset + length]
+                self._views[name] = view.cast(typecode) if typecode != "B" else view
+        except Exception:
+            self.close()
+            raise
+
+    @classmethod
+    def open(cls, base_dir, stamp=None):
+        """The snapshot in a snippets folder, or None if it is missing, damaged or
+        was written from a different state of the metadata store than stamp"""
+        path = os.path.join(base_dir, SNAPSHOT_FILENAME)
+        if not os.path.exists(path):
+            return None
+        try:
+            snapshot = cls(path)
+        except (OSError, ValueError, KeyError, TypeError, struct.error):
+            return None
+        if stamp is not None and snapshot.stamp != stamp:
+            snapshot.close()
+            return None
+        return snapshot
+
+    def __len__(self):
+        return self.count
+
+    def _string(self, field, index):
+        offsets = self._views[field + "_offsets"]
+        return str(self._views[field][offsets[index]:offsets[index + 1]], 'utf-8')
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        views = self._views
+        record = {"id": views["id"][index]}
+        for field in INTERNED_FIELDS:
+            record[field] = self.tables[field][views[field][index]]
+        tag_offsets = views["tag_offsets"]
+        record["tags"] = [self.tags[tag_id] for tag_id in
+                          views["tag_ids"][tag_offsets[index]:tag_offsets[index + 1]]]
+        for field in STRING_FIELDS:
+            record[field] = self._string(field, index)
+        return record
+
+    def close(self):
+        for view in self._views.values():
+            view.release()
+        self._views = {}
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
@@ -0,0 +1,645 @@
+"""Storage backends for snippet metadata.
+
+Every backend stores the same snippet dictionaries the GUI works with:
+id, title, language, filename, filepath, extension, tags, code_preview,
+created and content_hash. The JSON backend keeps the original snippets_metadata.json
+layout plus an append-only journal, the SQLite backend stores one row per
+snippet so a save or a delete only touches the rows involved.
+
+Several processes may share one snippets folder. Ids are reserved from
+the store a block at a time, so no two processes hand out the same one,
+and changes() tells each process what the others stored since it last
+asked, so it can merge them instead of reloading everything.
+"""
+import contextlib
+import json
+import os
+import sqlite3
+import uuid
+
+from .locking import FileLock
+
+METADATA_FILENAME = "snippets_metadata.json"
+JOURNAL_FILENAME = "snippets_metadata.journal"
+LOCK_FILENAME = "snippets_metadata.lock"
+DATABASE_FILENAME = "snippets.db"
+
+# Journal size at which the JSON backend writes a fresh snapshot
+JOURNAL_COMPACT_SIZE = 1024 * 1024
+
+# Entries the SQLite change log keeps; a process further behind reloads instead
+CHANGE_LOG_SIZE = 10000
+
+SNIPPET_COLUMNS = ("id", "title", "language", "filename", "filepath",
+                   "extension", "code_preview", "created", "content_hash", "modified")
+
+
+def copy_snippet(snippet):
+    """Return a copy of a snippet dict that shares no mutable state"""
+    copy = dict(snippet)
+    copy['tags'] = list(snippet.get('tags', []))
+    return copy
+
+
+def _file_key(path):
+    """Identifies one version of a file that is only ever replaced, never edited"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+class StorageBackend:
+    """Interface shared by all metadata backends"""
+
+    name = None
+    files = ()      # what the backend keeps in the snippets folder
+
+    def load_all(self):
+        """Return every stored snippet as a list of dicts"""
+        raise NotImplementedError
+
+    def get(self, snippet_id):
+        """Return a single snippet or None"""
+        raise NotImplementedError
+
+    def insert(self, snippet):
+        """Store a new snippet, assigning an id if it has none. Returns the id"""
+        raise NotImplementedError
+
+    def insert_many(self, snippets):
+        """Store several new snippets at once. Returns their ids"""
+        return [self.insert(snippet) for snippet in snippets]
+
+    def update(self, snippet):
+        """Replace the stored copy of an existing snippet"""
+        raise NotImplementedError
+
+    def update_many(self, snippets):
+        """Replace several existing snippets at once"""
+        for snippet in snippets:
+            self.update(snippet)
+
+    def delete(self, snippet_id):
+        """Remove a snippet by id"""
+        raise NotImplementedError
+
+    def apply_changes(self, inserts=(), updates=(), deletes=()):
+        """Write a batch of changes; backends make this one transaction or one write"""
+        if inserts:
+            self.insert_many(inserts)
+        if updates:
+            self.update_many(updates)
+        for snippet_id in deletes:
+            self.delete(snippet_id)
+
+    def last_id(self):
+        """Highest id ever handed out, including ids of deleted snippets"""
+        raise NotImplementedError
+
+    def reserve_ids(self, count):
+        """Set aside count new ids that no other process will hand out.
+
+        Returns (first, last). Snippets inserted with these ids may be
+        stored in any order, or not at all.
+        """
+        raise NotImplementedError
+
+    def changes(self):
+        """What other processes stored since load_all() or the last call.
+
+        Returns (puts, deletes): the current version of every snippet that
+        was added or changed, and the ids of deleted ones. If the backend
+        lost track, deletes is None and puts holds every snippet; any
+        other snippet was deleted.
+        """
+        raise NotImplementedError
+
+    def needs_compaction(self):
+        """Whether compact() is due; writes never compact on their own"""
+        return False
+
+    def compact(self):
+        """Fold logged changes into the main store; slow, so run it off the UI thread"""
+
+    def close(self):
+        pass
+
+
+class JsonStorage(StorageBackend):
+    """Original storage format: a JSON snapshot plus an append-only journal.
+
+    snippets_metadata.json keeps the original layout. Every batch of
+    changes is appended to snippets_metadata.journal as one JSON line and
+    fsynced, so a save costs one small write instead of a full rewrite.
+    Loading replays the journal over the snapshot; a torn last line left
+    by a crash is dropped. Once the journal grows past
+    JOURNAL_COMPACT_SIZE, needs_compaction() says so and compact()
+    rewrites the snapshot atomically and empties the journal; the library
+    runs it as a separate job on its I/O worker, so no save waits for it.
+
+    Every write happens under snippets_metadata.lock and first reads the
+    journal lines other processes appended since, so each process's view
+    stays whole and a compaction never drops another writer's changes.
+    Reserved ids are journalled too, and carried over by compaction.
+    """
+
+    name = "json"
+    files = (METADATA_FILENAME, JOURNAL_FILENAME)
+
+    def __init__(self, base_dir):
+        self.path = os.path.join(base_dir, METADATA_FILENAME)
+        self.journal_path = os.path.join(base_dir, JOURNAL_FILENAME)
+        self.lock = FileLock(os.path.join(base_dir, LOCK_FILENAME))
+        self._journal = None
+        with self.lock:
+            self._load()
+        self._external = []       # other processes' records, until changes() hands them out
+
+    def _load(self):
+        """Read the snapshot and replay the journal. Called with the lock held"""
+        self._snippets = {}
+        self._snapshot_key = _file_key(self.path)
+        if self._snapshot_key is not None:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for snippet in json.load(f):
+                    self._snippets[snippet['id']] = snippet
+        self._last_id = max(self._snippets, default=0)
+        self._offset = 0
+        self._replay()
+
+    def _replay(self):
+        """Apply journalled changes after the part already read. Returns the records"""
+        if not os.path.exists(self.journal_path):
+            return []
+        records = []
+        good_size = self._offset
+        with open(self.journal_path, 'rb') as f:
+            f.seek(self._offset)
+            for line in f:
+                try:
+                    record = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                self._apply_record(record)
+                records.append(record)
+                good_size += len(line)
+        if good_size != os.path.getsize(self.journal_path):
+            # Interrupted append; cut it off so new records follow a clean line.
+            # Writers hold the lock, so this is never someone else's append in progress
+            with open(self.journal_path, 'r+b') as f:
+                f.truncate(good_size)
+        self._offset = good_size
+        return records
+
+    def _apply_record(self, record):
+        for snippet in record.get('put', []):
+            self._snippets[snippet['id']] = snippet
+            self._last_id = max(self._last_id, snippet['id'])
+        for snippet_id in record.get('delete', []):
+            self._snippets.pop(snippet_id, None)
+        self._last_id = max(self._last_id, record.get('reserve', 0))
+
+    def _catch_up(self):
+        """Apply what other processes wrote since we last looked. Called with the lock held"""
+        if (_file_key(self.path) != self._snapshot_key
+                or _file_size(self.journal_path) < self._offset):
+            # Another process compacted: start again from its snapshot
+            self._load()
+            self._external = None
+        else:
+            records = self._replay()
+            if self._external is not None:
+                self._external.extend(records)
+
+    def changes(self):
+        if (self._external == []
+                and _file_size(self.journal_path) == self._offset
+                and _file_key(self.path) == self._snapshot_key):
+            return [], []
+        with self.lock:
+            self._catch_up()
+        external, self._external = self._external, []
+        if external is None:
+            return self.load_all(), None
+        puts, deletes = {}, set()
+        for record in external:
+            for snippet in record.get('put', []):
+                puts[snippet['id']] = snippet
+                deletes.discard(snippet['id'])
+            for snippet_id in record.get('delete', []):
+                puts.pop(snippet_id, None)
+                deletes.add(snippet_id)
+        return [copy_snippet(s) for s in puts.values()], sorted(deletes)
+
+    def load_all(self):
+        return [copy_snippet(s) for s in self._snippets.values()]
+
+    def get(self, snippet_id):
+        snippet = self._snippets.get(snippet_id)
+        return copy_snippet(snippet) if snippet else None
+
+    def _store(self, snippet):
+        if snippet.get('id') is None:
+            self._last_id += 1
+            snippet['id'] = self._last_id
+        else:
+            self._last_id = max(self._last_id, snippet['id'])
+        self._snippets[snippet['id']] = copy_snippet(snippet)
+        return snippet['id']
+
+    def insert(self, snippet):
+        return self.insert_many([snippet])[0]
+
+    def insert_many(self, snippets):
+        self.apply_changes(inserts=snippets)
+        return [snippet['id'] for snippet in snippets]
+
+    def update(self, snippet):
+        self.update_many([snippet])
+
+    def update_many(self, snippets):
+        for snippet in snippets:
+            if snippet['id'] not in self._snippets:
+                raise KeyError(snippet['id'])
+        self.apply_changes(updates=snippets)
+
+    def delete(self, snippet_id):
+        if snippet_id in self._snippets:
+            self.apply_changes(deletes=[snippet_id])
+
+    def apply_changes(self, inserts=(), updates=(), deletes=()):
+        with self.lock:
+            self._catch_up()
+            for snippet in inserts:
+                self._store(snippet)
+            for snippet in updates:
+                self._snippets[snippet['id']] = copy_snippet(snippet)
+            for snippet_id in deletes:
+                self._snippets.pop(snippet_id, None)
+            # One line per batch: a crash mid-write loses the batch, never half of it
+            record = {}
+            puts = list(inserts) + list(updates)
+            if puts:
+                record['put'] = [copy_snippet(s) for s in puts]
+            if deletes:
+                record['delete'] = list(deletes)
+            if record:
+                self._append(record)
+
+    def last_id(self):
+        return self._last_id
+
+    def reserve_ids(self, count):
+        with self.lock:
+            self._catch_up()
+            first = self._last_id + 1
+            self._last_id += count
+            self._append({'reserve': self._last_id})
+        return first, self._last_id
+
+    def _append(self, record):
+        """Write one journal line. Called with the lock held"""
+        if self._journal is None:
+            self._journal = open(self.journal_path, 'ab')
+        self._journal.write(json.dumps(record, separators=(',', ':')).encode('utf-8') + b"\n")
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._offset = self._journal.tell()
+
+    def needs_compaction(self):
+        return self._offset > JOURNAL_COMPACT_SIZE
+
+    def compact(self):
+        """Fold the journal into a new snapshot"""
+        with self.lock:
+            self._catch_up()
+            self._compact()
+
+    def _compact(self):
+        # Write to a temp file first so a crash never leaves half an index
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(list(self._snippets.values()), f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._snapshot_key = _file_key(self.path)
+        # Replaying the old journal over the new snapshot is harmless, so a
+        # crash before this truncate loses nothing
+        if self._journal is None:
+            self._journal = open(self.journal_path, 'ab')
+        self._journal.truncate(0)
+        self._offset = 0
+        # The snapshot only knows the ids in use; keep the reserved ones taken
+        self._append({'reserve': self._last_id})
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+
+class SqliteStorage(StorageBackend):
+    """Indexed SQLite storage with single-row writes.
+
+    Triggers log the id of every inserted, updated or deleted row in the
+    changes table, and each write transaction marks its own entries with
+    this connection's origin. PRAGMA data_version tells cheaply whether
+    another connection wrote at all; only then is the log read.
+    """
+
+    name = "sqlite"
+    files = (DATABASE_FILENAME, DATABASE_FILENAME + "-wal")
+    schema_version = 4
+
+    def __init__(self, base_dir):
+        self.path = os.path.join(base_dir, DATABASE_FILENAME)
+        self.origin = uuid.uuid4().hex
+        self._seen = 0              # newest change log entry merged
+        self._data_version = None
+        # The connection may be handed to a background I/O thread; callers make
+        # sure only one thread uses it at a time
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self._create_schema()
+        self._migrate_json(os.path.join(base_dir, METADATA_FILENAME))
+
+    def _create_schema(self):
+        with self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+                CREATE TABLE IF NOT EXISTS snippets (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    title TEXT NOT NULL,
+                    language TEXT NOT NULL,
+                    filename TEXT,
+                    filepath TEXT,
+                    extension TEXT,
+                    code_preview TEXT,
+                    created TEXT,
+                    content_hash TEXT,
+                    modified TEXT
+                );
+                CREATE TABLE IF NOT EXISTS snippet_tags (
+                    snippet_id INTEGER NOT NULL
+                        REFERENCES snippets(id) ON DELETE CASCADE,
+                    position INTEGER NOT NULL,
+                    tag TEXT NOT NULL,
+                    PRIMARY KEY (snippet_id, position)
+                );
+                CREATE TABLE IF NOT EXISTS changes (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    snippet_id INTEGER NOT NULL,
+                    origin TEXT
+                );
+                CREATE TRIGGER IF NOT EXISTS snippets_inserted AFTER INSERT ON snippets
+                BEGIN
+                    INSERT INTO changes (snippet_id) VALUES (NEW.id);
+                END;
+                CREATE TRIGGER IF NOT EXISTS snippets_updated AFTER UPDATE ON snippets
+                BEGIN
+                    INSERT INTO changes (snippet_id) VALUES (NEW.id);
+                END;
+                CREATE TRIGGER IF NOT EXISTS snippets_deleted AFTER DELETE ON snippets
+                BEGIN
+                    INSERT INTO changes (snippet_id) VALUES (OLD.id);
+                END;
+                CREATE INDEX IF NOT EXISTS idx_snippets_language ON snippets(language);
+                CREATE INDEX IF NOT EXISTS idx_snippets_filename ON snippets(filename);
+                CREATE INDEX IF NOT EXISTS idx_snippet_tags_tag ON snippet_tags(tag);
+            """)
+            self.conn.execute("INSERT OR IGNORE INTO meta VALUES ('schema_version', ?)",
+                              (str(self.schema_version),))
+            self._upgrade_schema(int(self._get_meta('schema_version')))
+
+    def _upgrade_schema(self, version):
+        if version >= self.schema_version:
+            # Opening must not write: the file's mtime tells readers nothing changed
+            return
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(snippets)")]
+        if version < 2 and "content_hash" not in columns:
+            self.conn.execute("ALTER TABLE snippets ADD COLUMN content_hash TEXT")
+        if version < 3 and "modified" not in columns:
+            self.conn.execute("ALTER TABLE snippets ADD COLUMN modified TEXT")
+        # Version 4 added the changes table and its triggers, created above
+        self._set_meta('schema_version', self.schema_version)
+
+    @contextlib.contextmanager
+    def _write_transaction(self):
+        """A transaction that takes the write lock up front and claims the
+        change log entries it adds as this connection's own"""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            start = self._change_seq()
+            yield
+            self.conn.execute("UPDATE changes SET origin = ? WHERE seq > ?", (self.origin, start))
+            self.conn.execute("DELETE FROM changes WHERE seq <= ?", (start - CHANGE_LOG_SIZE,))
+        except BaseException:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+
+    def _change_seq(self):
+        row = self.conn.execute(
+            "SELECT seq FROM sqlite_sequence WHERE name = 'changes'").fetchone()
+        return row[0] if row else 0
+
+    def _get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, str(value)))
+
+    def _migrate_json(self, json_path):
+        """Import an existing metadata file the first time the database is opened"""
+        journal_path = os.path.join(os.path.dirname(json_path), JOURNAL_FILENAME)
+        if self._get_meta('json_migrated') or not (os.path.exists(json_path)
+                                                  or os.path.exists(journal_path)):
+            return
+        # Go through JsonStorage so changes still in its journal come along
+        json_storage = JsonStorage(os.path.dirname(json_path))
+        snippets = json_storage.load_all()
+        json_storage.close()
+        with self.conn:
+            self._insert_rows(snippets)
+            self._set_meta('json_migrated', json_path)
+
+    def _row_values(self, snippet):
+        return tuple(snippet.get(column) for column in SNIPPET_COLUMNS)
+
+    def _insert_rows(self, snippets):
+        ids = []
+        placeholders = ", ".join("?" * len(SNIPPET_COLUMNS))
+        for snippet in snippets:
+            cursor = self.conn.execute(
+                f"INSERT INTO snippets ({', '.join(SNIPPET_COLUMNS)}) VALUES ({placeholders})",
+                self._row_values(snippet))
+            snippet['id'] = cursor.lastrowid
+            self._write_tags(snippet)
+            ids.append(snippet['id'])
+        return ids
+
+    def _write_tags(self, snippet):
+        self.conn.execute("DELETE FROM snippet_tags WHERE snippet_id = ?", (snippet['id'],))
+        self.conn.executemany(
+            "INSERT INTO snippet_tags (snippet_id, position, tag) VALUES (?, ?, ?)",
+            [(snippet['id'], pos, tag) for pos, tag in enumerate(snippet.get('tags', []))])
+
+    def _rows_to_snippets(self, rows):
+        snippets = {}
+        for row in rows:
+            snippet = dict(zip(SNIPPET_COLUMNS, row))
+            snippet['tags'] = []
+            snippets[snippet['id']] = snippet
+        return snippets
+
+    def load_all(self):
+        # Anything changed from here on shows up in changes(), perhaps twice
+        self._seen = self._change_seq()
+        self._data_version = self._get_data_version()
+        snippets = self._rows_to_snippets(self.conn.execute(
+            f"SELECT {', '.join(SNIPPET_COLUMNS)} FROM snippets ORDER BY id"))
+        for snippet_id, tag in self.conn.execute(
+                "SELECT snippet_id, tag FROM snippet_tags ORDER BY snippet_id, position"):
+            snippets[snippet_id]['tags'].append(tag)
+        return list(snippets.values())
+
+    def _fetch(self, ids):
+        """{id: snippet} for those of the ids that exist"""
+        snippets = {}
+        ids = list(ids)
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            marks = ", ".join("?" * len(chunk))
+            found = self._rows_to_snippets(self.conn.execute(
+                f"SELECT {', '.join(SNIPPET_COLUMNS)} FROM snippets WHERE id IN ({marks})", chunk))
+            for snippet_id, tag in self.conn.execute(
+                    f"SELECT snippet_id, tag FROM snippet_tags WHERE snippet_id IN ({marks}) "
+                    f"ORDER BY snippet_id, position", chunk):
+                found[snippet_id]['tags'].append(tag)
+            snippets.update(found)
+        return snippets
+
+    def get(self, snippet_id):
+        return self._fetch([snippet_id]).get(snippet_id)
+
+    def _get_data_version(self):
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def changes(self):
+        data_version = self._get_data_version()
+        if data_version == self._data_version:
+            return [], []
+        self._data_version = data_version
+        latest = self._change_seq()
+        oldest = self.conn.execute("SELECT min(seq) FROM changes").fetchone()[0]
+        if oldest is not None and oldest > self._seen + 1:
+            # Entries we never saw were pruned from the log
+            self._seen = latest
+            return self.load_all(), None
+        ids = {snippet_id for (snippet_id,) in self.conn.execute(
+            "SELECT snippet_id FROM changes WHERE seq > ? AND seq <= ? AND origin IS NOT ?",
+            (self._seen, latest, self.origin))}
+        self._seen = latest
+        snippets = self._fetch(ids)
+        return list(snippets.values()), sorted(ids - set(snippets))
+
+    def insert(self, snippet):
+        with self._write_transaction():
+            return self._insert_rows([snippet])[0]
+
+    def insert_many(self, snippets):
+        with self._write_transaction():
+            return self._insert_rows(snippets)
+
+    def update(self, snippet):
+        self.update_many([snippet])
+
+    def update_many(self, snippets):
+        with self._write_transaction():
+            self._update_rows(snippets)
+
+    def _update_rows(self, snippets):
+        assignments = ", ".join(f"{column} = ?" for column in SNIPPET_COLUMNS[1:])
+        for snippet in snippets:
+            cursor = self.conn.execute(
+                f"UPDATE snippets SET {assignments} WHERE id = ?",
+                self._row_values(snippet)[1:] + (snippet['id'],))
+            if cursor.rowcount == 0:
+                raise KeyError(snippet['id'])
+            self._write_tags(snippet)
+
+    def delete(self, snippet_id):
+        with self._write_transaction():
+            self.conn.execute("DELETE FROM snippets WHERE id = ?", (snippet_id,))
+
+    def apply_changes(self, inserts=(), updates=(), deletes=()):
+        with self._write_transaction():
+            self._insert_rows(inserts)
+            self._update_rows(updates)
+            self.conn.executemany("DELETE FROM snippets WHERE id = ?",
+                                  [(snippet_id,) for snippet_id in deletes])
+
+    def last_id(self):
+        row = self.conn.execute(
+            "SELECT seq FROM sqlite_sequence WHERE name = 'snippets'").fetchone()
+        return row[0] if row else 0
+
+    def reserve_ids(self, count):
+        # AUTOINCREMENT never goes below sqlite_sequence, so moving it up reserves the ids
+        with self._write_transaction():
+            last_used = max(self.last_id(), self.conn.execute(
+                "SELECT coalesce(max(id), 0) FROM snippets").fetchone()[0])
+            if self.conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'snippets'",
+                                 (last_used + count,)).rowcount == 0:
+                self.conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('snippets', ?)",
+                                  (last_used + count,))
+        return last_used + 1, last_used + count
+
+    def close(self):
+        self.conn.close()
+
+
+BACKENDS = {
+    JsonStorage.name: JsonStorage,
+    SqliteStorage.name: SqliteStorage,
+}
+
+
+def storage_stamp(base_dir, backend="sqlite"):
+    """[mtime_ns, size] of each of a backend's files (None if missing); changes with the data"""
+    stamp = []
+    for filename in BACKENDS[backend].files:
+        try:
+            stat = os.stat(os.path.join(base_dir, filename))
+        except OSError:
+            stamp.append(None)
+        else:
+            stamp.append([stat.st_mtime_ns, stat.st_size])
+    return stamp
+
+
+def open_storage(base_dir, backend="sqlite"):
+    """Open the metadata store for a snippets folder"""
+    try:
+        backend_class = BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown storage backend: {backend}") from None
+    return backend_class(base_dir)
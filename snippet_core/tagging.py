@@ -0,0 +1,267 @@
+"""Rule-driven tag generation.
+
+Rules live in a JSON data file (tag_rules.json next to this module by
+default). Each language gets the default rules plus its own, along with
+its comment syntax. A snippet is tagged by stripping comments, splitting
+the remaining text into identifiers once, and looking every distinct
+identifier up in keyword tables built from all rules, so the cost is one
+pass over the code no matter how many rules there are. Matches are whole
+identifiers, so "if" no longer matches inside "diff". Only the lines
+comment markers appear on are scanned for strings and comments, and the
+split works on the UTF-8 bytes, so a megabyte of code takes milliseconds.
+
+The tags found in the code are memoized in a TagMemo by content hash and
+language, together with a key for the rules that produced them (the rules
+version and a hash of that language's rules). Code that was tagged before
+is never scanned again until its language's rules change; the language
+and title words are added on every call, since they cost nothing.
+"""
+import json
+import os
+import re
+import string
+import threading
+import zlib
+
+from .blobs import hash_bytes
+from .cachefile import load_json, save_json
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tag_rules.json")
+
+MEMO_FILENAME = "tag_memo.json"
+MEMO_VERSION = 2
+
+# Maps every ASCII byte that cannot be part of an identifier to a space; the
+# bytes of non-ASCII characters are kept, so those characters stay in words
+_IDENTIFIER_CHARS = set(string.ascii_letters + string.digits + "_")
+_SPLIT_TABLE = bytes(byte if byte >= 128 or chr(byte) in _IDENTIFIER_CHARS else ord(" ")
+                     for byte in range(256))
+
+_PART_RE = re.compile(r'[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+')
+_STRING_PATTERN = r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\''
+_TITLE_WORD_RE = re.compile(r'\w+')
+
+
+class LanguageTagger:
+    """The compiled rules for one language"""
+
+    def __init__(self, language, rules, line_comments=(), block_comments=(), key=None):
+        self.language = language
+        self.key = key        # identifies these rules in the TagMemo
+        self.tag_order = []
+        self.exact = {}       # keyword -> tags, case-sensitive
+        self.folded = {}      # lowercase keyword -> tags
+        self.parts = {}       # lowercase identifier part -> tags
+        for rule in rules:
+            tag = rule['tag']
+            if tag not in self.tag_order:
+                self.tag_order.append(tag)
+            ignore_case = rule.get('ignore_case', False)
+            for keyword in rule['keywords']:
+                if rule.get('match_parts', False):
+                    self.parts.setdefault(keyword.lower(), set()).add(tag)
+                if ignore_case:
+                    self.folded.setdefault(keyword.lower(), set()).add(tag)
+                else:
+                    self.exact.setdefault(keyword, set()).add(tag)
+
+        # Only identifiers containing one of these can have a matching part. A
+        # part is lowercase, capitalized or uppercase; three case-sensitive
+        # forms match far faster than re.IGNORECASE
+        self.parts_re = None
+        if self.parts:
+            forms = {form for part in self.parts
+                     for form in (part, part.capitalize(), part.upper())}
+            self.parts_re = re.compile("|".join(sorted(map(re.escape, forms), key=len,
+                                                       reverse=True)))
+
+        # Strings are matched too, so comment markers inside them are ignored
+        comment_patterns = [re.escape(marker) + r'[^\n]*' for marker in line_comments]
+        comment_patterns += [re.escape(start) + r'.*?' + re.escape(end)
+                             for start, end in block_comments]
+        self.comment_re = self.marker_re = None
+        if comment_patterns:
+            self.comment_re = re.compile(
+                f"({_STRING_PATTERN})|" + "|".join(comment_patterns), re.DOTALL)
+            markers = list(line_comments) + [start for start, end in block_comments]
+            self.marker_re = re.compile("|".join(map(re.escape, markers)))
+
+    def strip_comments(self, code):
+        """The code with each comment replaced by a space.
+
+        Strings only run on past a line end escaped with a backslash, so
+        whether a marker starts a comment depends on its own line and the
+        lines it continues; lines without a marker are never scanned.
+        """
+        if self.marker_re is None:
+            return code
+        pieces = []
+        done = 0
+        marker = self.marker_re.search(code)
+        while marker is not None:
+            at = marker.start()
+            start = code.rfind("\n", 0, at) + 1
+            while start > done and code[start - 2:start - 1] == "\\":
+                start = code.rfind("\n", 0, start - 1) + 1
+            match = self.comment_re.search(code, max(start, done))
+            while match is not None and match.end() <= at:
+                match = self.comment_re.search(code, match.end())
+            if match is None or match.start() > at:
+                # An unclosed block comment: not a comment
+                resume = at + 1
+            elif match.group(1) is not None:
+                # The marker is inside a string
+                resume = match.end()
+            else:
+                pieces.append(code[done:match.start()])
+                pieces.append(" ")
+                done = resume = match.end()
+            marker = self.marker_re.search(code, resume)
+        if not pieces:
+            return code
+        pieces.append(code[done:])
+        return "".join(pieces)
+
+    def identifiers(self, code):
+        """Distinct identifiers in the code, comments excluded"""
+        words = set(self.strip_comments(code).encode('utf-8', 'surrogatepass')
+                    .translate(_SPLIT_TABLE).split())
+        return {word.decode('utf-8', 'replace') for word in words}
+
+    def tag_code(self, code):
+        found = set()
+        words = self.identifiers(code)
+        # Set operations and filter() keep the per-word work out of Python
+        for word in words.intersection(self.exact):
+            found |= self.exact[word]
+        if self.folded:
+            for word in set(map(str.lower, words)).intersection(self.folded):
+                found |= self.folded[word]
+        if self.parts_re is not None:
+            for word in filter(self.parts_re.search, words):
+                for part in _PART_RE.findall(word):
+                    part = part.lower()
+                    if part in self.parts:
+                        found |= self.parts[part]
+        return [tag for tag in self.tag_order if tag in found]
+
+
+class TagMemo:
+    """Tags found in code, by (content hash, language) and the rules key that found them.
+
+    Shared by the UI thread and the I/O worker, hence the lock.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}         # (digest, language) -> (rules key, tags)
+        self.dirty = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    @classmethod
+    def load(cls, base_dir):
+        """Load the memo saved in a snippets folder, or start an empty one"""
+        path = os.path.join(base_dir, MEMO_FILENAME)
+        memo = cls(path)
+        if not load_json(path, MEMO_VERSION, memo._restore):
+            # A missing or damaged memo only means the code is tagged again
+            memo = cls(path)
+        return memo
+
+    def _restore(self, state):
+        self.entries = {(digest, language): (key, tuple(tags))
+                        for digest, language, key, tags in state['entries']}
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        with self._lock:
+            entries = [[digest, language, key, tags]
+                       for (digest, language), (key, tags) in self.entries.items()]
+            self.dirty = False
+        save_json(self.path, MEMO_VERSION, {'entries': entries})
+
+    def get(self, digest, language, key):
+        """The memoized tags, or None if missing or found by other rules"""
+        entry = self.entries.get((digest, language))
+        if entry is None or entry[0] != key:
+            return None
+        return entry[1]
+
+    def put(self, digest, language, key, tags):
+        with self._lock:
+            self.entries[(digest, language)] = (key, tuple(tags))
+            self.dirty = True
+
+    def prune(self, digests):
+        """Forget code no longer in the library (drafts, old versions)"""
+        with self._lock:
+            stale = [entry for entry in self.entries if entry[0] not in digests]
+            for entry in stale:
+                del self.entries[entry]
+            if stale:
+                self.dirty = True
+        return len(stale)
+
+
+class TagEngine:
+    """Generates tags for snippets from a rules file, without any UI"""
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.version = rules.get('version', 1)
+        self._taggers = {}
+
+    @classmethod
+    def load(cls, path=None):
+        with open(path or DEFAULT_RULES_PATH, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def for_language(self, language):
+        tagger = self._taggers.get(language)
+        if tagger is None:
+            default = self.rules.get('default', {})
+            specific = self.rules.get('languages', {}).get(language, {})
+            rules = default.get('rules', []) + specific.get('rules', [])
+            line_comments = specific.get('line_comments', default.get('line_comments', []))
+            block_comments = specific.get('block_comments', default.get('block_comments', []))
+            # Editing one language's rules only invalidates that language's memo entries
+            compiled = json.dumps([rules, line_comments, block_comments], sort_keys=True)
+            key = f"{self.version}:{zlib.crc32(compiled.encode('utf-8')):08x}"
+            tagger = LanguageTagger(language, rules, line_comments, block_comments, key)
+            self._taggers[language] = tagger
+        return tagger
+
+    def generate(self, code, language, title="", memo=None, digest=None):
+        """Tags for a snippet: detected constructs, the language and title keywords.
+
+        With a TagMemo, code already tagged under the current rules is not
+        scanned again; digest is the code's content hash if already known.
+        """
+        tagger = self.for_language(language)
+        found = None
+        if memo is not None:
+            digest = digest or hash_bytes(code.encode('utf-8'))
+            found = memo.get(digest, language, tagger.key)
+        if found is None:
+            found = tagger.tag_code(code)
+            if memo is not None:
+                memo.put(digest, language, tagger.key, found)
+        return self._finish(found, language, title)
+
+    def recall(self, digest, language, title, memo):
+        """generate()'s tags from the memo alone, or None if the code must be read"""
+        found = memo.get(digest, language, self.for_language(language).key)
+        return None if found is None else self._finish(found, language, title)
+
+    @staticmethod
+    def _finish(found, language, title):
+        tags = list(found)
+        tags.append(language.lower())
+        for word in _TITLE_WORD_RE.findall(title.lower()):
+            if len(word) > 3 and word not in tags:
+                tags.append(word)
+        return tags
@@ -0,0 +1,85 @@
+import os
+import tempfile
+import time
+import unittest
+
+from snippet_core import SnippetLibrary
+from snippet_core.blobs import hash_file
+
+
+def edit_in_place(path, text):
+    """Overwrite a file's contents without replacing it, as some editors do,
+    dated back far enough that reconcile acts on it at once"""
+    with open(path, 'r+', encoding='utf-8') as f:
+        f.write(text)
+        f.truncate()
+    then = time.time_ns() - 10 * 10**9
+    os.utime(path, ns=(then, then))
+
+
+def read(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+class SharedCodeTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.library = SnippetLibrary(self._tmp.name)
+        self.hello = self.library.create("hello", "print('hello')\n", "Python")
+        self.shared = self.library.create("shared", "print('hello')\n", "Python")
+        self.library.flush()
+        self.library.reconcile()
+
+    def tearDown(self):
+        self.library.close()
+        self._tmp.cleanup()
+
+    def test_files_do_not_share_data_with_the_blob(self):
+        digest = self.hello['content_hash']
+        self.assertEqual(digest, self.shared['content_hash'])
+        self.assertFalse(self.library.blobs.linked(digest, self.hello['filepath']))
+        self.assertEqual(os.stat(self.hello['filepath']).st_nlink, 1)
+
+    def test_in_place_edit_changes_only_that_snippet(self):
+        digest = self.hello['content_hash']
+        edit_in_place(self.hello['filepath'], "print('edited')\n")
+        result = self.library.reconcile()
+        self.assertEqual([snippet['title'] for snippet in result.updated], ["hello"])
+        self.assertEqual(read(self.shared['filepath']), "print('hello')\n")
+        self.assertEqual(self.shared['content_hash'], digest)
+        self.assertEqual(hash_file(self.library.blobs.path(digest)), digest)
+        self.assertEqual(self.library.verify(), [])
+
+    def test_verify_fix_replaces_links_of_earlier_versions(self):
+        digest = self.hello['content_hash']
+        for snippet in (self.hello, self.shared):
+            os.remove(snippet['filepath'])
+            os.link(self.library.blobs.path(digest), snippet['filepath'])
+        problems = self.library.verify(fix=True)
+        self.assertEqual(sorted(problem for key, problem, fixed in problems), ["linked", "linked"])
+        self.assertEqual(self.library.verify(), [])
+        edit_in_place(self.hello['filepath'], "print('edited')\n")
+        self.library.reconcile()
+        self.assertEqual(read(self.shared['filepath']), "print('hello')\n")
+
+    def test_edit_through_an_old_link_is_undone_for_the_others(self):
+        digest = self.hello['content_hash']
+        # The others only get their code back from history
+        self.library.update(self.shared['id'], "shared", "print('hello')\n", "Python", [])
+        self.library.flush()
+        for snippet in (self.hello, self.shared):
+            os.remove(snippet['filepath'])
+            os.link(self.library.blobs.path(digest), snippet['filepath'])
+        self.library.reconcile()
+        edit_in_place(self.hello['filepath'], "print('edited')\n")
+        # The path the watcher reports: the links themselves can't tell which one was edited
+        result = self.library.reconcile([self.hello['filepath']])
+        self.assertEqual([snippet['title'] for snippet in result.updated], ["hello"])
+        self.assertEqual(read(self.shared['filepath']), "print('hello')\n")
+        self.assertEqual(read(self.hello['filepath']), "print('edited')\n")
+        self.assertEqual(hash_file(self.library.blobs.path(digest)), digest)
+
+
+if __name__ == '__main__':
+    unittest.main()
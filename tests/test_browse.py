@@ -0,0 +1,60 @@
+import os
+import tempfile
+import unittest
+
+from snippet_core import SnippetLibrary
+from snippet_core.browse import BrowseIndex
+
+
+def snippet(snippet_id, title, language="Python"):
+    return {'id': snippet_id, 'title': title, 'language': language, 'tags': [],
+            'created': f"2024-01-01T00:00:{snippet_id:02d}"}
+
+
+class BrowseViewTest(unittest.TestCase):
+    def setUp(self):
+        self.index = BrowseIndex(snippet(snippet_id, f"title {snippet_id:02d}")
+                                 for snippet_id in range(1, 41))
+
+    def check_view_follows_deletes(self, within):
+        view = self.index.view("title", False, within)
+        self.assertEqual(view[0], min(within))
+        for snippet_id in sorted(within)[:3]:
+            self.index.remove(snippet_id)
+        expected = sorted(within)[3:]
+        self.assertEqual(len(view), len(expected))
+        self.assertEqual(list(view), expected)
+        self.assertEqual(view[-1], expected[-1])
+        with self.assertRaises(IndexError):
+            view[len(expected)]
+
+    def test_small_filter_follows_deletes(self):
+        self.check_view_follows_deletes({5, 6, 7, 8})
+
+    def test_large_filter_follows_deletes(self):
+        self.check_view_follows_deletes(set(range(1, 31)))
+
+    def test_filtered_view_follows_renames(self):
+        view = self.index.view("title", False, set(range(1, 31)))
+        self.assertEqual(view[0], 1)
+        self.index.update(snippet(1, "zzz"))
+        self.assertEqual(view[len(view) - 1], 1)
+
+
+class LibraryBrowseTest(unittest.TestCase):
+    def test_browse_after_delete(self):
+        with tempfile.TemporaryDirectory() as root:
+            with SnippetLibrary(os.path.join(root, "Code_Snippets")) as library:
+                for title in ("alpha", "beta", "gamma"):
+                    library.create(title, f"print('{title}')\n", "Python", [])
+                view = library.browse("title", language="Python")
+                self.assertEqual([s['title'] for s in view], ["alpha", "beta", "gamma"])
+                library.delete(library.snippets[0]['id'])
+                titles = [s['title'] for s in view]
+                self.assertEqual(len(view), len(titles))
+                self.assertEqual(len(titles), 2)
+                self.assertEqual([view[i]['title'] for i in range(len(view))], titles)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+from snippet_core import SnippetLibrary
+from snippet_core.cli import main
+
+
+class AddCommandTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = self._tmp.name
+        self.base_dir = os.path.join(self.root, "Code_Snippets")
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def run_cli(self, *argv):
+        """(exit code, stderr) of one command"""
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr), contextlib.redirect_stdout(io.StringIO()):
+            code = main(["--library", self.base_dir, *argv])
+        return code, stderr.getvalue()
+
+    def test_binary_file_is_a_clear_error(self):
+        path = os.path.join(self.root, "image.py")
+        with open(path, 'wb') as f:
+            f.write(b"\x89PNG\r\n\x1a\n\xff\xfe")
+        code, stderr = self.run_cli("add", path)
+        self.assertEqual(code, 1)
+        self.assertIn("is not UTF-8 text", stderr)
+        self.assertNotIn("Traceback", stderr)
+        with SnippetLibrary(self.base_dir) as library:
+            self.assertEqual(len(library.snippets), 0)
+
+    def test_missing_file_is_a_clear_error(self):
+        code, stderr = self.run_cli("add", os.path.join(self.root, "missing.py"))
+        self.assertEqual(code, 1)
+        self.assertIn("Can't read", stderr)
+
+    def test_text_file_is_added(self):
+        path = os.path.join(self.root, "hello.py")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("print('hello')\n")
+        code, stderr = self.run_cli("add", "--quiet", path)
+        self.assertEqual(code, 0)
+        with SnippetLibrary(self.base_dir) as library:
+            self.assertEqual([snippet['title'] for snippet in library.snippets], ["hello"])
+
+
+if __name__ == '__main__':
+    unittest.main()
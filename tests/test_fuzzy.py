@@ -0,0 +1,32 @@
+import unittest
+
+from snippet_core.fuzzy import FuzzyIndex
+
+TITLES = ["binary search", "binary tree", "bubble sort", "merge sort", "quick sort",
+          "linked list", "search a sorted array", "binary heap", "merge intervals"]
+
+
+class FuzzySearchTest(unittest.TestCase):
+    def setUp(self):
+        self.fuzzy = FuzzyIndex({'id': doc_id, 'title': title, 'filename': f"{doc_id}.py", 'tags': []}
+                                for doc_id, title in enumerate(TITLES, 1))
+
+    def titles(self, results):
+        return [TITLES[doc_id - 1] for doc_id, score in results]
+
+    def test_transpositions_and_typos_match(self):
+        self.assertEqual(self.titles(self.fuzzy.search(["bianry", "serach"])), ["binary search"])
+        self.assertEqual(self.titles(self.fuzzy.search(["mrege"]))[0:2], ["merge sort", "merge intervals"])
+        self.assertEqual(self.fuzzy.search(["xyzzy"]), [])
+
+    def test_prefix_of_a_typo(self):
+        self.assertIn("binary search", self.titles(self.fuzzy.search(["bianry", "sea"], prefix_last=True)))
+
+    def test_limit_returns_the_top_of_the_full_ranking(self):
+        full = self.fuzzy.search(["sorrt"])
+        self.assertGreater(len(full), 2)
+        self.assertEqual(self.fuzzy.search(["sorrt"], limit=2), full[:2])
+
+
+if __name__ == '__main__':
+    unittest.main()
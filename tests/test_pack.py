@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+
+from snippet_core import SnippetLibrary
+from snippet_core.pack import PackWriter
+
+
+class PackImportTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = self._tmp.name
+        self.base_dir = os.path.join(self.root, "Code_Snippets")
+        self.library = SnippetLibrary(self.base_dir)
+
+    def tearDown(self):
+        self.library.close()
+        self._tmp.cleanup()
+
+    def write_pack(self, **fields):
+        """A pack with one Python snippet whose record carries fields"""
+        source = os.path.join(self.root, "source.py")
+        with open(source, 'w', encoding='utf-8') as f:
+            f.write("print('packed')\n")
+        path = os.path.join(self.root, "crafted.snippack")
+        record = {"title": "packed", "language": "Python", "filename": "packed.py",
+                  "filepath": source, "tags": []}
+        record.update(fields)
+        with PackWriter(path, 1) as writer:
+            writer.add(record)
+        return path
+
+    def files_outside_library(self):
+        return sorted(name for name in os.listdir(self.root)
+                      if name not in ("Code_Snippets", "source.py", "crafted.snippack"))
+
+    def test_relative_filename_stays_in_language_folder(self):
+        result = self.library.import_pack(self.write_pack(filename="../../../outside_pwned.py"))
+        self.assertEqual(self.files_outside_library(), [])
+        [snippet] = result.snippets
+        self.assertEqual(snippet['filepath'],
+                         os.path.join(self.base_dir, "Python", "outside_pwned.py"))
+
+    def test_absolute_filename_stays_in_language_folder(self):
+        target = os.path.join(self.root, "absolute.py")
+        result = self.library.import_pack(self.write_pack(filename=target))
+        self.assertFalse(os.path.exists(target))
+        [snippet] = result.snippets
+        self.assertEqual(os.path.dirname(snippet['filepath']), os.path.join(self.base_dir, "Python"))
+
+    def test_existing_file_is_not_replaced(self):
+        existing = self.library.create("packed", "print('mine')\n", "Python")
+        self.library.flush()
+        result = self.library.import_pack(self.write_pack())
+        with open(existing['filepath'], encoding='utf-8') as f:
+            self.assertEqual(f.read(), "print('mine')\n")
+        [snippet] = result.snippets
+        self.assertNotEqual(snippet['filepath'], existing['filepath'])
+
+    def test_crafted_content_hash_is_not_trusted(self):
+        outside = os.path.join(self.root, "secret.txt")
+        with open(outside, 'w', encoding='utf-8') as f:
+            f.write("secret\n")
+        result = self.library.import_pack(self.write_pack(content_hash="../../../secret.txt"))
+        [snippet] = result.snippets
+        self.assertEqual(self.library.read_code(snippet), "print('packed')\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
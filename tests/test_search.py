@@ -0,0 +1,82 @@
+import random
+import unittest
+
+from snippet_core import search
+from snippet_core.fuzzy import FuzzyIndex
+from snippet_core.search import IncrementalSearch, SearchIndex
+
+WORDS = ["sort", "search", "binary", "select", "string", "split", "stack", "sum",
+         "return", "result", "request", "read", "tree", "node", "merge", "list"]
+
+
+def build_index(count=400, seed=7):
+    """An index of count snippets made of random words, and the snippets"""
+    rng = random.Random(seed)
+    index = SearchIndex()
+    snippets = []
+    for doc_id in range(1, count + 1):
+        title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4)))
+        code = " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 40)))
+        snippets.append({'id': doc_id, 'title': title, 'tags': [rng.choice(WORDS)],
+                         'filename': f"{doc_id}.py", 'language': "Python"})
+        index.update(snippets[-1], code)
+    return index, snippets
+
+
+class SearchLimitTest(unittest.TestCase):
+    def setUp(self):
+        self.index, self.snippets = build_index()
+
+    def test_limit_returns_the_top_of_the_full_ranking(self):
+        for query in ["sort", "binary search", "re", "s", "tree node", "lang:python merge", '"binary search"']:
+            full = self.index.search(query, prefix_last=True)
+            for limit in (1, 10, 60):
+                self.assertEqual(self.index.search(query, limit=limit, prefix_last=True),
+                                 full[:limit], (query, limit))
+
+    def test_prefix_expansion_is_bounded_by_frequency(self):
+        original = search.MAX_PREFIX_POSTINGS
+        search.MAX_PREFIX_POSTINGS = 1
+        try:
+            terms = self.index.expand_prefix("s")
+            self.assertFalse(self.index.prefix_complete("s"))
+        finally:
+            search.MAX_PREFIX_POSTINGS = original
+        frequent = max((term for term in self.index.vocabulary if term.startswith("s")),
+                       key=lambda term: len(self.index.postings[term]))
+        self.assertEqual(terms, [frequent])
+
+    def test_typing_matches_a_fresh_search(self):
+        session = IncrementalSearch(self.index)
+        typed = "binary sea"
+        for end in range(1, len(typed) + 1):
+            query = typed[:end]
+            self.assertEqual(session.search(query, limit=20),
+                             IncrementalSearch(self.index).search(query, limit=20), query)
+
+    def test_limit_does_not_bring_in_typo_matches(self):
+        fuzzy = FuzzyIndex(self.snippets)
+        calls = []
+        search_query = fuzzy.search_query
+        fuzzy.search_query = lambda *args, **kwargs: calls.append(args) or search_query(*args, **kwargs)
+        session = IncrementalSearch(self.index, fuzzy)
+        self.assertEqual(len(session.search("sort", limit=5)), 5)
+        self.assertEqual(calls, [])
+        session.search("sortt", limit=5)
+        self.assertEqual(len(calls), 1)
+
+    def test_cached_frequencies_follow_edits(self):
+        self.index.warm()
+        self.index.search("sort")
+        self.index.update({'id': 1, 'title': "sort sort sort", 'tags': [], 'filename': "1.py",
+                           'language': "Python"}, "sort")
+        self.index.remove(2)
+        results = self.index.search("sort")
+        self.assertEqual(results[0][0], 1)
+        self.assertNotIn(2, [doc_id for doc_id, _ in results])
+        self.assertEqual({doc_id for doc_id, _ in results},
+                         set(self.index.postings["sort"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from urllib.parse import quote
+
+from snippet_core import SnippetLibrary
+from snippet_core.service import SnippetService, _is_loopback
+
+
+async def fetch(service, path):
+    """(status, JSON payload) of one GET request to a running service"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", service.port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1:{service.port}\r\n"
+                 f"Connection: close\r\n\r\n".encode('latin-1'))
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    status = int(head.split()[1])
+    if b"chunked" in head.lower():
+        body = b"".join(body.split(b"\r\n")[1::2])
+    return status, json.loads(body)
+
+
+class ServiceTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.library = SnippetLibrary(os.path.join(self._tmp.name, "Code_Snippets"))
+        for title in ("alpha", "beta", "gamma"):
+            self.library.create(title, f"print('{title}')\n", "Python")
+
+    def tearDown(self):
+        self.library.close()
+        self._tmp.cleanup()
+
+    def get(self, *paths):
+        """[(status, payload)] for GET requests made one after another"""
+        async def run():
+            service = SnippetService(self.library, "127.0.0.1", 0)
+            await service.start()
+            try:
+                return [await fetch(service, path) for path in paths]
+            finally:
+                await service.stop()
+        return asyncio.run(run())
+
+    def test_pages_follow_the_cursor(self):
+        [(status, first)] = self.get("/snippets?sort=title&limit=2")
+        self.assertEqual(status, 200)
+        self.assertEqual([snippet['title'] for snippet in first['snippets']], ["alpha", "beta"])
+        [(status, second)] = self.get("/snippets?sort=title&limit=2&after=" + quote(first['next']))
+        self.assertEqual(status, 200)
+        self.assertEqual([snippet['title'] for snippet in second['snippets']], ["gamma"])
+        self.assertIsNone(second['next'])
+
+    def test_malformed_cursor_is_a_bad_request(self):
+        cursors = ["5", '{"a": 1}', '"alpha"', "null", "[]", '["alpha"]', '["alpha", 1, 2]',
+                   '[1, 2]', '["alpha", "1"]', '["alpha", true]', '[["alpha"], 1]', "not json"]
+        responses = self.get(*(f"/snippets?sort=title&after={quote(cursor)}" for cursor in cursors))
+        for cursor, (status, payload) in zip(cursors, responses):
+            self.assertEqual(status, 400, cursor)
+            self.assertIn("error", payload)
+        [(status, payload)] = self.get("/snippets?sort=language&after=" + quote('["alpha", 1]'))
+        self.assertEqual(status, 400)
+
+    def test_only_loopback_peers_are_served(self):
+        self.assertTrue(_is_loopback(("127.0.0.1", 50000)))
+        self.assertTrue(_is_loopback(("::1", 50000, 0, 0)))
+        self.assertTrue(_is_loopback(("::ffff:127.0.0.1", 50000, 0, 0)))
+        self.assertFalse(_is_loopback(("192.168.1.20", 50000)))
+        self.assertFalse(_is_loopback(("::ffff:10.0.0.1", 50000, 0, 0)))
+        self.assertFalse(_is_loopback(None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from snippet_core import SnippetLibrary, storage
+from snippet_core.storage import JsonStorage
+
+
+def titles(backend):
+    return sorted(snippet['title'] for snippet in backend.load_all())
+
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.base_dir = self._tmp.name
+        self.journal_path = os.path.join(self.base_dir, storage.JOURNAL_FILENAME)
+        self.snapshot_path = os.path.join(self.base_dir, storage.METADATA_FILENAME)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def open(self):
+        backend = JsonStorage(self.base_dir)
+        self.addCleanup(backend.close)
+        return backend
+
+    def test_torn_last_line_is_dropped(self):
+        backend = self.open()
+        backend.insert_many([{'title': "one", 'tags': []}, {'title': "two", 'tags': []}])
+        backend.close()
+        good_size = os.path.getsize(self.journal_path)
+        with open(self.journal_path, 'ab') as f:
+            f.write(b'{"put":[{"id":3,"title":"thr')
+
+        backend = self.open()
+        self.assertEqual(titles(backend), ["one", "two"])
+        self.assertEqual(os.path.getsize(self.journal_path), good_size)
+        # New records follow a clean line and survive the next load
+        backend.insert({'title': "three", 'tags': []})
+        backend.close()
+        self.assertEqual(titles(self.open()), ["one", "three", "two"])
+
+    def test_complete_record_without_newline_is_dropped(self):
+        backend = self.open()
+        backend.insert({'title': "one", 'tags': []})
+        backend.close()
+        with open(self.journal_path, 'ab') as f:
+            f.write(b'{"delete":[1]}')
+        self.assertEqual(titles(self.open()), ["one"])
+
+    def test_appends_leave_compaction_to_the_caller(self):
+        with mock.patch.object(storage, "JOURNAL_COMPACT_SIZE", 200):
+            backend = self.open()
+            for number in range(10):
+                backend.insert({'title': f"snippet {number}", 'tags': []})
+            self.assertFalse(os.path.exists(self.snapshot_path))
+            self.assertTrue(backend.needs_compaction())
+            backend.compact()
+            self.assertFalse(backend.needs_compaction())
+        self.assertEqual(len(titles(self.open())), 10)
+
+    def test_crash_before_the_journal_is_emptied_loses_nothing(self):
+        backend = self.open()
+        backend.insert_many([{'title': "one", 'tags': []}, {'title': "two", 'tags': []}])
+        backend.delete(1)
+        with open(self.journal_path, 'rb') as f:
+            journal = f.read()
+        backend.compact()
+        backend.close()
+        # As if the process died after replacing the snapshot but before the truncate
+        with open(self.journal_path, 'wb') as f:
+            f.write(journal)
+        backend = self.open()
+        self.assertEqual(titles(backend), ["two"])
+        self.assertEqual(backend.reserve_ids(1), (3, 3))
+
+    def test_library_compacts_after_the_write(self):
+        with mock.patch.object(storage, "JOURNAL_COMPACT_SIZE", 2000):
+            with SnippetLibrary(os.path.join(self.base_dir, "library"), "json") as library:
+                for number in range(20):
+                    library.create(f"snippet {number}", f"print({number})\n", "Python", [])
+                    library.flush()
+                journal_path = os.path.join(library.base_dir, storage.JOURNAL_FILENAME)
+                self.assertLess(os.path.getsize(journal_path), 2000)
+            with SnippetLibrary(os.path.join(self.base_dir, "library"), "json") as library:
+                self.assertEqual(len(library.snippets), 20)
+
+
+if __name__ == '__main__':
+    unittest.main()